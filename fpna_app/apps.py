@@ -3,4 +3,11 @@ from django.apps import AppConfig
 
 class FpnaAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'fpna_app'
\ No newline at end of file
+    name = 'fpna_app'
+
+    def ready(self):
+        from django.core import checks
+
+        from .layout import layout_files_check, layout_names_check
+        checks.register(layout_files_check)
+        checks.register(layout_names_check, checks.Tags.database)
@@ -0,0 +1,157 @@
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from .cache import report_cache, report_key
+from .db import _call_sql, join_monthly_parts, monthly_accounts_parts, report_alias, report_function
+from .timing import record_query
+
+# Async counterparts of the db.py fetches, for the async views (FPNA_ASYNC_VIEWS).
+# They run on psycopg 3 through a bounded AsyncConnectionPool, so a worker
+# waiting on Postgres for one user keeps serving the others. Results share
+# report_cache with the sync functions, and follow the same replica routing.
+
+_pools = {}
+_pool_loop = None
+_pool_lock = None
+
+
+# DATABASES OPTIONS that Django interprets itself rather than passing to libpq
+DJANGO_ONLY_OPTIONS = {"pool", "isolation_level", "server_side_binding", "assume_role"}
+
+
+def _conninfo(alias=DEFAULT_DB_ALIAS):
+    """
+    libpq connection string of database `alias`, including its OPTIONS
+    (sslmode, options, connect_timeout, ...) so these connections are set up
+    like Django's own
+    """
+    from psycopg.conninfo import make_conninfo
+
+    db = settings.DATABASES[alias]
+    options = {
+        key: value for key, value in db.get("OPTIONS", {}).items()
+        if key not in DJANGO_ONLY_OPTIONS
+    }
+    return make_conninfo(
+        dbname=db.get("NAME") or None,
+        user=db.get("USER") or None,
+        password=db.get("PASSWORD") or None,
+        host=db.get("HOST") or None,
+        port=str(db["PORT"]) if db.get("PORT") else None,
+        **options,
+    )
+
+
+async def get_pool(alias=DEFAULT_DB_ALIAS):
+    """
+    The worker's AsyncConnectionPool for database `alias`, opened on first
+    use: FPNA_ASYNC_POOL_MIN_SIZE to FPNA_ASYNC_POOL_MAX_SIZE connections
+    (FPNA_ASYNC_REPLICA_POOL_MAX_SIZE for the replica).
+
+    The pools belong to the event loop that opened them, i.e. the ASGI
+    server's loop; under WSGI every request runs on a fresh loop, which is an
+    error.
+    """
+    global _pool_loop, _pool_lock
+    from psycopg_pool import AsyncConnectionPool
+
+    loop = asyncio.get_running_loop()
+    if _pool_loop is not None and _pool_loop is not loop:
+        raise RuntimeError("The async database pool needs a single event loop; serve FPNA_ASYNC_VIEWS over ASGI")
+    pool = _pools.get(alias)
+    if pool is not None:
+        return pool
+    if _pool_lock is None:
+        _pool_lock = asyncio.Lock()
+    async with _pool_lock:
+        if alias not in _pools:
+            max_size = getattr(settings, "FPNA_ASYNC_POOL_MAX_SIZE", 10)
+            if alias != DEFAULT_DB_ALIAS:
+                max_size = getattr(settings, "FPNA_ASYNC_REPLICA_POOL_MAX_SIZE", max_size)
+            pool = AsyncConnectionPool(
+                _conninfo(alias),
+                min_size=min(getattr(settings, "FPNA_ASYNC_POOL_MIN_SIZE", 1), max_size),
+                max_size=max_size,
+                timeout=getattr(settings, "FPNA_ASYNC_POOL_TIMEOUT", 30),
+                # psycopg prepares statements server-side itself; 0 means from the first run
+                kwargs={"prepare_threshold": 0 if getattr(settings, "FPNA_PREPARE_STATEMENTS", True) else None},
+                open=False,
+            )
+            await pool.open()
+            _pools[alias], _pool_loop = pool, loop
+    return _pools[alias]
+
+
+async def _report_alias():
+    """
+    db.report_alias() for async callers; its replica lag check queries
+    through Django, so it runs in a thread unless there is no replica
+    """
+    if getattr(settings, "FPNA_REPORT_DATABASE", DEFAULT_DB_ALIAS) == DEFAULT_DB_ALIAS:
+        return DEFAULT_DB_ALIAS
+    return await sync_to_async(report_alias)()
+
+
+async def _execute(sql, params):
+    """
+    (column names, row tuples) of one statement run on a pooled connection to
+    the database reports currently read from
+    """
+    pool = await get_pool(await _report_alias())
+    async with pool.connection() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(sql, params)
+            columns = [col.name for col in cursor.description]
+            return columns, await cursor.fetchall()
+
+
+async def _afetch(function, params):
+    """
+    Async db._fetch: same rows, same cache entries
+    """
+    key = report_key(function, *params)
+    hit, rows = report_cache.get(key)
+    if hit:
+        return rows
+    started = time.perf_counter()
+    columns, tuples = await _execute(_call_sql(function), params)
+    record_query(function, params, len(tuples), started)
+    rows = [dict(zip(columns, row)) for row in tuples]
+    report_cache.set(key, rows, report_cache.ttl_for(params[2], params[3]))
+    return rows
+
+
+async def afetch_actual_metrics(start_year, start_period, end_year, end_period, company_ids=None, metric_names=None):
+    return await _afetch(report_function("actual_metrics"),
+                         [start_year, start_period, end_year, end_period, company_ids, metric_names])
+
+
+async def afetch_actual_accounts(start_year, start_period, end_year, end_period, company_ids=None, components=None):
+    return await _afetch(report_function("actual_accounts"),
+                         [start_year, start_period, end_year, end_period, company_ids, components])
+
+
+async def afetch_monthly_accounts(start_year, start_period, end_year, end_period, company_ids=None, components=None):
+    """
+    Async db.fetch_monthly_accounts
+    """
+    parts, query = monthly_accounts_parts(start_year, start_period, end_year, end_period,
+                                          company_ids, components)
+    rows = []
+    if query is not None:
+        sql, params = query
+        started = time.perf_counter()
+        _, rows = await _execute(sql, params)
+        record_query("monthly_accounts", params, len(rows), started)
+    return join_monthly_parts(parts, rows)
+
+
+def pool_stats():
+    """
+    psycopg_pool statistics of the worker's pools by alias ({} before first use)
+    """
+    return {alias: pool.get_stats() for alias, pool in _pools.items()}
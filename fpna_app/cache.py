@@ -0,0 +1,142 @@
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from datetime import date
+
+from django.conf import settings
+
+# (year, month) of the period the current request treats as open. Set per
+# request by ReportPeriodMiddleware from the session's current_year /
+# current_month; falls back to today's date outside a request.
+current_period = ContextVar("current_period", default=None)
+
+
+def get_current_period():
+    period = current_period.get()
+    if period is None:
+        today = date.today()
+        period = (today.year, today.month)
+    return period
+
+
+def is_closed_range(end_year, end_period):
+    """
+    True if a half-open (year, period) range ends before the current period,
+    i.e. every period it covers is closed and its numbers no longer change
+    """
+    return (end_year, end_period) <= get_current_period()
+
+
+def report_key(function, start_year, start_period, end_year, end_period, company_ids=None, names=None):
+    """
+    Cache key for one finance.* call
+    """
+    return (
+        function,
+        start_year, start_period, end_year, end_period,
+        tuple(company_ids) if company_ids is not None else None,
+        tuple(names) if names is not None else None,
+    )
+
+
+class ReportCache:
+    """
+    Size-bounded LRU cache with a per-entry TTL and hit/miss counters.
+
+    Values are shared between callers and must not be mutated.
+    """
+
+    def __init__(self, max_entries, closed_ttl, open_ttl, invalidated_open_ttl=None):
+        self.max_entries = max_entries
+        self.closed_ttl = closed_ttl
+        self.open_ttl = open_ttl
+        self.invalidated_open_ttl = invalidated_open_ttl if invalidated_open_ttl is not None else open_ttl
+        # The thread evicting changed entries (fpna_app.invalidation), if any
+        self.invalidator = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Return (True, value) on a fresh hit, (False, None) otherwise
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def contains(self, key):
+        """
+        True if `key` has a fresh entry; unlike get() it leaves the LRU order
+        and counters alone
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[0] > time.monotonic()
+
+    def set(self, key, value, ttl):
+        if self.max_entries <= 0 or ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def ttl_for(self, end_year, end_period):
+        """
+        Closed ranges keep closed_ttl. Open ones keep open_ttl, or
+        invalidated_open_ttl while an invalidation thread evicts them as
+        their data changes.
+        """
+        if is_closed_range(end_year, end_period):
+            return self.closed_ttl
+        invalidator = self.invalidator
+        if invalidator is not None and invalidator.is_alive():
+            return self.invalidated_open_ttl
+        return self.open_ttl
+
+    def invalidate(self, predicate=None):
+        """
+        Drop every entry whose key matches `predicate`, or all entries.
+        Returns the number of entries removed.
+        """
+        with self._lock:
+            if predicate is None:
+                removed = len(self._entries)
+                self._entries.clear()
+                return removed
+            stale = [key for key in self._entries if predicate(key)]
+            for key in stale:
+                del self._entries[key]
+            return len(stale)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+            }
+
+
+report_cache = ReportCache(
+    max_entries=getattr(settings, "FPNA_CACHE_MAX_ENTRIES", 512),
+    closed_ttl=getattr(settings, "FPNA_CACHE_CLOSED_TTL", 24 * 60 * 60),
+    open_ttl=getattr(settings, "FPNA_CACHE_OPEN_TTL", 60),
+    invalidated_open_ttl=getattr(settings, "FPNA_CACHE_INVALIDATED_OPEN_TTL", None),
+)
@@ -0,0 +1,60 @@
+import numpy as np
+
+KEY_COLUMNS = ("ref_name", "metric_name")
+
+
+class ColumnarResult:
+    """
+    A result set stored column-wise (derive_report builds them).
+
+    Numeric columns are array('d') float64 arrays (NaN for no value), and
+    everything else is a plain list. Rows are addressed by their ref_name /
+    metric_name through a name -> position map built once, so lookups are
+    O(1) and no per-row dict is ever allocated.
+    """
+
+    __slots__ = ("columns", "column_index", "key_column", "key_index", "_data", "_positions")
+
+    def __init__(self, columns, data):
+        self.columns = list(columns)
+        self.column_index = {name: i for i, name in enumerate(self.columns)}
+        self._data = data
+        self.key_column = next((name for name in KEY_COLUMNS if name in self.column_index), None)
+        keys = self._data[self.column_index[self.key_column]] if self.key_column else []
+        self.key_index = {key: i for i, key in enumerate(keys)}
+        self._positions = {}
+
+    def __len__(self):
+        return len(self.key_index) if self.key_column else (len(self._data[0]) if self._data else 0)
+
+    def __contains__(self, key):
+        return key in self.key_index
+
+    def keys(self):
+        return self.key_index.keys()
+
+    def column(self, name):
+        """
+        The stored column itself (array or list), not a copy
+        """
+        return self._data[self.column_index[name]]
+
+    def numpy(self, name):
+        """
+        A numeric column as a NumPy view sharing the array's buffer (no copy)
+        """
+        column = self.column(name)
+        return np.frombuffer(column, dtype=np.float64)
+
+    def positions(self, index):
+        """
+        For a name -> position map (e.g. MetricEngine.account_index), an int64
+        array giving each row's position in that map, or -1 if absent.
+        Memoised per map, since the same engine is applied to many results.
+        """
+        cached = self._positions.get(id(index))
+        if cached is None or cached[0] is not index:
+            keys = self._data[self.column_index[self.key_column]] if self.key_column else []
+            cached = (index, np.fromiter((index.get(key, -1) for key in keys), dtype=np.int64, count=len(keys)))
+            self._positions[id(index)] = cached
+        return cached[1]
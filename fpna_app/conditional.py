@@ -0,0 +1,148 @@
+import hashlib
+import threading
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+
+from .db import note_primary_write
+from .reference import get_reference_data
+
+# The highest uniqueid of each table (index-only with gl_txn_raw_unique and
+# budget_uniqueid, which cache_invalidation --create installs) moves whenever
+# new ledger or budget rows are appended, and the change sequence the cache
+# invalidation triggers advance, when installed, on any other write
+LEDGER_VERSION_SQL = """
+    SELECT
+      (SELECT max(uniqueid) FROM public.gl_txn_raw),
+      (SELECT max(uniqueid) FROM public.budget),
+      to_regclass('public.fpna_change_seq') IS NOT NULL
+"""
+CHANGE_SEQUENCE_SQL = "SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM public.fpna_change_seq"
+
+# The rollup and resolved tables lag gl_txn_raw until they are refreshed, so
+# with those sources the report follows their watermark instead
+WATERMARK_VERSION_SQL = """
+    SELECT last_uniqueid, refreshed_at FROM public.rollup_watermark WHERE name = %s
+"""
+
+_version = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def _current_version():
+    from . import resolved, rollup
+
+    source = getattr(settings, "FPNA_ACTUALS_SOURCE", "ledger")
+    watermark_name = {"rollup": rollup.WATERMARK_NAME, "resolved": resolved.WATERMARK_NAME}.get(source)
+    with connection.cursor() as cursor:
+        cursor.execute(LEDGER_VERSION_SQL)
+        ledger, budget, has_sequence = cursor.fetchone()
+        version = (ledger, budget)
+        if has_sequence:
+            cursor.execute(CHANGE_SEQUENCE_SQL)
+            row = cursor.fetchone()
+            version += (row[0] if row else None,)
+        else:
+            version += (None,)
+        if watermark_name:
+            cursor.execute(WATERMARK_VERSION_SQL, [watermark_name])
+            version += (source, cursor.fetchone())
+    return version
+
+
+def data_version():
+    """
+    Version of the ledger and budget data reports are computed from,
+    re-read at most every FPNA_DATA_VERSION_CHECK_INTERVAL seconds
+    """
+    global _version, _checked_at
+    interval = getattr(settings, "FPNA_DATA_VERSION_CHECK_INTERVAL", 5)
+    with _lock:
+        now = time.monotonic()
+        if _version is None or now - _checked_at >= interval:
+            version = _current_version()
+            if _version is not None and version != _version:
+                # Keep reports on the primary until the replica has the new rows
+                note_primary_write()
+            _version = version
+            _checked_at = now
+        return _version
+
+
+def invalidate_data_version():
+    """
+    Force a fresh version read on the next access
+    """
+    global _checked_at
+    with _lock:
+        _checked_at = 0.0
+
+
+def report_etag(name, *parts):
+    """
+    ETag of report `name` for the request-specific `parts` (company, periods)
+    at the current data, reference data and code version
+    """
+    key = (
+        name,
+        parts,
+        data_version(),
+        get_reference_data().version,
+        getattr(settings, "FPNA_ETAG_VERSION", ""),
+    )
+    return quote_etag(hashlib.sha1(repr(key).encode()).hexdigest())
+
+
+def conditional_report(name, etag_parts):
+    """
+    Decorator answering If-None-Match with a 304 before the view (and so any
+    finance.* query) runs. `etag_parts(request, *args, **kwargs)` returns what
+    the response depends on besides the data, e.g. (company, period).
+
+    Works on sync and async views; the ETag is computed in a thread for the
+    latter, since it reads the session and database synchronously. Disabled
+    with FPNA_REPORT_ETAGS=0.
+    """
+
+    def decorator(view):
+        def etag(request, *args, **kwargs):
+            if not getattr(settings, "FPNA_REPORT_ETAGS", True) or request.method not in ("GET", "HEAD"):
+                return None
+            # Pages render {% csrf_token %}, so a rotated CSRF secret (e.g. on
+            # login) must not revalidate a copy carrying the old token
+            csrf_secret = request.META.get("CSRF_COOKIE")
+            return report_etag(name, *etag_parts(request, *args, **kwargs), csrf_secret)
+
+        def finish(response, res_etag):
+            if res_etag:
+                response.headers.setdefault("ETag", res_etag)
+                # Per-session content: browsers only, and always revalidated
+                patch_cache_control(response, private=True, no_cache=True)
+            return response
+
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def inner(request, *args, **kwargs):
+                res_etag = await sync_to_async(etag)(request, *args, **kwargs)
+                response = get_conditional_response(request, etag=res_etag)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                return finish(response, res_etag)
+        else:
+            @wraps(view)
+            def inner(request, *args, **kwargs):
+                res_etag = etag(request, *args, **kwargs)
+                response = get_conditional_response(request, etag=res_etag)
+                if response is None:
+                    response = view(request, *args, **kwargs)
+                return finish(response, res_etag)
+
+        return inner
+
+    return decorator
@@ -1,11 +1,12 @@
-from .db import fetch_companies
+from .reference import get_companies
 
 def company_context(request):
     """
     Context processor to add company data to all templates
     """
     try:
-        companies = fetch_companies()
+        # Served from the process-wide reference cache, not a query per render
+        companies = get_companies()
         
         # Get selected company from session, default to AFP
         selected_company = request.session.get('selected_company', 'AFP')
@@ -1,84 +1,597 @@
-from django.db import connection
+import contextvars
+import logging
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connection, connections
+
+from .cache import get_current_period, report_cache, report_key
+from .derived import PeriodMatrix, period_range
+from .timing import record_query
+
+logger = logging.getLogger(__name__)
+
+# finance.* set-returning functions addressable by report kind. Every one of
+# them takes (start_year, start_period, end_year, end_period, company_ids,
+# components/metric_names) with a half-open period range.
+REPORT_FUNCTIONS = {
+    "actual_accounts": "finance.actual_account",
+    "actual_metrics": "finance.actual_metric",
+    "budget_accounts": "finance.budget_account",
+    "budget_metrics": "finance.budget_metric",
+    "budget_vs_actual_accounts": "finance.budget_vs_actual_account",
+    "budget_vs_actual_metrics": "finance.budget_vs_actual_metric",
+    "actual_accounts_average": "finance.actual_account_average",
+    "actual_metrics_average": "finance.actual_metric_average",
+}
+
+# Drop-in replacements for the actual kinds that read public.gl_monthly_rollup
+# (see fpna_app/rollup.py) instead of aggregating gl_txn_raw. Used when
+# FPNA_ACTUALS_SOURCE is "rollup".
+ROLLUP_FUNCTIONS = {
+    "actual_accounts": "finance.rollup_actual_account",
+    "actual_metrics": "finance.rollup_actual_metric",
+    "actual_accounts_average": "finance.rollup_actual_account_average",
+    "actual_metrics_average": "finance.rollup_actual_metric_average",
+}
+
+# Actual kinds served from public.gl_txn_resolved (see fpna_app/resolved.py)
+# when FPNA_ACTUALS_SOURCE is "resolved"; averages keep the ledger functions.
+RESOLVED_FUNCTIONS = {
+    "actual_accounts": "finance.resolved_actual_account",
+    "actual_metrics": "finance.resolved_actual_metric",
+}
+
+ACTUALS_SOURCE_FUNCTIONS = {"rollup": ROLLUP_FUNCTIONS, "resolved": RESOLVED_FUNCTIONS}
+
+def report_function(kind):
+    """
+    Name of the finance.* function that serves a report kind
+    """
+    source_functions = ACTUALS_SOURCE_FUNCTIONS.get(getattr(settings, "FPNA_ACTUALS_SOURCE", "ledger"), {})
+    if kind in source_functions:
+        return source_functions[kind]
+    try:
+        return REPORT_FUNCTIONS[kind]
+    except KeyError:
+        raise ValueError(f"Unknown report kind: {kind}")
+
+
+# Replay lag of a streaming replica in seconds: 0 once it has replayed all
+# the WAL it received, NULL before it has replayed anything. A primary has none.
+REPLICA_LAG_SQL = """
+    SELECT CASE
+      WHEN NOT pg_is_in_recovery() THEN 0
+      WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+      ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+_replica_lock = threading.Lock()
+_replica_state = {"lag": None, "checked_at": None, "replayed_at": None, "last_write": None}
+
+
+def note_primary_write():
+    """
+    Record that new data was just seen on the primary (a load, a NOTIFY, a
+    new data version). Reports read from the primary until the replica is
+    known to have replayed past this moment.
+    """
+    with _replica_lock:
+        _replica_state["last_write"] = time.monotonic()
+        _replica_state["checked_at"] = None
+
+
+def _replica_lag(alias):
+    """
+    Replay lag of `alias` in seconds, re-measured at most every
+    FPNA_REPLICA_LAG_CHECK_INTERVAL seconds; None if unknown or unreachable
+    """
+    interval = getattr(settings, "FPNA_REPLICA_LAG_CHECK_INTERVAL", 5)
+    with _replica_lock:
+        checked_at = _replica_state["checked_at"]
+        if checked_at is not None and time.monotonic() - checked_at < interval:
+            return _replica_state["lag"]
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(REPLICA_LAG_SQL)
+            lag = cursor.fetchone()[0]
+        lag = float(lag) if lag is not None else None
+    except Exception as e:
+        logger.warning("Read replica %s is unavailable, reading reports from the primary: %s", alias, e)
+        connections[alias].close()
+        lag = None
+    now = time.monotonic()
+    with _replica_lock:
+        _replica_state.update(lag=lag, checked_at=now, replayed_at=now - lag if lag is not None else None)
+    return lag
+
+
+def report_alias():
+    """
+    Database alias report reads go to: FPNA_REPORT_DATABASE (the read
+    replica) while its lag is at most FPNA_REPLICA_MAX_LAG seconds and it has
+    replayed past the last noticed primary write, the primary otherwise.
+    Sessions, reference data and loads always use the primary.
+    """
+    alias = getattr(settings, "FPNA_REPORT_DATABASE", DEFAULT_DB_ALIAS)
+    if alias == DEFAULT_DB_ALIAS:
+        return alias
+    lag = _replica_lag(alias)
+    if lag is None or lag > getattr(settings, "FPNA_REPLICA_MAX_LAG", 30):
+        return DEFAULT_DB_ALIAS
+    with _replica_lock:
+        last_write, replayed_at = _replica_state["last_write"], _replica_state["replayed_at"]
+    if last_write is not None and (replayed_at is None or replayed_at < last_write):
+        return DEFAULT_DB_ALIAS
+    return alias
+
+
+def replica_status():
+    alias = getattr(settings, "FPNA_REPORT_DATABASE", DEFAULT_DB_ALIAS)
+    with _replica_lock:
+        lag = _replica_state["lag"]
+    return {"report_database": alias, "lag": lag, "routing_to": report_alias()}
+
+
+def _call_sql(function):
+    return f"SELECT * FROM {function}(%s, %s, %s, %s, %s, %s)"
+
+
+# Server-side prepared finance.* calls, per raw DB-API connection. Pooled
+# connections outlive requests, so each call is parsed and planned once per
+# connection rather than once per request.
+_prepared = weakref.WeakKeyDictionary()
+_prepared_lock = threading.Lock()
+prepare_stats = {"prepared": 0, "executed": 0}
+
+
+def _prepared_call_sql(cursor, function):
+    """
+    SQL for one finance.* call on `cursor`'s connection: an EXECUTE of a
+    statement prepared on first use, or the plain call when
+    FPNA_PREPARE_STATEMENTS is off (e.g. behind PgBouncer in transaction mode)
+    """
+    if not getattr(settings, "FPNA_PREPARE_STATEMENTS", True) or cursor.db.vendor != "postgresql":
+        return _call_sql(function)
+    name = "fpna_" + function.replace(".", "_")
+    raw = cursor.db.connection
+    with _prepared_lock:
+        names = _prepared.setdefault(raw, set())
+        prepared = name in names
+    if not prepared:
+        cursor.execute(
+            f"PREPARE {name} (integer, integer, integer, integer, text[], text[]) AS "
+            f"SELECT * FROM {function}($1, $2, $3, $4, $5, $6)"
+        )
+        with _prepared_lock:
+            names.add(name)
+            prepare_stats["prepared"] += 1
+    with _prepared_lock:
+        prepare_stats["executed"] += 1
+    return f"EXECUTE {name}(%s, %s, %s, %s, %s, %s)"
+
+
+def pool_stats():
+    """
+    Checkout and wait counters of this worker's connection pool (psycopg_pool
+    get_stats(): requests_num, requests_wait_ms, pool_size, pool_available,
+    ...) plus prepared statement counts
+    """
+    stats = {}
+    pool = getattr(connection, "pool", None)
+    if pool is not None:
+        stats.update(pool.get_stats())
+    with _prepared_lock:
+        stats.update({f"statements_{key}": value for key, value in prepare_stats.items()})
+        stats["prepared_connections"] = len(_prepared)
+    return stats
+
+
+class QueryTimeoutError(Exception):
+    """
+    Raised when a map_parallel call does not finish within its timeout
+    """
+
+
+# Server-side statement_timeout (seconds) of the report statements run by the
+# current map_parallel call; None outside one
+_statement_timeout = contextvars.ContextVar("fpna_statement_timeout", default=None)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _query_executor():
+    """
+    The process-wide pool map_parallel runs on. Each thread checks out its
+    own connection, so FPNA_QUERY_WORKERS also caps the extra connections a
+    worker's parallel calls take from its pool.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "FPNA_QUERY_WORKERS", 4),
+                thread_name_prefix="fpna-query",
+            )
+        return _executor
+
+
+def _execute(cursor, sql, params):
+    """
+    cursor.execute, under the statement_timeout of the map_parallel call
+    it runs in, if any
+    """
+    timeout = _statement_timeout.get()
+    if not timeout or cursor.db.vendor != "postgresql":
+        cursor.execute(sql, params)
+        return
+    cursor.execute(f"SET statement_timeout = {int(timeout * 1000)}")
+    try:
+        cursor.execute(sql, params)
+    finally:
+        cursor.execute("RESET statement_timeout")
+
+
+def _call_in_worker(fn, item, timeout):
+    close_old_connections()
+    token = _statement_timeout.set(timeout)
+    try:
+        return fn(item)
+    finally:
+        _statement_timeout.reset(token)
+        # Hand pooled connections back instead of idling on them between calls
+        for conn in connections.all(initialized_only=True):
+            if getattr(conn, "pool", None) is not None:
+                conn.close()
+
+
+def _result(future, timeout):
+    try:
+        # A little slack over the server-side timeout, which fires first
+        return future.result(timeout=timeout + 1 if timeout else None)
+    except FutureTimeoutError:
+        raise QueryTimeoutError(f"Report query did not finish within {timeout}s") from None
+
+
+def map_parallel(fn, items, timeout=None):
+    """
+    Yield fn(item) for each of `items`, in order, running up to
+    FPNA_QUERY_WORKERS calls at once on a process-wide thread pool.
+
+    Each call's report statements get a server-side statement_timeout of
+    `timeout` (FPNA_QUERY_TIMEOUT) seconds, and a call still running that
+    long after it is waited for raises QueryTimeoutError. At most
+    FPNA_QUERY_WORKERS results are computed ahead of the consumer. The first
+    error is re-raised and the calls not yet started are cancelled.
+    """
+    if timeout is None:
+        timeout = getattr(settings, "FPNA_QUERY_TIMEOUT", None)
+    workers = getattr(settings, "FPNA_QUERY_WORKERS", 4)
+    executor = _query_executor()
+    pending = deque()
+    try:
+        for item in items:
+            # Each call runs in a copy of the caller's context, so workers see
+            # the request's current period and timings
+            pending.append(executor.submit(contextvars.copy_context().run, _call_in_worker, fn, item, timeout))
+            if len(pending) >= workers:
+                yield _result(pending.popleft(), timeout)
+        while pending:
+            yield _result(pending.popleft(), timeout)
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _fetch(function, params):
+    """
+    Run a finance.* function and return its rows as a list of dicts.
+
+    Results are served from report_cache when possible; closed periods are
+    kept for FPNA_CACHE_CLOSED_TTL and open ones for FPNA_CACHE_OPEN_TTL.
+    """
+    key = report_key(function, *params)
+    hit, rows = report_cache.get(key)
+    if hit:
+        return rows
+    started = time.perf_counter()
+    with connections[report_alias()].cursor() as cursor:
+        _execute(cursor, _prepared_call_sql(cursor, function), params)
+        columns = [col[0] for col in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    record_query(function, params, len(rows), started)
+    report_cache.set(key, rows, report_cache.ttl_for(params[2], params[3]))
+    return rows
+
 
 def fetch_actual_metrics(start_year, start_period, end_year, end_period, company_ids=None, metric_names=None):
     """
     Fetch actual metrics data using the finance.actual_metric function
+    (finance.rollup_actual_metric when FPNA_ACTUALS_SOURCE is "rollup")
     """
-    with connection.cursor() as cursor:
-        cursor.execute("SELECT * FROM finance.actual_metric(%s, %s, %s, %s, %s, %s)", 
-                      [start_year, start_period, end_year, end_period, company_ids, metric_names])
-        columns = [col[0] for col in cursor.description]
-        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    return _fetch(report_function("actual_metrics"),
+                  [start_year, start_period, end_year, end_period, company_ids, metric_names])
 
 def fetch_actual_accounts(start_year, start_period, end_year, end_period, company_ids=None, components=None):
     """
     Fetch actual account data using the finance.actual_account function
+    (finance.rollup_actual_account when FPNA_ACTUALS_SOURCE is "rollup")
     """
-    with connection.cursor() as cursor:
-        cursor.execute("SELECT * FROM finance.actual_account(%s, %s, %s, %s, %s, %s)", 
-                      [start_year, start_period, end_year, end_period, company_ids, components])
-        columns = [col[0] for col in cursor.description]
-        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    return _fetch(report_function("actual_accounts"),
+                  [start_year, start_period, end_year, end_period, company_ids, components])
 
 def fetch_budget_accounts(start_year, start_period, end_year, end_period, company_ids=None, components=None):
     """
     Fetch budget account data using the finance.budget_account function
     """
-    with connection.cursor() as cursor:
-        cursor.execute("SELECT * FROM finance.budget_account(%s, %s, %s, %s, %s, %s)", 
-                      [start_year, start_period, end_year, end_period, company_ids, components])
-        columns = [col[0] for col in cursor.description]
-        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    return _fetch(report_function("budget_accounts"),
+                  [start_year, start_period, end_year, end_period, company_ids, components])
 
 def fetch_budget_metrics(start_year, start_period, end_year, end_period, company_ids=None, metric_names=None):
     """
     Fetch budget metrics data using the finance.budget_metric function
     """
-    with connection.cursor() as cursor:
-        cursor.execute("SELECT * FROM finance.budget_metric(%s, %s, %s, %s, %s, %s)", 
-                      [start_year, start_period, end_year, end_period, company_ids, metric_names])
-        columns = [col[0] for col in cursor.description]
-        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    return _fetch(report_function("budget_metrics"),
+                  [start_year, start_period, end_year, end_period, company_ids, metric_names])
 
 def fetch_budget_vs_actual_accounts(start_year, start_period, end_year, end_period, company_ids=None, components=None):
     """
     Fetch budget vs actual account data using the finance.budget_vs_actual_account function
     """
-    with connection.cursor() as cursor:
-        cursor.execute("SELECT * FROM finance.budget_vs_actual_account(%s, %s, %s, %s, %s, %s)", 
-                      [start_year, start_period, end_year, end_period, company_ids, components])
-        columns = [col[0] for col in cursor.description]
-        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    return _fetch(report_function("budget_vs_actual_accounts"),
+                  [start_year, start_period, end_year, end_period, company_ids, components])
 
 def fetch_budget_vs_actual_metrics(start_year, start_period, end_year, end_period, company_ids=None, metric_names=None):
     """
     Fetch budget vs actual metrics data using the finance.budget_vs_actual_metric function
     """
-    with connection.cursor() as cursor:
-        cursor.execute("SELECT * FROM finance.budget_vs_actual_metric(%s, %s, %s, %s, %s, %s)", 
-                      [start_year, start_period, end_year, end_period, company_ids, metric_names])
-        columns = [col[0] for col in cursor.description]
-        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    return _fetch(report_function("budget_vs_actual_metrics"),
+                  [start_year, start_period, end_year, end_period, company_ids, metric_names])
 
 def fetch_actual_accounts_average(start_year, start_period, end_year, end_period, company_ids=None, components=None):
     """
     Fetch actual account average data using the finance.actual_account_average function
     """
-    with connection.cursor() as cursor:
-        cursor.execute("SELECT * FROM finance.actual_account_average(%s, %s, %s, %s, %s, %s)", 
-                      [start_year, start_period, end_year, end_period, company_ids, components])
-        columns = [col[0] for col in cursor.description]
-        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    return _fetch(report_function("actual_accounts_average"),
+                  [start_year, start_period, end_year, end_period, company_ids, components])
 
 def fetch_actual_metrics_average(start_year, start_period, end_year, end_period, company_ids=None, metric_names=None):
     """
     Fetch actual metrics average data using the finance.actual_metric_average function
     """
-    with connection.cursor() as cursor:
-        cursor.execute("SELECT * FROM finance.actual_metric_average(%s, %s, %s, %s, %s, %s)", 
-                      [start_year, start_period, end_year, end_period, company_ids, metric_names])
-        columns = [col[0] for col in cursor.description]
-        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    return _fetch(report_function("actual_metrics_average"),
+                  [start_year, start_period, end_year, end_period, company_ids, metric_names])
+
+
+# Per-month signed account values, actual and budget in one statement. The
+# actual arm reads gl_monthly_rollup or gl_txn_resolved instead when
+# FPNA_ACTUALS_SOURCE is "rollup" or "resolved".
+MONTHLY_ACTUAL_LEDGER_SQL = """
+    SELECT 'actual' AS source, m.account_name, g.postyear::int, g.postperiod::int,
+           SUM(g.amount_raw * m.erp_sign)
+    FROM public.gl_txn_raw g
+    JOIN public.gl_account_map m
+      ON g.gl_account::int4 <@ m.acct_range
+    WHERE (%(company_ids)s::text[] IS NULL OR g.companyid = ANY(%(company_ids)s))
+      AND (g.postyear, g.postperiod) >= (%(start_year)s, %(start_period)s)
+      AND (g.postyear, g.postperiod) <  (%(end_year)s, %(end_period)s)
+      AND (%(components)s::text[] IS NULL OR m.account_name = ANY(%(components)s))
+    GROUP BY m.account_name, g.postyear, g.postperiod
+"""
+MONTHLY_ACTUAL_ROLLUP_SQL = """
+    SELECT 'actual' AS source, r.account_name, r.postyear::int, r.postperiod::int, SUM(r.amount)
+    FROM public.gl_monthly_rollup r
+    WHERE (%(company_ids)s::text[] IS NULL OR r.companyid = ANY(%(company_ids)s))
+      AND (r.postyear, r.postperiod) >= (%(start_year)s, %(start_period)s)
+      AND (r.postyear, r.postperiod) <  (%(end_year)s, %(end_period)s)
+      AND (%(components)s::text[] IS NULL OR r.account_name = ANY(%(components)s))
+    GROUP BY r.account_name, r.postyear, r.postperiod
+"""
+MONTHLY_ACTUAL_RESOLVED_SQL = """
+    SELECT 'actual' AS source, t.account_name, t.postyear::int, t.postperiod::int, SUM(t.amount)
+    FROM public.gl_txn_resolved t
+    WHERE (%(company_ids)s::text[] IS NULL OR t.companyid = ANY(%(company_ids)s))
+      AND (t.postyear, t.postperiod) >= (%(start_year)s, %(start_period)s)
+      AND (t.postyear, t.postperiod) <  (%(end_year)s, %(end_period)s)
+      AND (%(components)s::text[] IS NULL OR t.account_name = ANY(%(components)s))
+    GROUP BY t.account_name, t.postyear, t.postperiod
+"""
+MONTHLY_ACTUAL_SQL = {"rollup": MONTHLY_ACTUAL_ROLLUP_SQL, "resolved": MONTHLY_ACTUAL_RESOLVED_SQL}
+MONTHLY_BUDGET_SQL = """
+    SELECT 'budget' AS source, m.account_name, b.year, b.period, SUM(b.amt1 * m.erp_sign)
+    FROM public.budget b
+    JOIN public.gl_account_map m
+      ON b.account::int4 <@ m.acct_range
+    WHERE (%(company_ids)s::text[] IS NULL OR b.companyid = ANY(%(company_ids)s))
+      AND (b.year, b.period) >= (%(start_year)s, %(start_period)s)
+      AND (b.year, b.period) <  (%(end_year)s, %(end_period)s)
+      AND (%(components)s::text[] IS NULL OR m.account_name = ANY(%(components)s))
+    GROUP BY m.account_name, b.year, b.period
+"""
+
+
+def monthly_accounts_query(start_year, start_period, end_year, end_period, company_ids=None, components=None):
+    """
+    (cache key, sql, params) of one monthly accounts statement
+    """
+    params = {
+        "start_year": start_year, "start_period": start_period,
+        "end_year": end_year, "end_period": end_period,
+        "company_ids": list(company_ids) if company_ids is not None else None,
+        "components": list(components) if components is not None else None,
+    }
+    source = getattr(settings, "FPNA_ACTUALS_SOURCE", "ledger")
+    key = report_key(f"monthly_accounts:{source}", start_year, start_period, end_year, end_period,
+                     company_ids, components)
+    actual_sql = MONTHLY_ACTUAL_SQL.get(source, MONTHLY_ACTUAL_LEDGER_SQL)
+    return key, f"{actual_sql} UNION ALL {MONTHLY_BUDGET_SQL}", params
+
+
+def monthly_accounts_ranges(start_year, start_period, end_year, end_period):
+    """
+    A half-open range split at the current period into its closed and open
+    parts (either may be missing). They are cached separately, so the
+    closed months last FPNA_CACHE_CLOSED_TTL however far the range reaches
+    into the open ones.
+    """
+    start, end = (start_year, start_period), (end_year, end_period)
+    split = min(max(start, get_current_period()), end)
+    return [start + split for start, split in ((start, split), (split, end)) if start < split] or [start + end]
+
+
+def monthly_accounts_parts(start_year, start_period, end_year, end_period, company_ids=None, components=None):
+    """
+    [(range, cache key, cached matrices or None)] of a fetch_monthly_accounts
+    call, one per monthly_accounts_ranges part, and the (sql, params) of the
+    one statement that fetches the parts not cached, or None; shared with the
+    async backend
+    """
+    parts = []
+    for part in monthly_accounts_ranges(start_year, start_period, end_year, end_period):
+        key, _, _ = monthly_accounts_query(*part, company_ids, components)
+        hit, matrices = report_cache.get(key)
+        parts.append((part, key, matrices if hit else None))
+    missing = [part for part, _, matrices in parts if matrices is None]
+    if not missing:
+        return parts, None
+    _, sql, params = monthly_accounts_query(*missing[0][:2], *missing[-1][2:], company_ids, components)
+    return parts, (sql, params)
+
+
+def join_monthly_parts(parts, rows):
+    """
+    The {"actual", "budget"} matrices of a whole range from its parts: the
+    cached ones as they are, the others built from `rows` and cached with
+    their own TTL
+    """
+    matrices = []
+    for (start_year, start_period, end_year, end_period), key, cached in parts:
+        if cached is None:
+            start, end = (start_year, start_period), (end_year, end_period)
+            cached = monthly_matrices([row for row in rows if start <= (row[2], row[3]) < end],
+                                      start_year, start_period, end_year, end_period)
+            report_cache.set(key, cached, report_cache.ttl_for(end_year, end_period))
+        matrices.append(cached)
+    return {
+        source: PeriodMatrix.concat([part[source] for part in matrices])
+        for source in ("actual", "budget")
+    }
+
+
+def is_monthly_accounts_cached(start_year, start_period, end_year, end_period, company_ids=None, components=None):
+    """
+    True if fetch_monthly_accounts would run no statement; leaves the cache
+    counters alone
+    """
+    return all(
+        report_cache.contains(monthly_accounts_query(*part, company_ids, components)[0])
+        for part in monthly_accounts_ranges(start_year, start_period, end_year, end_period)
+    )
+
+
+def monthly_matrices(rows, start_year, start_period, end_year, end_period):
+    """
+    {"actual": PeriodMatrix, "budget": PeriodMatrix} from
+    (source, account_name, year, period, value) rows
+    """
+    periods = period_range(start_year, start_period, end_year, end_period)
+    account_names = sorted({row[1] for row in rows})
+    return {
+        source: PeriodMatrix.from_rows(
+            (row[1:] for row in rows if row[0] == source), periods, account_names
+        )
+        for source in ("actual", "budget")
+    }
+
+
+def fetch_monthly_accounts(start_year, start_period, end_year, end_period, company_ids=None, components=None):
+    """
+    Per-month actual and budget account values over a half-open period range
+    (summed over the given companies).
+
+    Returns {"actual": PeriodMatrix, "budget": PeriodMatrix}; both share the
+    same account rows and period columns, so variance, averages and any
+    sub-range totals can be derived in memory (see fpna_app.derived). The
+    closed and open months are cached apart (see monthly_accounts_ranges);
+    whatever is missing is fetched in one statement.
+    """
+    parts, query = monthly_accounts_parts(start_year, start_period, end_year, end_period,
+                                          company_ids, components)
+    rows = []
+    if query is not None:
+        sql, params = query
+        started = time.perf_counter()
+        with connections[report_alias()].cursor() as cursor:
+            _execute(cursor, sql, params)
+            rows = cursor.fetchall()
+        record_query("monthly_accounts", params, len(rows), started)
+    return join_monthly_parts(parts, rows)
+
+def iter_account_transactions(account_name, start_year, start_period, end_year, end_period,
+                              company_ids=None, after=None, limit=500, chunk_size=100):
+    """
+    Stream the gl_txn_raw rows behind one account over a half-open period range
+    (read from gl_txn_resolved when FPNA_ACTUALS_SOURCE is "resolved").
+
+    Rows are ordered by (posting_date, uniqueid), undated rows last, and read
+    through a server-side cursor in chunks of `chunk_size`, so memory use does
+    not depend on how many transactions the account has. `after` is the
+    (posting_date or None, uniqueid) of the last row already shown (keyset
+    pagination); at most `limit` rows are returned. Yields lists of row dicts.
+    """
+    if getattr(settings, "FPNA_ACTUALS_SOURCE", "ledger") == "resolved":
+        source, account, amount = "public.gl_txn_resolved g", "g.account_name", "g.amount"
+    else:
+        source = "public.gl_txn_raw g JOIN public.gl_account_map m ON g.gl_account::int4 <@ m.acct_range"
+        account, amount = "m.account_name", "g.amount_raw * m.erp_sign"
+    conditions = [
+        f"{account} = %s",
+        "(g.postyear, g.postperiod) >= (%s, %s)",
+        "(g.postyear, g.postperiod) < (%s, %s)",
+    ]
+    params = [account_name, start_year, start_period, end_year, end_period]
+    if company_ids is not None:
+        conditions.append("g.companyid = ANY(%s)")
+        params.append(list(company_ids))
+    if after is not None:
+        # posting_date is nullable and NULLs sort last, where a row
+        # comparison would never reach them
+        after_date, after_id = after
+        if after_date is None:
+            conditions.append("g.posting_date IS NULL AND g.uniqueid > %s")
+            params.append(after_id)
+        else:
+            conditions.append("((g.posting_date, g.uniqueid) > (%s, %s) OR g.posting_date IS NULL)")
+            params.extend(after)
+    params.append(limit)
+
+    sql = f"""
+        SELECT g.posting_date, g.uniqueid, g.companyid, g.gl_account, g.customer,
+               g.description, g.source, {amount} AS amount
+        FROM {source}
+        WHERE {" AND ".join(conditions)}
+        ORDER BY g.posting_date, g.uniqueid
+        LIMIT %s
+    """
+    with connections[report_alias()].chunked_cursor() as cursor:
+        cursor.execute(sql, params)
+        columns = None
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            # Named cursors only have a description once rows have been fetched
+            if columns is None:
+                columns = [col[0] for col in cursor.description]
+            yield [dict(zip(columns, row)) for row in rows]
+
 
 def fetch_companies():
     """
@@ -0,0 +1,184 @@
+from array import array
+from collections import namedtuple
+
+import numpy as np
+
+from .columnar import ColumnarResult
+
+
+def period_range(start_year, start_period, end_year, end_period):
+    """
+    (year, period) pairs of a half-open range; end_period may be 13
+    """
+    start = start_year * 12 + start_period - 1
+    end = end_year * 12 + end_period - 1
+    return [_as_period(month) for month in range(start, end)]
+
+
+def _as_period(month_index):
+    year, month = divmod(month_index, 12)
+    return year, month + 1
+
+
+def shift_period(year, period, months):
+    """
+    (year, period) `months` months after (or before, if negative) the given one
+    """
+    return _as_period(year * 12 + period - 1 + months)
+
+
+def quarter_start(year, period):
+    return year, period - (period - 1) % 3
+
+
+# One report column sliced from the per-month matrices. `value` is "total"
+# (of `source`), "average" (of actuals over months with postings) or
+# "variance" (actual - budget); the range is half-open like everywhere else.
+ReportColumn = namedtuple(
+    "ReportColumn", "key header source value start_year start_period end_year end_period"
+)
+
+
+class PeriodMatrix:
+    """
+    Account x month values over a contiguous range of periods.
+
+    `present` marks the cells that had postings, which the SQL average
+    functions count as periods; other cells hold 0.
+    """
+
+    def __init__(self, row_names, periods, values, present):
+        self.row_names = list(row_names)
+        self.row_index = {name: i for i, name in enumerate(self.row_names)}
+        self.periods = list(periods)
+        self.period_index = {period: i for i, period in enumerate(self.periods)}
+        self.values = values
+        self.present = present
+
+    @classmethod
+    def from_rows(cls, rows, periods, row_names):
+        """
+        Build from (name, year, period, value) rows; rows outside `periods`
+        or `row_names` are ignored
+        """
+        matrix = cls(row_names, periods, None, None)
+        matrix.values = np.zeros((len(matrix.row_names), len(matrix.periods)))
+        matrix.present = np.zeros(matrix.values.shape, dtype=bool)
+        for name, year, period, value in rows:
+            i = matrix.row_index.get(name)
+            j = matrix.period_index.get((year, period))
+            if i is None or j is None or value is None:
+                continue
+            matrix.values[i, j] += float(value)
+            matrix.present[i, j] = True
+        return matrix
+
+    @classmethod
+    def concat(cls, matrices):
+        """
+        Join matrices over consecutive period ranges side by side; the rows
+        are the union of theirs, in name order
+        """
+        if len(matrices) == 1:
+            return matrices[0]
+        row_names = sorted(set().union(*(matrix.row_names for matrix in matrices)))
+        joined = cls(row_names, [period for matrix in matrices for period in matrix.periods], None, None)
+        joined.values = np.zeros((len(joined.row_names), len(joined.periods)))
+        joined.present = np.zeros(joined.values.shape, dtype=bool)
+        at = 0
+        for matrix in matrices:
+            rows = [joined.row_index[name] for name in matrix.row_names]
+            width = len(matrix.periods)
+            joined.values[rows, at:at + width] = matrix.values
+            joined.present[rows, at:at + width] = matrix.present
+            at += width
+        return joined
+
+    def columns(self, start_year, start_period, end_year, end_period):
+        """
+        Column slice for a half-open (year, period) range inside the matrix
+        """
+        wanted = period_range(start_year, start_period, end_year, end_period)
+        indexes = [self.period_index[p] for p in wanted if p in self.period_index]
+        if not indexes:
+            return slice(0, 0)
+        return slice(indexes[0], indexes[-1] + 1)
+
+    def total(self, columns=slice(None)):
+        return self.values[:, columns].sum(axis=1)
+
+    def stats(self, columns=slice(None)):
+        """
+        Per-row average, minimum and maximum over the months that have
+        postings, and the number of such months (NaN where there are none),
+        as finance.actual_account_average computes them
+        """
+        values = self.values[:, columns]
+        present = self.present[:, columns]
+        count = present.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            average = np.where(count > 0, np.where(present, values, 0).sum(axis=1) / count, np.nan)
+        minimum = np.where(count > 0, np.where(present, values, np.inf).min(axis=1, initial=np.inf), np.nan)
+        maximum = np.where(count > 0, np.where(present, values, -np.inf).max(axis=1, initial=-np.inf), np.nan)
+        return average, minimum, maximum, count
+
+
+def derive_report(actual, budget, columns):
+    """
+    Slice report columns out of per-month actual and budget matrices that
+    share their rows and periods.
+
+    Totals and variance follow the finance.* functions (amounts already
+    erp_sign-adjusted, variance = actual - budget, a missing side counting as
+    0); averages skip months without postings and are NaN where there are
+    none. Returns a ColumnarResult keyed by ref_name with one float column per
+    ReportColumn.key.
+    """
+    matrices = {"actual": actual, "budget": budget}
+    data = {}
+    for column in columns:
+        months = actual.columns(column.start_year, column.start_period, column.end_year, column.end_period)
+        if column.value == "variance":
+            values = actual.total(months) - budget.total(months)
+        elif column.value == "average":
+            values = actual.stats(months)[0]
+        else:
+            values = matrices[column.source].total(months)
+        data[column.key] = array('d', values.tobytes())
+    return ColumnarResult(["ref_name"] + list(data), [list(actual.row_names)] + list(data.values()))
+
+
+def ratio_columns(values, numerators, denominators, columns):
+    """
+    Percentage rows (numerator / denominator * 100) for every report column in
+    one pass.
+
+    `values` is a (lines x columns) float array of the report's line values,
+    `numerators` and `denominators` index arrays into its lines, one pair per
+    ratio row. Ratios with a zero or missing denominator are 0. A variance
+    column gets the percentage-point difference between the actual and
+    budget columns over the same range when the report has both, since a
+    ratio of two variances means nothing; 0 otherwise.
+    """
+    numerator = values[numerators]
+    denominator = values[denominators]
+    ratios = np.zeros_like(numerator)
+    np.divide(numerator, denominator, out=ratios,
+              where=(denominator != 0) & np.isfinite(denominator) & np.isfinite(numerator))
+    ratios *= 100
+
+    positions = {
+        (column.source, column.value, column.start_year, column.start_period, column.end_year, column.end_period): index
+        for index, column in enumerate(columns)
+    }
+    for index, column in enumerate(columns):
+        if column.value != "variance":
+            continue
+        span = (column.start_year, column.start_period, column.end_year, column.end_period)
+        actual = positions.get(("actual", "total") + span)
+        budget = positions.get(("budget", "total") + span)
+        if actual is None or budget is None:
+            ratios[:, index] = 0
+        else:
+            ratios[:, index] = ratios[:, actual] - ratios[:, budget]
+    return ratios
@@ -0,0 +1,92 @@
+import csv
+import re
+
+from .db import map_parallel
+from .reports import budget_vs_actual_columns, get_budget_vs_actual
+
+ACCOUNTING_NUMBER_FORMAT = '#,##0;(#,##0);"-"'
+PERCENT_NUMBER_FORMAT = '0.0"%";(0.0"%");"-"'
+
+
+class _Echo:
+    """
+    File-like object whose write() hands the formatted line back to the caller
+    """
+
+    def write(self, value):
+        return value
+
+
+def _header(columns, multi_company):
+    header = ["Description", "Type"] + [column.header for column in columns]
+    return (["Company"] if multi_company else []) + header
+
+
+def _values(columns, item):
+    return [item[column.key] for column in columns]
+
+
+def iter_company_reports(company_ids, period):
+    """
+    Yield (companyid, financial_data) in company order. The companies'
+    reports are independent, so a multi-company export computes up to
+    FPNA_QUERY_WORKERS of them at once (db.map_parallel) and holds no more
+    than that many in memory.
+    """
+    if len(company_ids) == 1:
+        yield company_ids[0], get_budget_vs_actual(company_ids, period)
+        return
+    yield from map_parallel(lambda company: (company, get_budget_vs_actual([company], period)), company_ids)
+
+
+def iter_budget_vs_actual_csv(company_ids, period):
+    """
+    Yield the Budget vs. Actual report as CSV lines, for StreamingHttpResponse.
+    A Company column is added when more than one company is exported.
+
+    `period` is the session's (year, month); it is passed explicitly because
+    the body is generated after ReportPeriodMiddleware has returned.
+    """
+    writer = csv.writer(_Echo())
+    columns = budget_vs_actual_columns(period)
+    multi_company = len(company_ids) > 1
+    yield writer.writerow(_header(columns, multi_company))
+    for company, financial_data in iter_company_reports(company_ids, period):
+        prefix = [company] if multi_company else []
+        for item in financial_data:
+            yield writer.writerow(prefix + [item["name"], item["type"]] + _values(columns, item))
+
+
+def write_budget_vs_actual_xlsx(company_ids, fileobj, period):
+    """
+    Write the Budget vs. Actual report to `fileobj` as XLSX, one sheet per
+    company. The workbook is built in openpyxl's write-only mode, which streams
+    rows to disk instead of keeping every cell in memory.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+
+    columns = budget_vs_actual_columns(period)
+    workbook = Workbook(write_only=True)
+    for company, financial_data in iter_company_reports(company_ids, period):
+        sheet = workbook.create_sheet(title=re.sub(r"[\[\]:*?/\\]", "_", company)[:31])
+        sheet.column_dimensions["A"].width = 36
+        sheet.append(_header(columns, False))
+        for item in financial_data:
+            bold = item["type"] == "metric"
+            number_format = PERCENT_NUMBER_FORMAT if item["type"] == "percentage" else ACCOUNTING_NUMBER_FORMAT
+            name = WriteOnlyCell(sheet, value=item["name"])
+            if bold:
+                name.font = Font(bold=True)
+            row = [name, item["type"]]
+            for value in _values(columns, item):
+                cell = WriteOnlyCell(sheet, value=value)
+                cell.number_format = number_format
+                if bold:
+                    cell.font = Font(bold=True)
+                row.append(cell)
+            sheet.append(row)
+    if not workbook.worksheets:
+        workbook.create_sheet(title="Budget vs Actual")
+    workbook.save(fileobj)
@@ -0,0 +1,174 @@
+"""
+Bulk loading of ERP exports into public.gl_txn_raw and public.budget.
+
+Files are streamed in chunks of a bounded number of rows. Each chunk is
+COPYed into a temporary staging table and merged into the target in one
+transaction, skipping uniqueids that are already loaded, so re-running a
+load (or loading overlapping exports) never duplicates rows.
+"""
+import csv
+import gzip
+import io
+import time
+from pathlib import Path
+
+from django.db import connection, transaction
+
+# Loadable columns per target table; every file must carry `uniqueid`
+TABLE_COLUMNS = {
+    "gl_txn_raw": [
+        "gl_account", "companyid", "customer", "posting_date", "description",
+        "extdescription", "amount_raw", "invoicetype", "invvouch", "postperiod",
+        "postyear", "source", "sourcekey", "supplierinvnum", "transcode", "uniqueid",
+    ],
+    "budget": ["account", "amt1", "booktype", "companyid", "period", "uniqueid", "year"],
+}
+
+STAGE_TABLE = "fpna_ingest_stage"
+SCHEMA_SQL = Path(__file__).resolve().parent / "sql" / "ingest.sql"
+
+# Is there an index whose leading column is uniqueid?
+UNIQUEID_INDEX_SQL = """
+    SELECT EXISTS (
+        SELECT 1 FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+        WHERE i.indrelid = %s::regclass AND a.attname = 'uniqueid'
+    )
+"""
+
+# Lowest rollup/resolved watermark, if those tables are set up: ledger rows
+# loaded below it are skipped by incremental refreshes
+WATERMARK_SQL = """
+    SELECT CASE WHEN to_regclass('public.rollup_watermark') IS NOT NULL
+                THEN (SELECT min(last_uniqueid) FROM public.rollup_watermark) END
+"""
+
+
+def ensure_schema():
+    """
+    Create the uniqueid indexes the loader's merge needs
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(SCHEMA_SQL.read_text())
+
+
+def open_export(path, encoding="utf-8"):
+    """
+    Open a CSV export for reading as text, transparently gunzipping *.gz files
+    """
+    if str(path).endswith(".gz"):
+        return gzip.open(path, "rt", encoding=encoding, newline="")
+    return open(path, encoding=encoding, newline="")
+
+
+def _file_columns(header, table):
+    columns = [name.strip().lower() for name in header]
+    unknown = [name for name in columns if name not in TABLE_COLUMNS[table]]
+    if unknown:
+        raise ValueError(f"Unknown {table} column(s) in header: {', '.join(unknown)}")
+    if "uniqueid" not in columns:
+        raise ValueError("The header must include a uniqueid column")
+    return columns
+
+
+def _chunks(reader, chunk_rows):
+    """
+    Yield (row count, CSV text) for consecutive chunks of at most chunk_rows rows
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    count = 0
+    for row in reader:
+        writer.writerow(row)
+        count += 1
+        if count == chunk_rows:
+            yield count, buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+    if count:
+        yield count, buffer.getvalue()
+
+
+def _copy(cursor, sql, data):
+    """
+    COPY ... FROM STDIN with either driver Django may be running on
+    """
+    raw = cursor.cursor
+    if hasattr(raw, "copy"):  # psycopg 3
+        with raw.copy(sql) as copy:
+            copy.write(data)
+    else:  # psycopg2
+        raw.copy_expert(sql, io.StringIO(data))
+
+
+def load_file(path, table, chunk_rows=100_000, delimiter=",", encoding="utf-8", progress=None):
+    """
+    Load one CSV (optionally gzipped) export with a header row into `table`
+    ("gl_txn_raw" or "budget").
+
+    `progress`, if given, is called after every chunk with the running totals
+    dict that is also returned: rows read, rows inserted, duplicates skipped,
+    chunks and elapsed seconds. For gl_txn_raw, `below_watermark` counts the
+    inserted rows that incremental rollup/resolved refreshes will not pick
+    up, because their uniqueid is at or below a refresh watermark; those
+    need a `--full` refresh.
+    """
+    if table not in TABLE_COLUMNS:
+        raise ValueError(f"Unknown target table: {table}")
+    started = time.monotonic()
+    totals = {"file": str(path), "read": 0, "inserted": 0, "skipped": 0, "below_watermark": 0,
+              "chunks": 0, "seconds": 0.0}
+
+    with open_export(path, encoding) as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        header = next(reader, None)
+        if header is None:
+            return totals
+        columns = _file_columns(header, table)
+        column_list = ", ".join(columns)
+        stage_columns = ", ".join(f"s.{name}" for name in columns)
+
+        with connection.cursor() as cursor:
+            cursor.execute(UNIQUEID_INDEX_SQL, [f"public.{table}"])
+            if not cursor.fetchone()[0]:
+                # Every chunk's anti-join would scan the whole table
+                raise ValueError(f"public.{table} has no index on uniqueid; run `load_erp_export --create` first")
+            for count, data in _chunks(reader, chunk_rows):
+                with transaction.atomic():
+                    # Staging lives for one chunk's transaction only
+                    cursor.execute(
+                        f"CREATE TEMP TABLE {STAGE_TABLE} "
+                        f"(LIKE public.{table} INCLUDING DEFAULTS) ON COMMIT DROP"
+                    )
+                    _copy(cursor, f"COPY {STAGE_TABLE} ({column_list}) FROM STDIN WITH (FORMAT csv)", data)
+                    # Keep concurrent loads from inserting the same uniqueid twice
+                    cursor.execute(f"LOCK TABLE public.{table} IN SHARE ROW EXCLUSIVE MODE")
+                    watermark = None
+                    if table == "gl_txn_raw":
+                        cursor.execute(WATERMARK_SQL)
+                        watermark = cursor.fetchone()[0]
+                    cursor.execute(f"""
+                        WITH inserted AS (
+                            INSERT INTO public.{table} ({column_list})
+                            SELECT DISTINCT ON (s.uniqueid) {stage_columns}
+                            FROM {STAGE_TABLE} s
+                            WHERE NOT EXISTS (
+                                SELECT 1 FROM public.{table} t WHERE t.uniqueid = s.uniqueid
+                            )
+                            ORDER BY s.uniqueid
+                            RETURNING uniqueid
+                        )
+                        SELECT count(*), count(*) FILTER (WHERE uniqueid <= %s) FROM inserted
+                    """, [watermark])
+                    inserted, below_watermark = cursor.fetchone()
+                totals["read"] += count
+                totals["inserted"] += inserted
+                totals["below_watermark"] += below_watermark
+                totals["skipped"] += count - inserted
+                totals["chunks"] += 1
+                totals["seconds"] = time.monotonic() - started
+                if progress:
+                    progress(totals)
+    totals["seconds"] = time.monotonic() - started
+    return totals
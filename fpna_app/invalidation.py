@@ -0,0 +1,267 @@
+"""
+Push-based invalidation of the in-process caches.
+
+Triggers installed from sql/cache_invalidation.sql NOTIFY the fpna_cache
+channel with the (companyid, year, period)s a ledger or budget statement
+touched, or with the reference table that changed. A listener thread in each
+worker evicts just the matching report_cache entries, and reloads reference
+data on reference changes. A month roll NOTIFYs {"warm": [year, period]},
+which each listener answers by warming its worker's report cache.
+
+When notifications are unavailable (no psycopg 3, triggers not installed,
+a pooler that drops LISTEN, a lost connection) the thread polls the data
+version instead, retrying LISTEN every FPNA_CACHE_LISTEN_RETRY seconds.
+"""
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection
+
+from .cache import report_cache
+from .conditional import _current_version as _data_version, invalidate_data_version
+from .db import note_primary_write
+from .reference import _current_version as _reference_version, invalidate_reference_data
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "fpna_cache"
+SCHEMA_SQL = Path(__file__).resolve().parent / "sql" / "cache_invalidation.sql"
+REFERENCE_TABLES = {"company", "gl_account_map", "metric", "metric_component"}
+
+TRIGGERS_SQL = """
+    SELECT count(*) FROM pg_trigger
+    WHERE tgname LIKE 'fpna_notify%' AND tgrelid IN ('public.gl_txn_raw'::regclass, 'public.budget'::regclass)
+"""
+
+# (companyid, year, period)s of rows appended since the last poll
+POLL_CHANGES_SQL = {
+    "gl_txn_raw": """
+        SELECT DISTINCT companyid, postyear, postperiod FROM public.gl_txn_raw
+        WHERE uniqueid > %s AND uniqueid <= %s
+    """,
+    "budget": """
+        SELECT DISTINCT companyid, year, period FROM public.budget
+        WHERE uniqueid > %s AND uniqueid <= %s
+    """,
+}
+
+_listener = None
+_lock = threading.Lock()
+
+
+def ensure_schema():
+    """
+    Install (or update) the NOTIFY triggers
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(SCHEMA_SQL.read_text())
+
+
+def evict_periods(changes):
+    """
+    Drop the report_cache entries whose range covers any of the
+    (companyid, year, period) `changes` for that company (or for all
+    companies). Returns the number of entries removed.
+    """
+    changes = {(company, int(year), int(period)) for company, year, period in changes}
+
+    def stale(key):
+        start, end, companies = key[1:3], key[3:5], key[5]
+        return any(
+            start <= (year, period) < end and (companies is None or company in companies)
+            for company, year, period in changes
+        )
+
+    invalidate_data_version()
+    note_primary_write()
+    return report_cache.invalidate(stale)
+
+
+def evict_all(reference=False):
+    """
+    Drop every report_cache entry; with `reference`, reload the reference
+    data on next use as well
+    """
+    if reference:
+        invalidate_reference_data()
+    invalidate_data_version()
+    note_primary_write()
+    return report_cache.invalidate()
+
+
+def handle_notification(payload):
+    """
+    Apply one fpna_cache payload; returns the number of entries evicted
+    """
+    message = json.loads(payload)
+    if "warm" in message:
+        from .warmup import warm_reports
+
+        warm_reports(tuple(message["warm"]))
+        return 0
+    table = message.get("table")
+    if table == "rollup_watermark":
+        from . import resolved, rollup
+
+        source = getattr(settings, "FPNA_ACTUALS_SOURCE", "ledger")
+        watched = {"rollup": rollup.WATERMARK_NAME, "resolved": resolved.WATERMARK_NAME}.get(source)
+        return evict_all() if message.get("name") == watched else 0
+    if "changes" in message:
+        return evict_periods(message["changes"])
+    return evict_all(reference=table in REFERENCE_TABLES)
+
+
+class InvalidationListener(threading.Thread):
+    """
+    Per-worker thread applying cache invalidations, by LISTEN when possible
+    and by polling otherwise. `mode` is "listen", "poll" or "starting".
+    """
+
+    def __init__(self, poll_interval, listen_retry, listen=True):
+        super().__init__(name="fpna-invalidation", daemon=True)
+        self.poll_interval = poll_interval
+        self.listen_retry = listen_retry
+        self.listen = listen
+        self.mode = "starting"
+        self.events = 0
+        self.evicted = 0
+        self.last_event = None
+        self.last_error = None
+        self._stopping = threading.Event()
+        self._poll_state = None
+
+    def stop(self):
+        self._stopping.set()
+
+    def _apply(self, evicted):
+        self.events += 1
+        self.evicted += evicted
+        self.last_event = time.time()
+
+    def run(self):
+        while not self._stopping.is_set():
+            if self.listen:
+                try:
+                    self._listen()
+                except Exception as e:
+                    self.last_error = str(e)
+                    logger.warning("Cache invalidation falls back to polling: %s", e)
+                    if self.mode == "listen":
+                        # Notifications may have been lost with the connection
+                        self._apply(evict_all(reference=True))
+            self.mode = "poll"
+            self._poll_for(self.listen_retry if self.listen else None)
+
+    def _listen(self):
+        import psycopg
+
+        from .async_db import _conninfo
+
+        with psycopg.connect(_conninfo(), autocommit=True) as conn:
+            if not conn.execute(TRIGGERS_SQL).fetchone()[0]:
+                raise RuntimeError("NOTIFY triggers are not installed; run `manage.py cache_invalidation --create`")
+            conn.execute(f"LISTEN {CHANNEL}")
+            # Changes made while nobody was listening went unnoticed
+            self._apply(evict_all(reference=True))
+            self.mode = "listen"
+            self.last_error = None
+            self._poll_state = None
+            while not self._stopping.is_set():
+                # The timeout only bounds how long a stop() takes to be seen
+                for notify in conn.notifies(timeout=1.0):
+                    self._apply(handle_notification(notify.payload))
+
+    def _poll_for(self, seconds):
+        """
+        Poll every poll_interval seconds, for `seconds` or until stopped
+        """
+        deadline = None if seconds is None else time.monotonic() + seconds
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                self.last_error = str(e)
+                logger.warning("Cache invalidation poll failed: %s", e)
+            finally:
+                connection.close()
+            if self._stopping.wait(self.poll_interval):
+                return
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+
+    def poll(self):
+        """
+        Compare the data and reference versions with the previous poll. New
+        ledger/budget uniqueids are looked up to evict just their periods;
+        anything else that moved (watermark, change sequence, reference data)
+        evicts everything, since an update or delete can't be located.
+        """
+        state = (_data_version(), _reference_version())
+        previous, self._poll_state = self._poll_state, state
+        if previous is None or previous == state:
+            return
+        (data, reference), (old_data, old_reference) = state, previous
+        if reference != old_reference or data[2:] != old_data[2:]:
+            self._apply(evict_all(reference=reference != old_reference))
+            return
+        changes = set()
+        with connection.cursor() as cursor:
+            for sql, new, old in zip(POLL_CHANGES_SQL.values(), data[:2], old_data[:2]):
+                if new == old:
+                    continue
+                if new is None or old is None or new < old:
+                    # Rows were deleted, or the table was empty: no telling what moved
+                    self._apply(evict_all())
+                    return
+                cursor.execute(sql, [old, new])
+                changes.update(cursor.fetchall())
+        self._apply(evict_periods(changes))
+
+    def status(self):
+        return {
+            "mode": self.mode,
+            "events": self.events,
+            "evicted": self.evicted,
+            "last_event": self.last_event,
+            "last_error": self.last_error,
+        }
+
+
+def start():
+    """
+    Start this worker's invalidation thread according to
+    FPNA_CACHE_INVALIDATION ("listen", "poll" or "off"). Returns the thread,
+    or None when off; starting twice returns the running thread.
+    """
+    global _listener
+    mode = getattr(settings, "FPNA_CACHE_INVALIDATION", "off")
+    if mode == "off":
+        return None
+    with _lock:
+        if _listener is None or not _listener.is_alive():
+            _listener = InvalidationListener(
+                poll_interval=getattr(settings, "FPNA_CACHE_POLL_INTERVAL", 30),
+                listen_retry=getattr(settings, "FPNA_CACHE_LISTEN_RETRY", 60),
+                listen=mode == "listen",
+            )
+            _listener.start()
+            # Evicted on change, open periods can be cached longer
+            report_cache.invalidator = _listener
+        return _listener
+
+
+def listening():
+    """
+    True while this worker's invalidation thread receives NOTIFYs
+    """
+    listener = _listener
+    return listener is not None and listener.is_alive() and listener.mode == "listen"
+
+
+def status():
+    listener = _listener
+    return listener.status() if listener is not None else {"mode": "off"}
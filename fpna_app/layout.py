@@ -0,0 +1,308 @@
+"""
+Report layouts: the ordered line items of a report, defined in
+layouts/<name>.json and compiled once per process.
+
+Each line is {"name", "type"} plus, for account lines, the "group" whose
+metric line is flagged "is_group_header", and for percentage lines the
+"numerator" and "denominator" lines. Compiling a layout fixes where every
+line's values come from in one (lines x columns) matrix, so populating a
+report is a matrix product for the metrics and a gather for the rows.
+"""
+import json
+import logging
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from .derived import ratio_columns
+
+logger = logging.getLogger(__name__)
+
+LAYOUT_DIR = Path(__file__).resolve().parent / "layouts"
+LINE_TYPES = ("account", "metric", "percentage")
+
+
+class ReportLayout:
+    """
+    A validated, compiled layout.
+
+    Value matrix rows are the layout's distinct accounts, then its distinct
+    metrics, then its ratios, then one row of zeros, and every output row is
+    gathered from its precomputed position there. Only the metric positions
+    depend on the metric definitions, and those are memoised per MetricEngine.
+    """
+
+    def __init__(self, name, lines, title=None):
+        self.name = name
+        self.title = title or name
+        self.lines = [dict(line) for line in lines]
+        _validate(name, self.lines)
+
+        self.account_names = list(dict.fromkeys(l["name"] for l in self.lines if l["type"] == "account"))
+        self.account_index = {name: i for i, name in enumerate(self.account_names)}
+        self.metric_names = list(dict.fromkeys(l["name"] for l in self.lines if l["type"] == "metric"))
+        self.ratios = list(dict.fromkeys(
+            (l["numerator"], l["denominator"]) for l in self.lines if l["type"] == "percentage"
+        ))
+        ratio_index = {ratio: i for i, ratio in enumerate(self.ratios)}
+
+        # group -> account names, in display order
+        self.groups = {}
+        for line in self.lines:
+            if line["type"] == "account" and line.get("group"):
+                self.groups.setdefault(line["group"], []).append(line["name"])
+
+        metrics_at = len(self.account_names)
+        ratios_at = metrics_at + len(self.metric_names)
+        self._zero_row = ratios_at + len(self.ratios)
+        line_rows = {name: i for i, name in enumerate(self.account_names)}
+        line_rows.update((name, metrics_at + i) for i, name in enumerate(self.metric_names))
+        self._numerators = np.array([line_rows[n] for n, _ in self.ratios], dtype=np.intp)
+        self._denominators = np.array([line_rows[d] for _, d in self.ratios], dtype=np.intp)
+
+        def source(line):
+            if line["type"] == "percentage":
+                return ratios_at + ratio_index[(line["numerator"], line["denominator"])]
+            return line_rows[line["name"]]
+
+        def static(line):
+            return {
+                "name": line["name"],
+                "type": line["type"],
+                "group": line.get("group"),
+                "is_group_header": line.get("is_group_header", False),
+            }
+
+        # (static row fields, value matrix row) per output row
+        self._detail = _plan((static(line), source(line)) for line in self.lines)
+        # Per collapsed row, the index of its detail row, or the placeholder
+        # row (carrying no values) that stands in for a group's account rows
+        self._collapsed = []
+        placeholders = set()
+        for i, line in enumerate(self.lines):
+            group = line.get("group")
+            if line["type"] == "account" and group:
+                if group not in placeholders:
+                    placeholders.add(group)
+                    self._collapsed.append({"name": group, "type": "group", "group": group, "is_group_header": False})
+                continue
+            self._collapsed.append(i)
+        self._group_rows = {
+            group: _plan((static(line), source(line)) for line in self.lines
+                         if line["type"] == "account" and line.get("group") == group)
+            for group in self.groups
+        }
+        self._metric_positions = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data.get("name", Path(path).stem), data.get("lines", []), data.get("title"))
+
+    def metric_positions(self, engine):
+        """
+        Position of each layout metric in engine.metric_names, -1 (the zero
+        row appended to the evaluated metrics) for metrics it doesn't define
+        """
+        with self._lock:
+            cached = self._metric_positions.get(id(engine))
+            if cached is None or cached[0] is not engine:
+                positions = np.array([engine.metric_index.get(name, -1) for name in self.metric_names],
+                                     dtype=np.intp)
+                # Keep only the current engine's; older ones are gone with their reference data
+                self._metric_positions = {id(engine): (engine, positions)}
+                cached = self._metric_positions[id(engine)]
+            return cached[1]
+
+    def values(self, accounts_data, columns, engine=None, monthly=None):
+        """
+        The (value matrix rows x columns) matrix for a derive_report result.
+        Without `engine` only the account rows are filled in. Metric
+        "average" columns need the `monthly` fetch_monthly_accounts matrices
+        the result was derived from.
+        """
+        keys = [column.key for column in columns]
+        matrix = np.zeros((self._zero_row + 1, len(keys)))
+        if not len(accounts_data):
+            return matrix
+        # NaN (an average without postings) shows as 0, like a missing account
+        data = np.nan_to_num(np.column_stack([accounts_data.numpy(key) for key in keys]), nan=0.0)
+
+        positions = accounts_data.positions(self.account_index)
+        used = positions >= 0
+        matrix[positions[used]] = data[used]
+
+        if engine is not None and self.metric_names:
+            # Metrics are linear in their accounts, so totals and variance
+            # columns are one product
+            engine_accounts = np.zeros((len(engine.account_names), len(keys)))
+            positions = accounts_data.positions(engine.account_index)
+            used = positions >= 0
+            np.add.at(engine_accounts, positions[used], data[used])
+            metrics = np.vstack([engine.evaluate(engine_accounts), np.zeros((1, len(keys)))])
+            # Averages are not: a metric averages its own monthly totals
+            for j, column in enumerate(columns):
+                if column.value == "average":
+                    if monthly is None:
+                        raise ValueError("Metric averages need the monthly matrices")
+                    source = monthly[column.source]
+                    months = source.columns(column.start_year, column.start_period,
+                                            column.end_year, column.end_period)
+                    metrics[:-1, j] = np.nan_to_num(engine.monthly_average(source, months), nan=0.0)
+            metrics_at = len(self.account_names)
+            matrix[metrics_at:metrics_at + len(self.metric_names)] = metrics[self.metric_positions(engine)]
+
+            if self.ratios:
+                ratios_at = metrics_at + len(self.metric_names)
+                matrix[ratios_at:self._zero_row] = ratio_columns(
+                    matrix, self._numerators, self._denominators, columns
+                )
+        return matrix
+
+    def rows(self, accounts_data, columns, engine, monthly=None):
+        """
+        Report rows (one dict per line, the keys the template and exports
+        read)
+        """
+        return _populate(self._detail, self.values(accounts_data, columns, engine, monthly), columns)
+
+    def collapse(self, rows):
+        """
+        rows() output with each group's account rows replaced by one "group"
+        placeholder row; the row dicts are shared, not copied
+        """
+        return [rows[entry] if isinstance(entry, int) else dict(entry) for entry in self._collapsed]
+
+    def group_rows(self, group, accounts_data, columns):
+        """
+        The account rows of one group; needs only the group's accounts
+        """
+        return _populate(self._group_rows[group], self.values(accounts_data, columns), columns)
+
+    def check(self, reference):
+        """
+        Names in the layout that gl_account_map or public.metric don't
+        define; their lines would always show 0
+        """
+        known_accounts = set(reference.account_names)
+        known_metrics = set(reference.metric_names)
+        return (
+            [name for name in self.account_names if name not in known_accounts],
+            [name for name in self.metric_names if name not in known_metrics],
+        )
+
+
+def _plan(rows):
+    """
+    (static row fields, value matrix rows as an index array)
+    """
+    rows = list(rows)
+    return [static for static, _ in rows], np.array([source for _, source in rows], dtype=np.intp)
+
+
+def _populate(plan, matrix, columns):
+    statics, sources = plan
+    keys = [column.key for column in columns]
+    rows = []
+    for static, values in zip(statics, matrix[sources].tolist()):
+        row = dict(static)
+        if static["type"] != "group":
+            row.update(zip(keys, values))
+        rows.append(row)
+    return rows
+
+
+def _validate(name, lines):
+    """
+    Raise ValueError unless the lines form a well-formed layout
+    """
+    for i, line in enumerate(lines):
+        if not line.get("name") or line.get("type") not in LINE_TYPES:
+            raise ValueError(f"Layout {name!r} line {i + 1}: needs a name and a type in {LINE_TYPES}")
+    line_names = {line["name"] for line in lines if line["type"] != "percentage"}
+    headers = set()
+    for i, line in enumerate(lines):
+        where = f"Layout {name!r} line {i + 1}"
+        if line["type"] == "percentage":
+            for side in ("numerator", "denominator"):
+                if line.get(side) not in line_names:
+                    raise ValueError(f"{where}: {side} {line.get(side)!r} is not an account or metric line")
+        if line.get("is_group_header"):
+            if line["type"] != "metric" or not line.get("group"):
+                raise ValueError(f"{where}: only a metric line with a group can be its header")
+            headers.add(line["group"])
+    for line in lines:
+        if line["type"] == "account" and line.get("group") and line["group"] not in headers:
+            raise ValueError(f"Layout {name!r}: group {line['group']!r} has no is_group_header line")
+
+
+_layouts = {}
+_lock = threading.Lock()
+
+
+def get_layout(name):
+    """
+    The compiled layout layouts/<name>.json, loaded on first use
+    """
+    with _lock:
+        if name not in _layouts:
+            _layouts[name] = ReportLayout.load(LAYOUT_DIR / f"{name}.json")
+        return _layouts[name]
+
+
+def available_layouts():
+    return sorted(path.stem for path in LAYOUT_DIR.glob("*.json"))
+
+
+def check_layouts(reference=None):
+    """
+    Load every layout and compare it with the reference data; returns
+    {layout: (unknown accounts, unknown metrics)} for the ones with problems
+    and logs them
+    """
+    if reference is None:
+        from .reference import get_reference_data
+        reference = get_reference_data()
+    problems = {}
+    for name in available_layouts():
+        accounts, metrics = get_layout(name).check(reference)
+        if accounts or metrics:
+            problems[name] = (accounts, metrics)
+            logger.warning("Layout %s: unknown accounts %s, unknown metrics %s", name, accounts, metrics)
+    return problems
+
+
+def layout_files_check(app_configs, **kwargs):
+    """
+    System check: every layout file loads and is well-formed
+    """
+    from django.core import checks
+
+    errors = []
+    for name in available_layouts():
+        try:
+            get_layout(name)
+        except (OSError, ValueError) as e:
+            errors.append(checks.Error(str(e), obj=f"layouts/{name}.json", id="fpna_app.E001"))
+    return errors
+
+
+def layout_names_check(app_configs, databases=None, **kwargs):
+    """
+    System check (`check --database default`): every account and metric a
+    layout names exists in the reference data
+    """
+    from django.core import checks
+
+    if not databases:
+        return []
+    return [
+        checks.Warning(
+            f"Unknown accounts {accounts} and metrics {metrics} always show 0",
+            obj=f"layouts/{name}.json", id="fpna_app.W001",
+        )
+        for name, (accounts, metrics) in check_layouts().items()
+    ]
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from fpna_app import invalidation
+from fpna_app.cache import report_cache
+
+
+class Command(BaseCommand):
+    help = "Install the cache invalidation NOTIFY triggers, or run a listener in the foreground to watch them"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--create", action="store_true",
+                            help="Create or update the NOTIFY triggers on the ledger, budget and reference tables")
+        parser.add_argument("--listen", action="store_true",
+                            help="Run the invalidation thread in the foreground and print its status on every event")
+        parser.add_argument("--poll", action="store_true",
+                            help="With --listen, poll instead of using LISTEN")
+
+    def handle(self, *args, **options):
+        if options["create"]:
+            invalidation.ensure_schema()
+            self.stdout.write(self.style.SUCCESS("Cache invalidation triggers are up to date"))
+        if not options["listen"]:
+            return
+
+        listener = invalidation.InvalidationListener(
+            poll_interval=5, listen_retry=60, listen=not options["poll"],
+        )
+        listener.start()
+        self.stdout.write("Watching for cache invalidations (Ctrl-C to stop)")
+        seen = None
+        try:
+            while listener.is_alive():
+                status = listener.status()
+                if (status["mode"], status["events"], status["last_error"]) != seen:
+                    seen = (status["mode"], status["events"], status["last_error"])
+                    self.stdout.write(f"  {status} cache={report_cache.stats()}")
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            listener.stop()
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from fpna_app import ingest
+
+
+class Command(BaseCommand):
+    help = "Bulk load ERP CSV exports (optionally gzipped) into public.gl_txn_raw or public.budget via COPY"
+
+    def add_arguments(self, parser):
+        parser.add_argument("table", choices=sorted(ingest.TABLE_COLUMNS),
+                            help="Target table")
+        parser.add_argument("files", nargs="+",
+                            help="CSV files with a header row of column names; *.gz is decompressed on the fly")
+        parser.add_argument("--create", action="store_true",
+                            help="Create the uniqueid indexes the merge needs first")
+        parser.add_argument("--chunk-rows", type=int, default=100_000,
+                            help="Rows copied and merged per transaction")
+        parser.add_argument("--delimiter", default=",")
+        parser.add_argument("--encoding", default="utf-8")
+
+    def handle(self, *args, **options):
+        if options["create"]:
+            ingest.ensure_schema()
+            self.stdout.write("Loader indexes are up to date")
+
+        def progress(totals):
+            if options["verbosity"] > 1:
+                rate = totals["read"] / totals["seconds"] if totals["seconds"] else 0
+                self.stdout.write(
+                    f"  {totals['read']} rows read, {totals['inserted']} inserted ({rate:,.0f} rows/s)"
+                )
+
+        for path in options["files"]:
+            try:
+                totals = ingest.load_file(
+                    path, options["table"], chunk_rows=options["chunk_rows"],
+                    delimiter=options["delimiter"], encoding=options["encoding"], progress=progress,
+                )
+            except (OSError, ValueError) as e:
+                raise CommandError(f"{path}: {e}")
+            rate = totals["read"] / totals["seconds"] if totals["seconds"] else 0
+            self.stdout.write(self.style.SUCCESS(
+                f"{path}: {totals['inserted']} row(s) inserted, {totals['skipped']} duplicate(s) skipped, "
+                f"{totals['chunks']} chunk(s) in {totals['seconds']:.1f}s ({rate:,.0f} rows/s)"
+            ))
+            if totals["below_watermark"]:
+                self.stdout.write(self.style.WARNING(
+                    f"{path}: {totals['below_watermark']} row(s) have a uniqueid below the rollup/resolved "
+                    f"watermark; incremental refreshes skip them, run them with --full"
+                ))
+        if options["table"] == "gl_txn_raw":
+            self.stdout.write("Run refresh_gl_rollup / refresh_gl_resolved to fold the new rows in")
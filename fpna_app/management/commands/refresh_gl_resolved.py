@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from fpna_app import resolved
+
+
+class Command(BaseCommand):
+    help = "Incrementally resolve new gl_txn_raw rows and gl_account_map changes into public.gl_txn_resolved"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--create", action="store_true",
+                            help="Create the resolved table and finance.resolved_* functions first")
+        parser.add_argument("--full", action="store_true",
+                            help="Rebuild the table from scratch (e.g. after edits to existing ledger rows or backfills)")
+        parser.add_argument("--batch-size", type=int, default=250_000,
+                            help="Number of ledger rows resolved per transaction")
+
+    def handle(self, *args, **options):
+        if options["create"]:
+            resolved.ensure_schema()
+            self.stdout.write("Resolved ledger schema is up to date")
+
+        def progress(watermark, high):
+            if options["verbosity"] > 1:
+                self.stdout.write(f"  resolved up to uniqueid {watermark} of {high}")
+
+        result = resolved.refresh(full=options["full"], batch_size=options["batch_size"], progress=progress)
+        if result["remapped_entries"]:
+            self.stdout.write(
+                f"Re-resolved {result['remapped_rows']} row(s) for "
+                f"{result['remapped_entries']} changed gl_account_map entries"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Resolved ledger refreshed: uniqueid {result['start']} -> {result['end']}, "
+            f"{result['batches']} batch(es), {result['rows']} row(s) added"
+        ))
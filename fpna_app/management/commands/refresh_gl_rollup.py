@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from fpna_app import rollup
+
+
+class Command(BaseCommand):
+    help = "Incrementally fold new gl_txn_raw rows into public.gl_monthly_rollup"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--create", action="store_true",
+                            help="Create the rollup tables and finance.rollup_* functions first")
+        parser.add_argument("--full", action="store_true",
+                            help="Rebuild the rollup from scratch (e.g. after gl_account_map changes or backfills)")
+        parser.add_argument("--batch-size", type=int, default=250_000,
+                            help="Number of ledger rows folded per transaction")
+
+    def handle(self, *args, **options):
+        if options["create"]:
+            rollup.ensure_schema()
+            self.stdout.write("Rollup schema is up to date")
+
+        def progress(watermark, high):
+            if options["verbosity"] > 1:
+                self.stdout.write(f"  folded up to uniqueid {watermark} of {high}")
+
+        result = rollup.refresh(full=options["full"], batch_size=options["batch_size"], progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rollup refreshed: uniqueid {result['start']} -> {result['end']}, "
+            f"{result['batches']} batch(es), {result['rows']} rollup row(s) touched"
+        ))
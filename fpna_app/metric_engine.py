@@ -0,0 +1,95 @@
+import numpy as np
+
+
+class MetricEngine:
+    """
+    public.metric / public.metric_component compiled into a dense matrix.
+
+    Row i of `matrix` holds the signed weight of every leaf account in metric
+    i, with nested metrics already expanded, so the values of all metrics for
+    any number of columns are one matrix product with the account values.
+    """
+
+    def __init__(self, metric_names, components):
+        """
+        `components` is an iterable of (metric_name, ref_type, ref_name, op)
+        rows as stored in public.metric_component
+        """
+        self.metric_names = list(metric_names)
+        self.metric_index = {name: i for i, name in enumerate(self.metric_names)}
+
+        children = {name: [] for name in self.metric_names}
+        for metric_name, ref_type, ref_name, op in components:
+            children.setdefault(metric_name, []).append(
+                (ref_type, ref_name, 1 if op == '+' else -1)
+            )
+
+        leaves = {}
+        for name in self.metric_names:
+            self._expand(name, children, leaves, ())
+
+        self.account_names = sorted({account for weights in leaves.values() for account in weights})
+        self.account_index = {name: i for i, name in enumerate(self.account_names)}
+        self.matrix = np.zeros((len(self.metric_names), len(self.account_names)))
+        for name, weights in leaves.items():
+            row = self.metric_index[name]
+            for account, sign in weights.items():
+                self.matrix[row, self.account_index[account]] = sign
+
+    def _expand(self, name, children, leaves, path):
+        """
+        Return {account_name: signed weight} for a metric, memoised in `leaves`
+        """
+        if name in leaves:
+            return leaves[name]
+        if name in path:
+            raise ValueError(f"Metric definitions are cyclic: {' -> '.join(path + (name,))}")
+        weights = {}
+        for ref_type, ref_name, sign in children.get(name, []):
+            if ref_type == 'metric':
+                nested = self._expand(ref_name, children, leaves, path + (name,))
+                for account, weight in nested.items():
+                    weights[account] = weights.get(account, 0) + sign * weight
+            else:
+                weights[ref_name] = weights.get(ref_name, 0) + sign
+        leaves[name] = weights
+        return weights
+
+    def evaluate(self, accounts):
+        """
+        Metric values for an account vector, or an (accounts x columns) matrix
+        """
+        return self.matrix @ accounts
+
+    def monthly_average(self, matrix, months=slice(None)):
+        """
+        Per-metric average of the metric's monthly totals over the months of
+        a PeriodMatrix column slice in which any of its accounts posted, NaN
+        where none did (finance.actual_metric_average). Averaging the
+        accounts' own averages instead would count each account's months
+        separately.
+        """
+        positions = np.fromiter((self.account_index.get(name, -1) for name in matrix.row_names),
+                                dtype=np.int64, count=len(matrix.row_names))
+        used = positions >= 0
+        values = matrix.values[:, months][used]
+        present = matrix.present[:, months][used]
+        accounts = np.zeros((len(self.account_names), values.shape[1]))
+        posted = np.zeros(accounts.shape)
+        np.add.at(accounts, positions[used], values)
+        np.add.at(posted, positions[used], present)
+        totals = self.matrix @ accounts
+        metric_present = ((self.matrix != 0) @ (posted > 0)) > 0
+        count = metric_present.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(count > 0, np.where(metric_present, totals, 0).sum(axis=1) / count, np.nan)
+
+
+def get_metric_engine():
+    """
+    Process-wide MetricEngine, compiled from the cached reference data and
+    rebuilt whenever the metric definitions change
+    """
+    from .reference import get_reference_data
+    return get_reference_data().metric_engine
+
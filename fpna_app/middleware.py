@@ -0,0 +1,245 @@
+import re
+import threading
+from datetime import datetime
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # optional; without it responses are only gzipped
+    brotli = None
+
+from . import profiling
+from .cache import current_period
+from .timing import RequestTimings, log_slow_request, request_timings, server_timing_header
+
+re_accepts_br = re.compile(r"\bbr\b")
+
+
+class ReportPeriodMiddleware:
+    """
+    Expose the session's current month/year to the db layer, which uses it to
+    tell closed periods from open ones when caching report results.
+
+    Sync and async capable, so async views don't pay a thread hop for it.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        now = datetime.now()
+        try:
+            period = (
+                int(request.session.get('current_year', now.year)),
+                int(request.session.get('current_month', now.month)),
+            )
+        except AttributeError:
+            period = (now.year, now.month)
+        token = current_period.set(period)
+        try:
+            return self.get_response(request)
+        finally:
+            current_period.reset(token)
+
+    async def __acall__(self, request):
+        now = datetime.now()
+        try:
+            period = (
+                int(await request.session.aget('current_year', now.year)),
+                int(await request.session.aget('current_month', now.month)),
+            )
+        except AttributeError:
+            period = (now.year, now.month)
+        token = current_period.set(period)
+        try:
+            return await self.get_response(request)
+        finally:
+            current_period.reset(token)
+
+
+class ServerTimingMiddleware:
+    """
+    With FPNA_REQUEST_TIMING on, time each request's database calls and
+    phases (see fpna_app.timing), report them in a Server-Timing header and
+    write requests slower than FPNA_SLOW_REQUEST_MS to the slow-request log
+    as one JSON line. Off, it just passes the request through.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, "FPNA_REQUEST_TIMING", False)
+        self.slow_ms = getattr(settings, "FPNA_SLOW_REQUEST_MS", 500)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _finish(self, request, response, timings):
+        total_ms = timings.total_ms()
+        response["Server-Timing"] = server_timing_header(timings, total_ms)
+        if total_ms >= self.slow_ms:
+            log_slow_request(request, response, timings, total_ms)
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        timings = RequestTimings()
+        token = request_timings.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_timings.reset(token)
+        return self._finish(request, response, timings)
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        timings = RequestTimings()
+        token = request_timings.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_timings.reset(token)
+        return self._finish(request, response, timings)
+
+
+class ProfilingMiddleware:
+    """
+    With FPNA_PROFILING on, let staff profile a single request by adding
+    ?profile=1 (or an X-FPNA-Profile: 1 header). The request's Python stacks
+    are sampled every FPNA_PROFILE_INTERVAL_MS and kept, with its database
+    calls and phases, in this worker's ring buffer of recent profiles (see
+    /status/profiles/); the response carries the profile id in an
+    X-FPNA-Profile header. ?profile=collapsed returns the collapsed stacks
+    instead of the page.
+
+    At most one request per worker is profiled at a time and at most
+    FPNA_PROFILE_RATE_PER_MINUTE per minute; over that, requests are served
+    unprofiled with "X-FPNA-Profile: rate-limited". Must come after
+    AuthenticationMiddleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, "FPNA_PROFILING", False)
+        self.interval = getattr(settings, "FPNA_PROFILE_INTERVAL_MS", 5) / 1000
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _requested(self, request):
+        if not self.enabled:
+            return None
+        return request.GET.get("profile") or request.headers.get("X-FPNA-Profile")
+
+    def _start(self):
+        timings = request_timings.get()
+        token = None
+        if timings is None:
+            # Request timing is off; collect this request's SQL timings anyway
+            timings = RequestTimings()
+            token = request_timings.set(timings)
+        sampler = profiling.StackSampler(threading.get_ident(), self.interval)
+        return timings, token, sampler
+
+    def _finish(self, request, response, mode, timings, sampler):
+        profile_id = profiling.store(request, sampler, timings, timings.total_ms())
+        if mode == "collapsed":
+            response = HttpResponse(sampler.collapsed(), content_type="text/plain; charset=utf-8")
+        response["X-FPNA-Profile"] = str(profile_id)
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        mode = self._requested(request)
+        if not mode or not request.user.is_staff:
+            return self.get_response(request)
+        if not profiling.acquire():
+            response = self.get_response(request)
+            response["X-FPNA-Profile"] = "rate-limited"
+            return response
+        timings, token, sampler = self._start()
+        try:
+            with sampler:
+                response = self.get_response(request)
+        finally:
+            if token is not None:
+                request_timings.reset(token)
+            profiling.release()
+        return self._finish(request, response, mode, timings, sampler)
+
+    async def __acall__(self, request):
+        # Under ASGI this samples the event loop thread: async views profile
+        # fully, sync views only show up as the await on their worker thread
+        mode = self._requested(request)
+        if not mode or not (await request.auser()).is_staff:
+            return await self.get_response(request)
+        if not profiling.acquire():
+            response = await self.get_response(request)
+            response["X-FPNA-Profile"] = "rate-limited"
+            return response
+        timings, token, sampler = self._start()
+        try:
+            with sampler:
+                response = await self.get_response(request)
+        finally:
+            if token is not None:
+                request_timings.reset(token)
+            profiling.release()
+        return self._finish(request, response, mode, timings, sampler)
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware that answers with brotli instead when the client accepts
+    it and the brotli package is installed. The report tables compress far
+    better with brotli at FPNA_BROTLI_QUALITY than with gzip. Streaming
+    responses (transactions drill-down, CSV export) stay on gzip.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.brotli_quality = getattr(settings, "FPNA_BROTLI_QUALITY", 5)
+
+    def process_response(self, request, response):
+        if (
+            brotli is None
+            or response.streaming
+            or len(response.content) < 200
+            or response.has_header("Content-Encoding")
+            or not re_accepts_br.search(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        ):
+            return super().process_response(request, response)
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        compressed = brotli.compress(response.content, quality=self.brotli_quality)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response.headers["Content-Length"] = str(len(response.content))
+        # The encoded body differs byte-wise, so the ETag becomes weak, as
+        # GZipMiddleware does; If-None-Match still matches weakly
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = "br"
+        return response
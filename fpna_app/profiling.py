@@ -0,0 +1,99 @@
+import itertools
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from django.conf import settings
+
+# Most recent profiles of this process, newest last
+profiles = deque(maxlen=getattr(settings, "FPNA_PROFILE_BUFFER", 20))
+_ids = itertools.count(1)
+_recent = deque()
+_lock = threading.Lock()
+# One profile at a time per process, so profiling never stacks up under load
+_active = threading.Lock()
+
+
+class StackSampler:
+    """
+    Sample one thread's Python stack every `interval` seconds from a
+    background thread and count the stacks, in the collapsed format flame
+    graph tools read ("outer;inner;leaf count")
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="fpna-profiler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_qualname}")
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        return "\n".join(f"{stack} {count}" for stack, count in self.counts.most_common())
+
+
+def acquire():
+    """
+    Reserve the profiler for one request, subject to
+    FPNA_PROFILE_RATE_PER_MINUTE; returns False if the caller must run
+    unprofiled. Pair a True result with release().
+    """
+    limit = getattr(settings, "FPNA_PROFILE_RATE_PER_MINUTE", 6)
+    now = time.monotonic()
+    with _lock:
+        while _recent and now - _recent[0] > 60:
+            _recent.popleft()
+        if len(_recent) >= limit or not _active.acquire(blocking=False):
+            return False
+        _recent.append(now)
+        return True
+
+
+def release():
+    _active.release()
+
+
+def store(request, sampler, timings, total_ms):
+    """
+    Add a finished profile to the ring buffer and return its id
+    """
+    profile_id = next(_ids)
+    profiles.append({
+        "id": profile_id,
+        "ts": time.time(),
+        "path": request.get_full_path(),
+        "user": request.user.get_username(),
+        "total_ms": round(total_ms, 2),
+        "samples": sum(sampler.counts.values()),
+        "db_ms": round(timings.db_ms(), 2),
+        "queries": timings.queries,
+        "phases": dict(timings.phases),
+        "collapsed": sampler.collapsed(),
+    })
+    return profile_id
+
+
+def get_profile(profile_id):
+    for profile in list(profiles):
+        if profile["id"] == profile_id:
+            return profile
+    return None
@@ -0,0 +1,115 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+# Cheap fingerprint of the reference tables. They hold at most a few hundred
+# rows, so hashing every row catches edits as well as inserts and deletes.
+VERSION_SQL = """
+    SELECT
+      (SELECT count(*) || ':' || coalesce(sum(hashtext(companyid)), 0)
+         FROM public.company),
+      (SELECT count(*) || ':' || coalesce(sum(hashtext(account_name || ':' || range_start || ':' || range_end || ':' || erp_sign)), 0)
+         FROM public.gl_account_map),
+      (SELECT count(*) || ':' || coalesce(sum(hashtext(metric_id || ':' || metric_name)), 0)
+         FROM public.metric),
+      (SELECT count(*) || ':' || coalesce(sum(hashtext(metric_id || ':' || ref_type || ':' || ref_name || ':' || op)), 0)
+         FROM public.metric_component)
+"""
+
+
+class ReferenceData:
+    """
+    Snapshot of public.company, public.gl_account_map and the metric
+    definitions, plus the MetricEngine compiled from them
+    """
+
+    def __init__(self, version, companies, account_map, metric_names, metric_components):
+        self.version = version
+        self.companies = companies
+        # (account_name, range_start, range_end, erp_sign) ordered by range_start
+        self.account_map = account_map
+        self.account_names = sorted({row[0] for row in account_map})
+        self.metric_names = metric_names
+        # (metric_name, ref_type, ref_name, op)
+        self.metric_components = metric_components
+        self._metric_engine = None
+        self._engine_lock = threading.Lock()
+
+    @classmethod
+    def load(cls, version):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT companyid FROM public.company ORDER BY companyid")
+            companies = [row[0] for row in cursor.fetchall()]
+            cursor.execute("""
+                SELECT account_name, range_start, range_end, erp_sign
+                FROM public.gl_account_map
+                ORDER BY range_start
+            """)
+            account_map = cursor.fetchall()
+            cursor.execute("SELECT metric_name FROM public.metric ORDER BY metric_name")
+            metric_names = [row[0] for row in cursor.fetchall()]
+            cursor.execute("""
+                SELECT m.metric_name, mc.ref_type, mc.ref_name, mc.op
+                FROM public.metric_component mc
+                JOIN public.metric m ON m.metric_id = mc.metric_id
+            """)
+            metric_components = cursor.fetchall()
+        return cls(version, companies, account_map, metric_names, metric_components)
+
+    @property
+    def metric_engine(self):
+        """
+        MetricEngine for these definitions, compiled on first use
+        """
+        with self._engine_lock:
+            if self._metric_engine is None:
+                from .metric_engine import MetricEngine
+                self._metric_engine = MetricEngine(self.metric_names, self.metric_components)
+            return self._metric_engine
+
+
+_reference = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def _current_version():
+    with connection.cursor() as cursor:
+        cursor.execute(VERSION_SQL)
+        return tuple(cursor.fetchone())
+
+
+def get_reference_data():
+    """
+    Process-wide ReferenceData, loaded lazily.
+
+    The version fingerprint is re-checked at most every
+    FPNA_REFERENCE_CHECK_INTERVAL seconds and the data reloaded only if it
+    changed, so steady-state page renders issue no reference queries.
+    """
+    global _reference, _checked_at
+    interval = getattr(settings, "FPNA_REFERENCE_CHECK_INTERVAL", 30)
+    with _lock:
+        now = time.monotonic()
+        if _reference is not None and now - _checked_at < interval:
+            return _reference
+        version = _current_version()
+        if _reference is None or _reference.version != version:
+            _reference = ReferenceData.load(version)
+        _checked_at = now
+        return _reference
+
+
+def get_companies():
+    return get_reference_data().companies
+
+
+def invalidate_reference_data():
+    """
+    Force a version check (and reload if needed) on the next access
+    """
+    global _checked_at
+    with _lock:
+        _checked_at = 0.0
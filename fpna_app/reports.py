@@ -0,0 +1,160 @@
+from django.conf import settings
+
+from .cache import get_current_period
+from .db import fetch_monthly_accounts, is_monthly_accounts_cached
+from .derived import ReportColumn, derive_report, quarter_start, shift_period
+from .layout import get_layout
+from .metric_engine import get_metric_engine
+from .singleflight import async_report_flight, single_flight
+from .timing import phase
+
+
+# The line items, groups and percentage rows live in
+# layouts/budget_vs_actual.json, compiled once per process
+BUDGET_VS_ACTUAL = get_layout("budget_vs_actual")
+
+# group -> account names, in display order
+BUDGET_VS_ACTUAL_GROUPS = BUDGET_VS_ACTUAL.groups
+
+
+def _quarter(year, period, quarters_back):
+    """
+    (label, start_year, start_period, end_year, end_period) of the quarter
+    `quarters_back` quarters before the one containing (year, period)
+    """
+    start = shift_period(*quarter_start(year, period), -3 * quarters_back)
+    end = shift_period(*start, 3)
+    return f"Q{(start[1] - 1) // 3 + 1} {start[0]}", start[0], start[1], end[0], end[1]
+
+
+def budget_vs_actual_columns(period=None):
+    """
+    Columns of the Budget vs. Actual report for the session's current period
+    (defaults to get_current_period()): actuals for the last two closed
+    quarters, budget/average/variance for the last one and budget for the
+    quarter in progress.
+
+    The keys are the financial_data keys the template and exports read.
+    """
+    year, month = period or get_current_period()
+    prior_label, *prior = _quarter(year, month, 2)
+    last_label, *last = _quarter(year, month, 1)
+    current_label, *current = _quarter(year, month, 0)
+    return (
+        ReportColumn("q1_actual", f"{prior_label} Actual", "actual", "total", *prior),
+        ReportColumn("q2_actual", f"{last_label} Actual", "actual", "total", *last),
+        ReportColumn("q2_budget", f"{last_label} Budget", "budget", "total", *last),
+        ReportColumn("q2_average", f"{last_label} Average", "actual", "average", *last),
+        ReportColumn("variance", f"{last_label} Var B/(W)", "actual", "variance", *last),
+        ReportColumn("q3_budget", f"{current_label} Budget", "budget", "total", *current),
+    )
+
+
+def report_window(columns, period=None):
+    """
+    Half-open (year, period) range fetched for a report: the trailing
+    FPNA_REPORT_TRAILING_MONTHS and FPNA_REPORT_HORIZON_MONTHS of budget
+    around the current period, widened to cover every column
+    """
+    year, month = period or get_current_period()
+    trailing = getattr(settings, "FPNA_REPORT_TRAILING_MONTHS", 24)
+    horizon = getattr(settings, "FPNA_REPORT_HORIZON_MONTHS", 6)
+    start = min([shift_period(year, month, -trailing)] + [(c.start_year, c.start_period) for c in columns])
+    end = max([shift_period(year, month, horizon)] + [(c.end_year, c.end_period) for c in columns])
+    return start + end
+
+
+def is_budget_vs_actual_cached(company_ids, period=None):
+    """
+    True if the data behind a company set's report is in report_cache, i.e.
+    rendering it would run no report queries
+    """
+    columns = budget_vs_actual_columns(period)
+    return is_monthly_accounts_cached(*report_window(columns, period), company_ids)
+
+
+def get_budget_vs_actual(company_ids, period=None, detail=True):
+    """
+    Budget vs. Actual rows for a company set, computed once for all concurrent
+    requests for the same report (see fpna_app.singleflight).
+
+    Without `detail`, each group's account rows are replaced by one "group"
+    placeholder row, to be filled in by get_budget_vs_actual_group(). The
+    page, the exports and the warm-up share one computation either way.
+    """
+    period = period or get_current_period()
+    key = ("budget_vs_actual", tuple(company_ids), period)
+    rows = single_flight(key, lambda: build_budget_vs_actual(company_ids, period))
+    return rows if detail else BUDGET_VS_ACTUAL.collapse(rows)
+
+
+async def aget_budget_vs_actual(company_ids, period=None, detail=True):
+    """
+    get_budget_vs_actual for async views: fetched on the async pool and
+    coalesced per event loop
+    """
+    period = period or get_current_period()
+    key = ("budget_vs_actual", tuple(company_ids), period)
+    rows = await async_report_flight.do(key, lambda: abuild_budget_vs_actual(company_ids, period))
+    return rows if detail else BUDGET_VS_ACTUAL.collapse(rows)
+
+
+async def abuild_budget_vs_actual(company_ids, period=None):
+    from asgiref.sync import sync_to_async
+
+    from .async_db import afetch_monthly_accounts
+
+    columns = budget_vs_actual_columns(period)
+    monthly = await afetch_monthly_accounts(*report_window(columns, period), company_ids=company_ids)
+    # Usually served from memory, but a reference data re-check queries Django's connection
+    engine = await sync_to_async(get_metric_engine)()
+    with phase("assemble"):
+        return assemble_budget_vs_actual(monthly, columns, engine)
+
+
+def build_budget_vs_actual(company_ids, period=None):
+    """
+    Build the Budget vs. Actual rows (one dict per line item) for a company set
+    """
+    # One per-month fetch over the whole window; every column is sliced from
+    # it in memory (see fpna_app.derived). Metric rows are evaluated from the
+    # accounts, so even the collapsed report needs all of them.
+    columns = budget_vs_actual_columns(period)
+    monthly = fetch_monthly_accounts(*report_window(columns, period), company_ids=company_ids)
+    engine = get_metric_engine()
+    with phase("assemble"):
+        return assemble_budget_vs_actual(monthly, columns, engine)
+
+
+def get_budget_vs_actual_group(company_ids, group, period=None):
+    """
+    Account rows of one report group, as returned by get_budget_vs_actual()
+    """
+    if group not in BUDGET_VS_ACTUAL_GROUPS:
+        raise ValueError(f"Unknown report group: {group}")
+    period = period or get_current_period()
+    key = ("budget_vs_actual_group", tuple(company_ids), group, period)
+    return single_flight(key, lambda: build_budget_vs_actual_group(company_ids, group, period))
+
+
+def build_budget_vs_actual_group(company_ids, group, period=None):
+    columns = budget_vs_actual_columns(period)
+    window = report_window(columns, period)
+    # The page's own window fetch usually still has every account; otherwise
+    # fetch just this group's accounts (p_components)
+    components = None if is_budget_vs_actual_cached(company_ids, period) else BUDGET_VS_ACTUAL_GROUPS[group]
+    monthly = fetch_monthly_accounts(*window, company_ids=company_ids, components=components)
+    with phase("assemble"):
+        accounts_data = derive_report(monthly["actual"], monthly["budget"], columns)
+        return BUDGET_VS_ACTUAL.group_rows(group, accounts_data, columns)
+
+
+def assemble_budget_vs_actual(monthly, columns, engine):
+    """
+    Report rows from a fetch_monthly_accounts window; no database access, so
+    the sync and async views share it
+    """
+    accounts_data = derive_report(monthly["actual"], monthly["budget"], columns)
+    # Metric rows come from the account columns and percentage rows from the
+    # line values, all gathered into the layout's rows (see fpna_app.layout)
+    return BUDGET_VS_ACTUAL.rows(accounts_data, columns, engine, monthly)
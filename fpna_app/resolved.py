@@ -0,0 +1,179 @@
+"""
+Resolved ledger (public.gl_txn_resolved).
+
+A materialized copy of the gl_txn_signed view: every gl_txn_raw row joined to
+its gl_account_map entries with the signed amount precomputed. New ledger rows
+are appended by uniqueid watermark; gl_account_map edits re-resolve only the
+account ranges they touch.
+"""
+from pathlib import Path
+
+from django.db import connection, transaction
+
+from . import rollup
+
+SCHEMA_SQL = Path(__file__).resolve().parent / "sql" / "gl_txn_resolved.sql"
+WATERMARK_NAME = "gl_txn_resolved"
+
+RESOLVED_COLUMNS = """
+    t.gl_account, t.companyid, t.customer, t.posting_date, t.description,
+    t.extdescription, t.amount_raw, t.invoicetype, t.invvouch, t.postperiod,
+    t.postyear, t.source, t.sourcekey, t.supplierinvnum, t.transcode,
+    t.uniqueid, m.account_name, t.amount_raw * m.erp_sign, m.tags
+"""
+
+# Resolves gl_txn_raw rows with uniqueid in (%s, %s]
+APPEND_SQL = f"""
+    INSERT INTO public.gl_txn_resolved
+    SELECT {RESOLVED_COLUMNS}
+    FROM public.gl_txn_raw t
+    JOIN public.gl_account_map m
+      ON t.gl_account::int4 <@ m.acct_range
+    WHERE t.uniqueid > %s AND t.uniqueid <= %s
+    ON CONFLICT (uniqueid, account_name) DO NOTHING
+"""
+
+# Map entries added, removed or edited since the last resolve, old and new
+CHANGED_RANGES_SQL = """
+    CREATE TEMP TABLE resolved_changed_ranges ON COMMIT DROP AS
+    SELECT acct_range FROM (
+        (SELECT account_name, acct_range, erp_sign, tags FROM public.gl_account_map
+         EXCEPT
+         SELECT account_name, acct_range, erp_sign, tags FROM public.gl_txn_resolved_map)
+        UNION ALL
+        (SELECT account_name, acct_range, erp_sign, tags FROM public.gl_txn_resolved_map
+         EXCEPT
+         SELECT account_name, acct_range, erp_sign, tags FROM public.gl_account_map)
+    ) changed
+"""
+
+# Drop and re-resolve the ledger rows (up to the watermark) of every
+# gl_account inside a changed range, against the whole current map
+REMAP_DELETE_SQL = """
+    DELETE FROM public.gl_txn_resolved r
+    USING resolved_changed_ranges c
+    WHERE r.gl_account <@ c.acct_range
+"""
+REMAP_INSERT_SQL = f"""
+    INSERT INTO public.gl_txn_resolved
+    SELECT {RESOLVED_COLUMNS}
+    FROM public.gl_txn_raw t
+    JOIN public.gl_account_map m
+      ON t.gl_account::int4 <@ m.acct_range
+    WHERE t.uniqueid <= %s
+      AND EXISTS (SELECT 1 FROM resolved_changed_ranges c WHERE t.gl_account::int4 <@ c.acct_range)
+"""
+
+SNAPSHOT_MAP_SQL = """
+    DELETE FROM public.gl_txn_resolved_map;
+    INSERT INTO public.gl_txn_resolved_map (account_name, acct_range, erp_sign, tags)
+    SELECT account_name, acct_range, erp_sign, tags FROM public.gl_account_map;
+"""
+
+
+def ensure_schema():
+    """
+    Create the resolved table, its map snapshot and the finance.resolved_*
+    functions if missing (along with the rollup schema, which provides
+    finance.metric_leaf_accounts)
+    """
+    rollup.ensure_schema()
+    with connection.cursor() as cursor:
+        cursor.execute(SCHEMA_SQL.read_text())
+
+
+def _lock_watermark(cursor):
+    cursor.execute(
+        "SELECT last_uniqueid FROM public.rollup_watermark WHERE name = %s FOR UPDATE",
+        [WATERMARK_NAME],
+    )
+    row = cursor.fetchone()
+    if row is None:
+        raise RuntimeError("Resolved ledger schema is missing; run `manage.py refresh_gl_resolved --create` first")
+    return row[0]
+
+
+def _set_watermark(cursor, uniqueid):
+    cursor.execute(
+        "UPDATE public.rollup_watermark SET last_uniqueid = %s, refreshed_at = now() WHERE name = %s",
+        [uniqueid, WATERMARK_NAME],
+    )
+
+
+def remap():
+    """
+    Re-resolve the ledger rows whose account falls in a gl_account_map entry
+    that changed since the last resolve, then record the current map.
+
+    Returns (changed map entries, resolved rows rewritten).
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        watermark = _lock_watermark(cursor)
+        cursor.execute(CHANGED_RANGES_SQL)
+        cursor.execute("SELECT count(*) FROM resolved_changed_ranges")
+        changed = cursor.fetchone()[0]
+        if not changed:
+            return 0, 0
+        cursor.execute(REMAP_DELETE_SQL)
+        cursor.execute(REMAP_INSERT_SQL, [watermark])
+        rows = cursor.rowcount
+        cursor.execute(SNAPSHOT_MAP_SQL)
+        # Bumps refreshed_at, which report ETags follow
+        _set_watermark(cursor, watermark)
+        return changed, rows
+
+
+def refresh(full=False, batch_size=250_000, progress=None):
+    """
+    Bring gl_txn_resolved up to date with gl_txn_raw and gl_account_map.
+
+    Map changes are applied first (see remap()); then ledger rows above the
+    stored uniqueid watermark are appended one batch of `batch_size` rows
+    per transaction, so an interrupted run resumes where it stopped. Rows
+    loaded later with a uniqueid below the watermark are never appended (the
+    loader reports them). `full=True` rebuilds the table in one transaction,
+    which is needed after such backfills or edits to already-resolved
+    ledger rows.
+
+    `progress`, if given, is called with (watermark, high_watermark) after
+    each batch. Returns a dict describing the run.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT COALESCE(MAX(uniqueid), 0) FROM public.gl_txn_raw")
+        high = cursor.fetchone()[0]
+
+        if full:
+            with transaction.atomic():
+                _lock_watermark(cursor)
+                cursor.execute("TRUNCATE public.gl_txn_resolved")
+                cursor.execute(APPEND_SQL, [0, high])
+                rows = cursor.rowcount
+                cursor.execute(SNAPSHOT_MAP_SQL)
+                _set_watermark(cursor, high)
+            if progress:
+                progress(high, high)
+            return {"full": True, "start": 0, "end": high, "batches": 1, "rows": rows,
+                    "remapped_entries": 0, "remapped_rows": 0}
+
+        remapped_entries, remapped_rows = remap()
+        with transaction.atomic():
+            start = _lock_watermark(cursor)
+        watermark = start
+        batches = 0
+        rows = 0
+        while watermark < high:
+            with transaction.atomic():
+                # Re-read under lock so concurrent refreshes never append a range twice
+                watermark = _lock_watermark(cursor)
+                if watermark >= high:
+                    break
+                upper = rollup.next_batch_upper(cursor, watermark, high, batch_size)
+                cursor.execute(APPEND_SQL, [watermark, upper])
+                rows += cursor.rowcount
+                _set_watermark(cursor, upper)
+            watermark = upper
+            batches += 1
+            if progress:
+                progress(watermark, high)
+        return {"full": False, "start": start, "end": max(watermark, start), "batches": batches, "rows": rows,
+                "remapped_entries": remapped_entries, "remapped_rows": remapped_rows}
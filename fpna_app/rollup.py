@@ -0,0 +1,125 @@
+"""
+Monthly actuals rollup (public.gl_monthly_rollup).
+
+gl_txn_raw is folded into one row per (companyid, account_name, postyear,
+postperiod) so the finance.rollup_* functions can answer account, metric and
+average queries without the range join against gl_account_map.
+"""
+from pathlib import Path
+
+from django.db import connection, transaction
+
+SCHEMA_SQL = Path(__file__).resolve().parent / "sql" / "gl_monthly_rollup.sql"
+WATERMARK_NAME = "gl_monthly_rollup"
+
+# Adds the signed amounts of gl_txn_raw rows with uniqueid in (%s, %s] to the rollup
+FOLD_SQL = """
+    INSERT INTO public.gl_monthly_rollup AS r
+        (companyid, account_name, postyear, postperiod, amount, txn_count)
+    SELECT t.companyid, m.account_name, t.postyear, t.postperiod,
+           SUM(t.amount_raw * m.erp_sign), COUNT(*)
+    FROM public.gl_txn_raw t
+    JOIN public.gl_account_map m
+      ON t.gl_account::int4 <@ m.acct_range
+    WHERE t.uniqueid > %s AND t.uniqueid <= %s
+    GROUP BY t.companyid, m.account_name, t.postyear, t.postperiod
+    ON CONFLICT (companyid, account_name, postyear, postperiod) DO UPDATE
+       SET amount = r.amount + EXCLUDED.amount,
+           txn_count = r.txn_count + EXCLUDED.txn_count
+"""
+
+# Upper bound of the next batch: the batch_size-th uniqueid above the
+# watermark (an index scan on gl_txn_raw_unique), since uniqueids are sparse
+NEXT_BATCH_SQL = """
+    SELECT uniqueid FROM public.gl_txn_raw
+    WHERE uniqueid > %s AND uniqueid <= %s
+    ORDER BY uniqueid
+    OFFSET %s LIMIT 1
+"""
+
+
+def ensure_schema():
+    """
+    Create the rollup tables and finance.rollup_* functions if missing
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(SCHEMA_SQL.read_text())
+
+
+def _lock_watermark(cursor):
+    cursor.execute(
+        "SELECT last_uniqueid FROM public.rollup_watermark WHERE name = %s FOR UPDATE",
+        [WATERMARK_NAME],
+    )
+    row = cursor.fetchone()
+    if row is None:
+        raise RuntimeError("Rollup schema is missing; run `manage.py refresh_gl_rollup --create` first")
+    return row[0]
+
+
+def _set_watermark(cursor, uniqueid):
+    cursor.execute(
+        "UPDATE public.rollup_watermark SET last_uniqueid = %s, refreshed_at = now() WHERE name = %s",
+        [uniqueid, WATERMARK_NAME],
+    )
+
+
+def next_batch_upper(cursor, watermark, high, batch_size):
+    """
+    Upper uniqueid of a batch of at most `batch_size` ledger rows above
+    `watermark`, capped at `high`
+    """
+    cursor.execute(NEXT_BATCH_SQL, [watermark, high, max(batch_size, 1) - 1])
+    row = cursor.fetchone()
+    return row[0] if row else high
+
+
+def refresh(full=False, batch_size=250_000, progress=None):
+    """
+    Fold gl_txn_raw rows above the stored uniqueid watermark into the rollup.
+
+    Incremental refreshes commit one batch of `batch_size` ledger rows at a
+    time, so an interrupted run resumes where it stopped. Rows loaded later
+    with a uniqueid below the watermark are never folded in (the loader
+    reports them). `full=True` rebuilds the table from scratch in one
+    transaction, which is needed after such backfills, gl_account_map
+    changes or edits to already-folded ledger rows.
+
+    `progress`, if given, is called with (watermark, high_watermark) after
+    each batch. Returns a dict describing the run.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT COALESCE(MAX(uniqueid), 0) FROM public.gl_txn_raw")
+        high = cursor.fetchone()[0]
+
+        if full:
+            with transaction.atomic():
+                _lock_watermark(cursor)
+                cursor.execute("DELETE FROM public.gl_monthly_rollup")
+                cursor.execute(FOLD_SQL, [0, high])
+                rows = cursor.rowcount
+                _set_watermark(cursor, high)
+            if progress:
+                progress(high, high)
+            return {"full": True, "start": 0, "end": high, "batches": 1, "rows": rows}
+
+        with transaction.atomic():
+            start = _lock_watermark(cursor)
+        watermark = start
+        batches = 0
+        rows = 0
+        while watermark < high:
+            with transaction.atomic():
+                # Re-read under lock so concurrent refreshes never fold a range twice
+                watermark = _lock_watermark(cursor)
+                if watermark >= high:
+                    break
+                upper = next_batch_upper(cursor, watermark, high, batch_size)
+                cursor.execute(FOLD_SQL, [watermark, upper])
+                rows += cursor.rowcount
+                _set_watermark(cursor, upper)
+            watermark = upper
+            batches += 1
+            if progress:
+                progress(watermark, high)
+        return {"full": False, "start": start, "end": max(watermark, start), "batches": batches, "rows": rows}
@@ -0,0 +1,228 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+
+
+class _Call:
+    __slots__ = ("started", "event", "result", "error")
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls with the same key within a process: the first
+    caller computes, everyone else arriving meanwhile waits for its result
+    (or its exception).
+
+    Followers give up with TimeoutError `timeout` seconds after the leader
+    starts computing. With `report_start`, `fn` is called with a callback it
+    invokes once it is done waiting for anything else (e.g. a lock held by
+    another process), so that wait does not count against the followers.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key, fn, timeout=None, report_start=False):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if not leader:
+            call.started.wait()
+            if not call.event.wait(timeout):
+                raise TimeoutError(f"Timed out waiting for in-flight computation of {key!r}")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            if report_start:
+                call.result = fn(call.started.set)
+            else:
+                call.started.set()
+                call.result = fn()
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.started.set()
+            call.event.set()
+
+    def stats(self):
+        with self._lock:
+            return {"leaders": self.leaders, "followers": self.followers, "in_flight": len(self._calls)}
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for coroutines on one event loop: followers await the
+    leader's future instead of blocking a thread
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key, fn):
+        future = self._calls.get(key)
+        if future is not None:
+            self.followers += 1
+            return await asyncio.shield(future)
+
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        self.leaders += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as error:
+            future.set_exception(error)
+            # Mark it retrieved so a flight without followers doesn't log
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+
+    def stats(self):
+        return {"leaders": self.leaders, "followers": self.followers, "in_flight": len(self._calls)}
+
+
+def _locked_file_flight(key, fn, lock_dir, share_ttl, timeout, started=None):
+    """
+    Cross-process single flight: serialise on an flock()ed file per key and
+    share the leader's JSON result with processes that queued behind it.
+
+    Only a result written after this caller started waiting is reused, so a
+    result is never served to a later request (nothing would invalidate it).
+    Each holder removes the lock file when done, and result files are swept
+    once older than `share_ttl` seconds. After `timeout` seconds without the
+    lock, `fn` is computed anyway rather than failing the request. `started`
+    is called once the lock is held or the wait given up.
+    """
+    import fcntl
+
+    digest = hashlib.sha256(repr(key).encode()).hexdigest()[:32]
+    os.makedirs(lock_dir, exist_ok=True)
+    lock_path = os.path.join(lock_dir, f"{digest}.lock")
+    result_path = os.path.join(lock_dir, f"{digest}.json")
+    waiting_since = time.time()
+    deadline = time.monotonic() + timeout if timeout is not None else None
+
+    while True:
+        with open(lock_path, "a") as lock_file:
+            locked = False
+            while not locked:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    locked = True
+                except BlockingIOError:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        break
+                    time.sleep(0.05)
+            if not locked:
+                # The holder is slower than a request may wait: computing
+                # the report twice beats failing the request
+                if started:
+                    started()
+                return fn()
+            try:
+                current = os.stat(lock_path)
+            except FileNotFoundError:
+                current = None
+            if current is None or current.st_ino != os.fstat(lock_file.fileno()).st_ino:
+                # Whoever held it removed this file: its result (if any) is
+                # read under the next lock
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                continue
+            if started:
+                started()
+            try:
+                try:
+                    if os.path.getmtime(result_path) > waiting_since:
+                        with open(result_path) as f:
+                            return json.load(f)
+                except (OSError, ValueError):
+                    pass
+                result = fn()
+                tmp_path = f"{result_path}.{os.getpid()}"
+                with open(tmp_path, "w") as f:
+                    json.dump(result, f, default=str)
+                os.replace(tmp_path, result_path)
+                _sweep(lock_dir, share_ttl)
+                return result
+            finally:
+                # Anyone still queued on this file notices and moves on
+                os.unlink(lock_path)
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _sweep(lock_dir, max_age):
+    """
+    Remove result files nobody can still be waiting for
+    """
+    cutoff = time.time() - max_age
+    for entry in os.scandir(lock_dir):
+        if entry.name.endswith(".json"):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+            except OSError:
+                pass
+
+
+report_flight = SingleFlight()
+async_report_flight = AsyncSingleFlight()
+
+
+def single_flight(key, fn):
+    """
+    Run `fn` once for all concurrent callers with the same key.
+
+    Within a worker, callers are coalesced in memory. When
+    FPNA_SINGLEFLIGHT_LOCK_DIR is set, the leader additionally takes a lock
+    file so workers on the same host compute each report once, and hands its
+    (JSON-serialisable) result to the others that were already waiting.
+    Result files are removed after FPNA_SINGLEFLIGHT_SHARE_TTL seconds.
+
+    FPNA_SINGLEFLIGHT_TIMEOUT bounds both the wait for the lock file, after
+    which the worker computes on its own, and how long in-worker followers
+    wait once their leader is computing.
+    """
+    lock_dir = getattr(settings, "FPNA_SINGLEFLIGHT_LOCK_DIR", None)
+    timeout = getattr(settings, "FPNA_SINGLEFLIGHT_TIMEOUT", 120)
+    if lock_dir:
+        share_ttl = getattr(settings, "FPNA_SINGLEFLIGHT_SHARE_TTL", 30)
+        return report_flight.do(
+            key,
+            lambda started: _locked_file_flight(key, fn, lock_dir, share_ttl, timeout, started),
+            timeout,
+            report_start=True,
+        )
+    return report_flight.do(key, fn, timeout)
@@ -0,0 +1,166 @@
+-- Cache invalidation: statement-level triggers that NOTIFY fpna_cache with
+-- what changed, for the listener in each Django worker (fpna_app.invalidation).
+-- Installed by `manage.py cache_invalidation --create`.
+--
+-- Payloads are JSON:
+--   {"table": "gl_txn_raw", "changes": [["AFP", 2025, 7], ...]}   ledger/budget rows
+--   {"table": "gl_txn_raw", "all": true}                         too many periods to list
+--   {"table": "gl_account_map"}                                  reference tables
+--   {"table": "rollup_watermark", "name": "gl_monthly_rollup"}   rollup/resolved refreshes
+-- NOTIFY is delivered on commit, and repeats within a transaction are
+-- folded, so a chunked bulk load sends one message per chunk.
+
+-- The data version reads max(uniqueid) of the ledger and budget every few
+-- seconds; gl_txn_raw has gl_txn_raw_unique, the budget needs this one to
+-- keep that an index-only lookup. Same definition as in ingest.sql.
+CREATE UNIQUE INDEX IF NOT EXISTS budget_uniqueid ON public.budget USING btree (uniqueid);
+
+-- Advanced by every trigger below so the data version (fpna_app.conditional)
+-- also moves on updates, deletes and rows backfilled below the highest
+-- uniqueid. nextval takes no row lock, so concurrent writers never queue on
+-- it; it is not transactional either, so it moves when the statement runs,
+-- not when the writer commits (appended rows still move max(uniqueid) on
+-- commit, and the NOTIFY on commit forces a fresh version read).
+CREATE SEQUENCE IF NOT EXISTS public.fpna_change_seq;
+
+CREATE OR REPLACE FUNCTION finance.fpna_count_change()
+ RETURNS void
+ LANGUAGE plpgsql
+AS $function$
+BEGIN
+    PERFORM nextval('public.fpna_change_seq');
+END;
+$function$;
+
+-- Single-row counter the sequence replaces
+DROP TABLE IF EXISTS public.fpna_change_counter;
+
+CREATE OR REPLACE FUNCTION finance.fpna_notify_changes(p_table text, p_changes jsonb)
+ RETURNS void
+ LANGUAGE plpgsql
+AS $function$
+DECLARE
+    payload text;
+BEGIN
+    IF p_changes IS NULL OR jsonb_array_length(p_changes) = 0 THEN
+        RETURN;
+    END IF;
+    PERFORM finance.fpna_count_change();
+    payload := jsonb_build_object('table', p_table, 'changes', p_changes)::text;
+    -- NOTIFY payloads must stay under 8000 bytes
+    IF octet_length(payload) > 7000 THEN
+        payload := jsonb_build_object('table', p_table, 'all', true)::text;
+    END IF;
+    PERFORM pg_notify('fpna_cache', payload);
+END;
+$function$;
+
+-- Ledger rows: transition tables are named changed_rows (and old_rows for
+-- UPDATE, whose old periods are stale too)
+CREATE OR REPLACE FUNCTION finance.fpna_notify_gl_txn_raw()
+ RETURNS trigger
+ LANGUAGE plpgsql
+AS $function$
+DECLARE
+    changes jsonb;
+BEGIN
+    IF TG_OP = 'UPDATE' THEN
+        SELECT jsonb_agg(DISTINCT jsonb_build_array(companyid, postyear, postperiod)) INTO changes
+        FROM (SELECT companyid, postyear, postperiod FROM changed_rows
+              UNION SELECT companyid, postyear, postperiod FROM old_rows) c;
+    ELSE
+        SELECT jsonb_agg(DISTINCT jsonb_build_array(companyid, postyear, postperiod)) INTO changes
+        FROM changed_rows;
+    END IF;
+    PERFORM finance.fpna_notify_changes(TG_TABLE_NAME, changes);
+    RETURN NULL;
+END;
+$function$;
+
+CREATE OR REPLACE FUNCTION finance.fpna_notify_budget()
+ RETURNS trigger
+ LANGUAGE plpgsql
+AS $function$
+DECLARE
+    changes jsonb;
+BEGIN
+    IF TG_OP = 'UPDATE' THEN
+        SELECT jsonb_agg(DISTINCT jsonb_build_array(companyid, year, period)) INTO changes
+        FROM (SELECT companyid, year, period FROM changed_rows
+              UNION SELECT companyid, year, period FROM old_rows) c;
+    ELSE
+        SELECT jsonb_agg(DISTINCT jsonb_build_array(companyid, year, period)) INTO changes
+        FROM changed_rows;
+    END IF;
+    PERFORM finance.fpna_notify_changes(TG_TABLE_NAME, changes);
+    RETURN NULL;
+END;
+$function$;
+
+-- Reference tables and watermarks: which table (and watermark) is enough
+CREATE OR REPLACE FUNCTION finance.fpna_notify_table()
+ RETURNS trigger
+ LANGUAGE plpgsql
+AS $function$
+BEGIN
+    PERFORM finance.fpna_count_change();
+    PERFORM pg_notify('fpna_cache', jsonb_build_object('table', TG_TABLE_NAME)::text);
+    RETURN NULL;
+END;
+$function$;
+
+CREATE OR REPLACE FUNCTION finance.fpna_notify_watermark()
+ RETURNS trigger
+ LANGUAGE plpgsql
+AS $function$
+BEGIN
+    PERFORM pg_notify('fpna_cache', jsonb_build_object('table', TG_TABLE_NAME, 'name', NEW.name)::text);
+    RETURN NULL;
+END;
+$function$;
+
+-- Transition tables allow only one event per trigger
+CREATE OR REPLACE TRIGGER fpna_notify_insert AFTER INSERT ON public.gl_txn_raw
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION finance.fpna_notify_gl_txn_raw();
+CREATE OR REPLACE TRIGGER fpna_notify_update AFTER UPDATE ON public.gl_txn_raw
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION finance.fpna_notify_gl_txn_raw();
+CREATE OR REPLACE TRIGGER fpna_notify_delete AFTER DELETE ON public.gl_txn_raw
+    REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION finance.fpna_notify_gl_txn_raw();
+
+CREATE OR REPLACE TRIGGER fpna_notify_insert AFTER INSERT ON public.budget
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION finance.fpna_notify_budget();
+CREATE OR REPLACE TRIGGER fpna_notify_update AFTER UPDATE ON public.budget
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION finance.fpna_notify_budget();
+CREATE OR REPLACE TRIGGER fpna_notify_delete AFTER DELETE ON public.budget
+    REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION finance.fpna_notify_budget();
+
+CREATE OR REPLACE TRIGGER fpna_notify AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.company
+    FOR EACH STATEMENT EXECUTE FUNCTION finance.fpna_notify_table();
+CREATE OR REPLACE TRIGGER fpna_notify AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.gl_account_map
+    FOR EACH STATEMENT EXECUTE FUNCTION finance.fpna_notify_table();
+CREATE OR REPLACE TRIGGER fpna_notify AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.metric
+    FOR EACH STATEMENT EXECUTE FUNCTION finance.fpna_notify_table();
+CREATE OR REPLACE TRIGGER fpna_notify AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.metric_component
+    FOR EACH STATEMENT EXECUTE FUNCTION finance.fpna_notify_table();
+
+-- A truncated ledger or budget invalidates everything
+CREATE OR REPLACE TRIGGER fpna_notify_truncate AFTER TRUNCATE ON public.gl_txn_raw
+    FOR EACH STATEMENT EXECUTE FUNCTION finance.fpna_notify_table();
+CREATE OR REPLACE TRIGGER fpna_notify_truncate AFTER TRUNCATE ON public.budget
+    FOR EACH STATEMENT EXECUTE FUNCTION finance.fpna_notify_table();
+
+-- The watermark table only exists once the rollup or resolved ledger is set up
+DO $$
+BEGIN
+    IF to_regclass('public.rollup_watermark') IS NOT NULL THEN
+        CREATE OR REPLACE TRIGGER fpna_notify AFTER UPDATE ON public.rollup_watermark
+            FOR EACH ROW EXECUTE FUNCTION finance.fpna_notify_watermark();
+    END IF;
+END;
+$$;
@@ -0,0 +1,125 @@
+-- Monthly actuals rollup: gl_txn_raw pre-aggregated per company, mapped
+-- account and posting period. Maintained by `manage.py refresh_gl_rollup`.
+
+CREATE TABLE IF NOT EXISTS public.gl_monthly_rollup (
+    companyid    text     NOT NULL,
+    account_name text     NOT NULL,
+    postyear     integer  NOT NULL,
+    postperiod   smallint NOT NULL,
+    amount       numeric  NOT NULL DEFAULT 0,
+    txn_count    bigint   NOT NULL DEFAULT 0,
+    PRIMARY KEY (companyid, account_name, postyear, postperiod)
+);
+
+CREATE INDEX IF NOT EXISTS gl_monthly_rollup_period
+    ON public.gl_monthly_rollup (postyear, postperiod, companyid);
+
+-- Highest gl_txn_raw.uniqueid already folded into a derived table
+CREATE TABLE IF NOT EXISTS public.rollup_watermark (
+    name          text        PRIMARY KEY,
+    last_uniqueid bigint      NOT NULL DEFAULT 0,
+    refreshed_at  timestamptz NOT NULL DEFAULT now()
+);
+
+INSERT INTO public.rollup_watermark (name, last_uniqueid)
+VALUES ('gl_monthly_rollup', 0)
+ON CONFLICT (name) DO NOTHING;
+
+-- Signed leaf accounts of each metric (nested metrics expanded)
+CREATE OR REPLACE FUNCTION finance.metric_leaf_accounts(p_metric_names text[] DEFAULT NULL::text[])
+ RETURNS TABLE(metric_name text, account_name text, sign integer)
+ LANGUAGE sql STABLE
+AS $function$
+    WITH RECURSIVE
+    wanted AS (
+        SELECT m.metric_id, m.metric_name
+        FROM public.metric m
+        WHERE p_metric_names IS NULL OR m.metric_name = ANY(p_metric_names)
+    ),
+    expand(metric_id, ref_type, ref_name, sign) AS (
+        SELECT mc.metric_id, mc.ref_type, mc.ref_name,
+               CASE mc.op WHEN '+' THEN 1 ELSE -1 END
+        FROM public.metric_component mc
+        WHERE mc.metric_id IN (SELECT w.metric_id FROM wanted w)
+        UNION ALL
+        SELECT e.metric_id, mc2.ref_type, mc2.ref_name,
+               e.sign * CASE mc2.op WHEN '+' THEN 1 ELSE -1 END
+        FROM expand e
+        JOIN public.metric sub ON e.ref_type = 'metric' AND sub.metric_name = e.ref_name
+        JOIN public.metric_component mc2 ON mc2.metric_id = sub.metric_id
+    )
+    SELECT w.metric_name, e.ref_name, e.sign
+    FROM expand e
+    JOIN wanted w ON w.metric_id = e.metric_id
+    WHERE e.ref_type = 'account';
+$function$;
+
+CREATE OR REPLACE FUNCTION finance.rollup_actual_account(p_start_year integer, p_start_period integer, p_end_year integer, p_end_period integer, p_company_ids text[] DEFAULT NULL::text[], p_components text[] DEFAULT NULL::text[])
+ RETURNS TABLE(companyid text, ref_name text, value numeric)
+ LANGUAGE sql STABLE
+AS $function$
+    SELECT r.companyid, r.account_name, SUM(r.amount)
+    FROM public.gl_monthly_rollup r
+    WHERE (p_company_ids IS NULL OR r.companyid = ANY(p_company_ids))
+      AND (r.postyear, r.postperiod) >= (p_start_year, p_start_period)
+      AND (r.postyear, r.postperiod) <  (p_end_year, p_end_period)
+      AND (p_components IS NULL OR r.account_name = ANY(p_components))
+    GROUP BY r.companyid, r.account_name
+    ORDER BY r.companyid, r.account_name;
+$function$;
+
+CREATE OR REPLACE FUNCTION finance.rollup_actual_metric(p_start_year integer, p_start_period integer, p_end_year integer, p_end_period integer, p_company_ids text[] DEFAULT NULL::text[], p_metric_names text[] DEFAULT NULL::text[])
+ RETURNS TABLE(companyid text, metric_name text, value numeric)
+ LANGUAGE sql STABLE
+AS $function$
+    SELECT r.companyid, l.metric_name, SUM(l.sign * r.amount)
+    FROM finance.metric_leaf_accounts(p_metric_names) l
+    JOIN public.gl_monthly_rollup r ON r.account_name = l.account_name
+    WHERE (p_company_ids IS NULL OR r.companyid = ANY(p_company_ids))
+      AND (r.postyear, r.postperiod) >= (p_start_year, p_start_period)
+      AND (r.postyear, r.postperiod) <  (p_end_year, p_end_period)
+    GROUP BY r.companyid, l.metric_name
+    ORDER BY r.companyid, l.metric_name;
+$function$;
+
+-- Averages over the months in a half-open range that have postings
+CREATE OR REPLACE FUNCTION finance.rollup_actual_account_average(p_start_year integer, p_start_period integer, p_end_year integer, p_end_period integer, p_company_ids text[] DEFAULT NULL::text[], p_components text[] DEFAULT NULL::text[])
+ RETURNS TABLE(companyid text, ref_name text, avg_value numeric, min_value numeric, max_value numeric, periods_count integer, start_date date, end_date date)
+ LANGUAGE sql STABLE
+AS $function$
+    WITH per_month AS (
+        SELECT r.companyid, r.account_name, r.postyear, r.postperiod, SUM(r.amount) AS value
+        FROM public.gl_monthly_rollup r
+        WHERE (p_company_ids IS NULL OR r.companyid = ANY(p_company_ids))
+          AND (r.postyear, r.postperiod) >= (p_start_year, p_start_period)
+          AND (r.postyear, r.postperiod) <  (p_end_year, p_end_period)
+          AND (p_components IS NULL OR r.account_name = ANY(p_components))
+        GROUP BY r.companyid, r.account_name, r.postyear, r.postperiod
+    )
+    SELECT pm.companyid, pm.account_name,
+           AVG(pm.value), MIN(pm.value), MAX(pm.value), COUNT(*)::int,
+           make_date(p_start_year, p_start_period, 1),
+           (make_date(p_end_year, 1, 1) + (p_end_period - 1) * INTERVAL '1 month' - INTERVAL '1 day')::date
+    FROM per_month pm
+    GROUP BY pm.companyid, pm.account_name
+    ORDER BY pm.companyid, pm.account_name;
+$function$;
+
+CREATE OR REPLACE FUNCTION finance.rollup_actual_metric_average(p_start_year integer, p_start_period integer, p_end_year integer, p_end_period integer, p_company_ids text[] DEFAULT NULL::text[], p_metric_names text[] DEFAULT NULL::text[])
+ RETURNS TABLE(companyid text, metric_name text, avg_value numeric)
+ LANGUAGE sql STABLE
+AS $function$
+    WITH per_month AS (
+        SELECT r.companyid, l.metric_name, r.postyear, r.postperiod, SUM(l.sign * r.amount) AS value
+        FROM finance.metric_leaf_accounts(p_metric_names) l
+        JOIN public.gl_monthly_rollup r ON r.account_name = l.account_name
+        WHERE (p_company_ids IS NULL OR r.companyid = ANY(p_company_ids))
+          AND (r.postyear, r.postperiod) >= (p_start_year, p_start_period)
+          AND (r.postyear, r.postperiod) <  (p_end_year, p_end_period)
+        GROUP BY r.companyid, l.metric_name, r.postyear, r.postperiod
+    )
+    SELECT pm.companyid, pm.metric_name, AVG(pm.value)
+    FROM per_month pm
+    GROUP BY pm.companyid, pm.metric_name
+    ORDER BY pm.companyid, pm.metric_name;
+$function$;
@@ -0,0 +1,80 @@
+-- Resolved ledger: a materialized copy of the public.gl_txn_signed view
+-- (gl_txn_raw joined to gl_account_map, amount = amount_raw * erp_sign), so
+-- readers skip the range join. Maintained by `manage.py refresh_gl_resolved`.
+
+CREATE TABLE IF NOT EXISTS public.gl_txn_resolved (
+    gl_account     integer  NOT NULL,
+    companyid      text     NOT NULL,
+    customer       text,
+    posting_date   date,
+    description    text,
+    extdescription text,
+    amount_raw     numeric,
+    invoicetype    text,
+    invvouch       integer,
+    postperiod     smallint NOT NULL,
+    postyear       integer  NOT NULL,
+    source         text,
+    sourcekey      text,
+    supplierinvnum text,
+    transcode      smallint,
+    uniqueid       bigint   NOT NULL,
+    account_name   text     NOT NULL,
+    amount         numeric,
+    tags           jsonb,
+    PRIMARY KEY (uniqueid, account_name)
+);
+
+CREATE INDEX IF NOT EXISTS gl_txn_resolved_period
+    ON public.gl_txn_resolved (postyear, postperiod, companyid, account_name);
+CREATE INDEX IF NOT EXISTS gl_txn_resolved_drilldown
+    ON public.gl_txn_resolved (account_name, posting_date, uniqueid);
+CREATE INDEX IF NOT EXISTS gl_txn_resolved_gl_account
+    ON public.gl_txn_resolved (gl_account);
+
+-- The gl_account_map rows the resolved table currently reflects; diffing it
+-- against gl_account_map gives the ranges that need re-resolving
+CREATE TABLE IF NOT EXISTS public.gl_txn_resolved_map (
+    account_name text      NOT NULL,
+    acct_range   int4range NOT NULL,
+    erp_sign     smallint  NOT NULL,
+    tags         jsonb
+);
+
+CREATE TABLE IF NOT EXISTS public.rollup_watermark (
+    name          text        PRIMARY KEY,
+    last_uniqueid bigint      NOT NULL DEFAULT 0,
+    refreshed_at  timestamptz NOT NULL DEFAULT now()
+);
+
+INSERT INTO public.rollup_watermark (name, last_uniqueid)
+VALUES ('gl_txn_resolved', 0)
+ON CONFLICT (name) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION finance.resolved_actual_account(p_start_year integer, p_start_period integer, p_end_year integer, p_end_period integer, p_company_ids text[] DEFAULT NULL::text[], p_components text[] DEFAULT NULL::text[])
+ RETURNS TABLE(companyid text, ref_name text, value numeric)
+ LANGUAGE sql STABLE
+AS $function$
+    SELECT t.companyid, t.account_name, SUM(t.amount)
+    FROM public.gl_txn_resolved t
+    WHERE (p_company_ids IS NULL OR t.companyid = ANY(p_company_ids))
+      AND (t.postyear, t.postperiod) >= (p_start_year, p_start_period)
+      AND (t.postyear, t.postperiod) <  (p_end_year, p_end_period)
+      AND (p_components IS NULL OR t.account_name = ANY(p_components))
+    GROUP BY t.companyid, t.account_name
+    ORDER BY t.companyid, t.account_name;
+$function$;
+
+CREATE OR REPLACE FUNCTION finance.resolved_actual_metric(p_start_year integer, p_start_period integer, p_end_year integer, p_end_period integer, p_company_ids text[] DEFAULT NULL::text[], p_metric_names text[] DEFAULT NULL::text[])
+ RETURNS TABLE(companyid text, metric_name text, value numeric)
+ LANGUAGE sql STABLE
+AS $function$
+    SELECT t.companyid, l.metric_name, SUM(l.sign * t.amount)
+    FROM finance.metric_leaf_accounts(p_metric_names) l
+    JOIN public.gl_txn_resolved t ON t.account_name = l.account_name
+    WHERE (p_company_ids IS NULL OR t.companyid = ANY(p_company_ids))
+      AND (t.postyear, t.postperiod) >= (p_start_year, p_start_period)
+      AND (t.postyear, t.postperiod) <  (p_end_year, p_end_period)
+    GROUP BY t.companyid, l.metric_name
+    ORDER BY t.companyid, l.metric_name;
+$function$;
@@ -0,0 +1,6 @@
+-- Indexes the ERP export loader (fpna_app.ingest) relies on. Each chunk is
+-- merged with an anti-join on uniqueid, which without an index scans the
+-- whole target table once per chunk. gl_txn_raw already has
+-- gl_txn_raw_unique. Installed by `manage.py load_erp_export --create`.
+
+CREATE UNIQUE INDEX IF NOT EXISTS budget_uniqueid ON public.budget USING btree (uniqueid);
@@ -45,4 +45,12 @@ def percentage_format(value):
         num_value = float(value)
         return f"{num_value:.1f}%"
     except (ValueError, TypeError):
-        return str(value)
\ No newline at end of file
+        return str(value)
+
+@register.filter
+def column_value(item, column):
+    """
+    A report row's value for one ReportColumn, so cells follow the column spec:
+    {{ item|column_value:column|accounting_format }}
+    """
+    return item.get(column.key)
@@ -0,0 +1,141 @@
+import math
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from fpna_app.derived import PeriodMatrix, ReportColumn, derive_report, period_range, ratio_columns
+
+PERIODS = period_range(2024, 10, 2025, 4)
+
+# (name, year, period, value) rows as the monthly statement returns them,
+# amounts already erp_sign-adjusted
+ACTUAL_ROWS = [
+    ("Sales", 2024, 10, 100.0), ("Sales", 2024, 11, 200.0), ("Sales", 2025, 1, 60.0),
+    ("Freight", 2024, 12, -30.0), ("Freight", 2024, 12, -10.0),
+    ("Returns", 2024, 10, None),
+    ("Sales", 2023, 12, 999.0), ("Unmapped", 2024, 10, 5.0),
+]
+BUDGET_ROWS = [("Sales", 2024, 10, 90.0), ("Sales", 2024, 11, 90.0), ("Sales", 2024, 12, 90.0), ("Freight", 2025, 2, -25.0)]
+ROWS = ["Freight", "Returns", "Sales"]
+
+Q4 = (2024, 10, 2025, 1)
+Q1 = (2025, 1, 2025, 4)
+COLUMNS = [
+    ReportColumn("q4_actual", "Q4 2024 Actual", "actual", "total", *Q4),
+    ReportColumn("q4_budget", "Q4 2024 Budget", "budget", "total", *Q4),
+    ReportColumn("q4_average", "Q4 2024 Average", "actual", "average", *Q4),
+    ReportColumn("variance", "Q4 2024 Var B/(W)", "actual", "variance", *Q4),
+    ReportColumn("q1_budget", "Q1 2025 Budget", "budget", "total", *Q1),
+]
+
+
+def matrices():
+    return PeriodMatrix.from_rows(ACTUAL_ROWS, PERIODS, ROWS), PeriodMatrix.from_rows(BUDGET_ROWS, PERIODS, ROWS)
+
+
+class PeriodMatrixTests(SimpleTestCase):
+    def test_from_rows(self):
+        actual, _ = matrices()
+        self.assertEqual(actual.values.tolist(), [
+            [0, 0, -40, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0],
+            [100, 200, 0, 60, 0, 0],
+        ])
+        # Only months with a (non-NULL) posting are present; a month summing
+        # to 0 would still count
+        self.assertEqual(actual.present.sum(axis=1).tolist(), [1, 0, 3])
+
+    def test_columns_slice(self):
+        actual, _ = matrices()
+        self.assertEqual(actual.columns(*Q4), slice(0, 3))
+        self.assertEqual(actual.columns(*Q1), slice(3, 6))
+        self.assertEqual(actual.columns(2023, 1, 2024, 1), slice(0, 0))
+
+    def test_stats_skip_months_without_postings(self):
+        actual, _ = matrices()
+        average, minimum, maximum, count = actual.stats(actual.columns(*Q4))
+        self.assertEqual(average[0], -40)
+        self.assertTrue(math.isnan(average[1]))
+        self.assertEqual(average[2], 150)
+        self.assertEqual((minimum[2], maximum[2]), (100, 200))
+        self.assertTrue(math.isnan(minimum[1]) and math.isnan(maximum[1]))
+        self.assertEqual(count.tolist(), [1, 0, 2])
+
+    def test_stats_count_zero_postings(self):
+        matrix = PeriodMatrix.from_rows([("A", 2024, 10, 10.0), ("A", 2024, 11, 0.0)], PERIODS, ["A"])
+        average, minimum, _, count = matrix.stats()
+        self.assertEqual((average[0], minimum[0], count[0]), (5, 0, 2))
+
+    def test_concat(self):
+        left = PeriodMatrix.from_rows([("B", 2024, 10, 1.0)], PERIODS[:3], ["B"])
+        right = PeriodMatrix.from_rows([("A", 2025, 1, 2.0)], PERIODS[3:], ["A"])
+        joined = PeriodMatrix.concat([left, right])
+        self.assertEqual(joined.row_names, ["A", "B"])
+        self.assertEqual(joined.periods, PERIODS)
+        self.assertEqual(joined.values.tolist(), [[0, 0, 0, 2, 0, 0], [1, 0, 0, 0, 0, 0]])
+        self.assertEqual(joined.present.sum(), 2)
+
+
+class DeriveReportTests(SimpleTestCase):
+    def setUp(self):
+        self.result = derive_report(*matrices(), COLUMNS)
+
+    def column(self, key):
+        return dict(zip(self.result.column("ref_name"), self.result.numpy(key).tolist()))
+
+    def test_totals_keep_signs(self):
+        self.assertEqual(self.column("q4_actual"), {"Freight": -40, "Returns": 0, "Sales": 300})
+        self.assertEqual(self.column("q4_budget"), {"Freight": 0, "Returns": 0, "Sales": 270})
+        self.assertEqual(self.column("q1_budget"), {"Freight": -25, "Returns": 0, "Sales": 0})
+
+    def test_variance_is_actual_minus_budget(self):
+        self.assertEqual(self.column("variance"), {"Freight": -40, "Returns": 0, "Sales": 30})
+
+    def test_average_over_posted_months(self):
+        averages = self.column("q4_average")
+        self.assertEqual((averages["Freight"], averages["Sales"]), (-40, 150))
+        self.assertTrue(math.isnan(averages["Returns"]))
+
+    def test_rows_are_addressable(self):
+        self.assertEqual(len(self.result), 3)
+        index = {"Sales": 0, "Other": 1}
+        self.assertEqual(self.result.positions(index).tolist(), [-1, -1, 0])
+        self.assertIsInstance(self.result.numpy("variance"), np.ndarray)
+
+
+class RatioColumnsTests(SimpleTestCase):
+    # Lines: 0 numerator, 1 denominator, 2 zero, 3 NaN
+    VALUES = np.array([
+        # q4_actual, q4_budget, q4_average, variance, q1_budget
+        [25.0, 30.0, 10.0, -5.0, 12.0],
+        [100.0, 120.0, 40.0, -20.0, 0.0],
+        [0.0, 0.0, 0.0, 0.0, 0.0],
+        [np.nan, 50.0, np.nan, np.nan, 50.0],
+    ])
+
+    def ratios(self, numerators, denominators):
+        return ratio_columns(self.VALUES, np.array(numerators), np.array(denominators), COLUMNS)
+
+    def test_percentages(self):
+        ratios = self.ratios([0], [1])
+        self.assertEqual(ratios[0, :3].tolist(), [25.0, 25.0, 25.0])
+
+    def test_zero_or_missing_denominator_is_zero(self):
+        ratios = self.ratios([0, 0, 3], [2, 3, 1])
+        self.assertEqual(ratios[0].tolist(), [0, 0, 0, 0, 0])
+        # A NaN actual numerator gives a 0 actual ratio, against a 60% budget
+        self.assertEqual(ratios[1].tolist(), [0, 60.0, 0, -60.0, 24.0])
+        self.assertEqual(ratios[2, 4], 0)
+        self.assertFalse(np.isnan(ratios).any())
+
+    def test_variance_is_percentage_points(self):
+        # 25% actual vs 25% budget: 0 points, not (-5 / -20) = 25%
+        self.assertEqual(self.ratios([0], [1])[0, 3], 0)
+        ratios = self.ratios([1], [3])
+        self.assertEqual(ratios[0, 3], ratios[0, 0] - ratios[0, 1])
+
+    def test_variance_without_both_sides_is_zero(self):
+        columns = [column for column in COLUMNS if column.key != "q4_budget"]
+        values = np.delete(self.VALUES, 1, axis=1)
+        ratios = ratio_columns(values, np.array([0]), np.array([1]), columns)
+        self.assertEqual(ratios[0, 2], 0)
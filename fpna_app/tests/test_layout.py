@@ -0,0 +1,75 @@
+from array import array
+
+from django.test import SimpleTestCase
+
+from fpna_app.columnar import ColumnarResult
+from fpna_app.derived import ReportColumn
+from fpna_app.layout import ReportLayout
+
+LINES = [
+    {"name": "Sales - A", "type": "account", "group": "sales"},
+    {"name": "Sales - B", "type": "account", "group": "sales"},
+    {"name": "Gross Sales", "type": "metric", "group": "sales", "is_group_header": True},
+    {"name": "Freight", "type": "account"},
+    {"name": "% of Sales", "type": "percentage", "numerator": "Freight", "denominator": "Gross Sales"},
+]
+
+COLUMNS = [ReportColumn("q1_actual", "Q1 2025 Actual", "actual", "total", 2025, 1, 2025, 4)]
+
+
+class LayoutValidationTests(SimpleTestCase):
+    def assertInvalid(self, lines, message):
+        with self.assertRaisesMessage(ValueError, message):
+            ReportLayout("test", lines)
+
+    def test_valid_layout(self):
+        layout = ReportLayout("test", LINES)
+        self.assertEqual(layout.account_names, ["Sales - A", "Sales - B", "Freight"])
+        self.assertEqual(layout.metric_names, ["Gross Sales"])
+        self.assertEqual(layout.groups, {"sales": ["Sales - A", "Sales - B"]})
+
+    def test_line_needs_name_and_type(self):
+        self.assertInvalid([{"type": "account"}], "line 1: needs a name and a type")
+        self.assertInvalid([{"name": "Freight", "type": "total"}], "line 1: needs a name and a type")
+
+    def test_percentage_needs_known_lines(self):
+        lines = LINES[:4] + [{"name": "%", "type": "percentage", "numerator": "Freight", "denominator": "Net"}]
+        self.assertInvalid(lines, "line 5: denominator 'Net' is not an account or metric line")
+
+    def test_percentage_cannot_reference_percentage(self):
+        lines = LINES + [{"name": "%%", "type": "percentage", "numerator": "% of Sales", "denominator": "Freight"}]
+        self.assertInvalid(lines, "line 6: numerator '% of Sales' is not an account or metric line")
+
+    def test_only_grouped_metric_can_be_header(self):
+        lines = [{"name": "Freight", "type": "account", "group": "freight", "is_group_header": True}]
+        self.assertInvalid(lines, "line 1: only a metric line with a group can be its header")
+        lines = [{"name": "Gross Sales", "type": "metric", "is_group_header": True}]
+        self.assertInvalid(lines, "line 1: only a metric line with a group can be its header")
+
+    def test_group_needs_header(self):
+        self.assertInvalid(LINES[:2], "group 'sales' has no is_group_header line")
+
+
+class LayoutRowsTests(SimpleTestCase):
+    def setUp(self):
+        self.layout = ReportLayout("test", LINES)
+        # The derive_report shape: ref_name plus one float column per key
+        self.data = ColumnarResult(
+            ["ref_name", "q1_actual"], [["Sales - B", "Freight", "Unknown"], array("d", [5.0, 2.0, 7.0])]
+        )
+
+    def test_detail_rows(self):
+        rows = self.layout.rows(self.data, COLUMNS, engine=None)
+        self.assertEqual([row["name"] for row in rows], [line["name"] for line in LINES])
+        self.assertEqual([row["q1_actual"] for row in rows], [0.0, 5.0, 0.0, 2.0, 0.0])
+
+    def test_collapsed_rows(self):
+        rows = self.layout.collapse(self.layout.rows(self.data, COLUMNS, engine=None))
+        self.assertEqual([(row["name"], row["type"]) for row in rows], [
+            ("sales", "group"), ("Gross Sales", "metric"), ("Freight", "account"), ("% of Sales", "percentage"),
+        ])
+        self.assertNotIn("q1_actual", rows[0])
+
+    def test_group_rows(self):
+        rows = self.layout.group_rows("sales", self.data, COLUMNS)
+        self.assertEqual([(row["name"], row["q1_actual"]) for row in rows], [("Sales - A", 0.0), ("Sales - B", 5.0)])
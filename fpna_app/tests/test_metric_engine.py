@@ -0,0 +1,61 @@
+import math
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from fpna_app.derived import PeriodMatrix, period_range
+from fpna_app.metric_engine import MetricEngine
+
+METRICS = ["Gross Sales", "Net Sales", "Freight Margin"]
+COMPONENTS = [
+    ("Gross Sales", "account", "Sales - A", "+"),
+    ("Gross Sales", "account", "Sales - B", "+"),
+    ("Net Sales", "metric", "Gross Sales", "+"),
+    ("Net Sales", "account", "Returns", "-"),
+    ("Freight Margin", "metric", "Net Sales", "+"),
+    ("Freight Margin", "account", "Freight", "-"),
+]
+
+
+class MetricEngineTests(SimpleTestCase):
+    def setUp(self):
+        self.engine = MetricEngine(METRICS, COMPONENTS)
+
+    def weights(self, metric):
+        row = self.engine.matrix[self.engine.metric_index[metric]]
+        return {name: row[i] for name, i in self.engine.account_index.items() if row[i]}
+
+    def test_nested_metrics_expand_to_signed_accounts(self):
+        self.assertEqual(self.engine.account_names, ["Freight", "Returns", "Sales - A", "Sales - B"])
+        self.assertEqual(self.weights("Net Sales"), {"Sales - A": 1, "Sales - B": 1, "Returns": -1})
+        self.assertEqual(self.weights("Freight Margin"),
+                         {"Sales - A": 1, "Sales - B": 1, "Returns": -1, "Freight": -1})
+
+    def test_cycles_are_rejected(self):
+        with self.assertRaisesMessage(ValueError, "cyclic: A -> B -> A"):
+            MetricEngine(["A", "B"], [("A", "metric", "B", "+"), ("B", "metric", "A", "+")])
+
+    def test_evaluate_columns(self):
+        # Freight, Returns, Sales - A, Sales - B x two columns
+        accounts = np.array([[5.0, 1.0], [10.0, 0.0], [100.0, 50.0], [20.0, 0.0]])
+        self.assertEqual(self.engine.evaluate(accounts).tolist(), [[120, 50], [110, 50], [105, 49]])
+
+    def test_monthly_average_uses_the_metrics_own_months(self):
+        periods = period_range(2025, 1, 2025, 4)
+        matrix = PeriodMatrix.from_rows([
+            ("Sales - A", 2025, 1, 30.0),
+            ("Sales - B", 2025, 2, 30.0),
+            ("Returns", 2025, 2, 6.0),
+            ("Unrelated", 2025, 3, 99.0),
+        ], periods, ["Returns", "Sales - A", "Sales - B", "Unrelated"])
+        average = self.engine.monthly_average(matrix)
+        # Gross Sales posted in January and February: (30 + 30) / 2, where
+        # the accounts' own averages would sum to 60
+        self.assertEqual(average[self.engine.metric_index["Gross Sales"]], 30)
+        self.assertEqual(average[self.engine.metric_index["Net Sales"]], (30 + 24) / 2)
+        # Restricted to March, nothing any metric uses posted
+        self.assertTrue(np.isnan(self.engine.monthly_average(matrix, matrix.columns(2025, 3, 2025, 4))).all())
+
+    def test_monthly_average_without_accounts(self):
+        matrix = PeriodMatrix.from_rows([], period_range(2025, 1, 2025, 2), [])
+        self.assertTrue(all(math.isnan(value) for value in self.engine.monthly_average(matrix)))
@@ -0,0 +1,48 @@
+import threading
+import time
+
+from django.test import SimpleTestCase, override_settings
+
+from fpna_app.db import QueryTimeoutError, _statement_timeout, map_parallel
+
+
+@override_settings(FPNA_QUERY_WORKERS=4, FPNA_QUERY_TIMEOUT=30)
+class MapParallelTests(SimpleTestCase):
+    def test_results_in_order(self):
+        def call(item):
+            # Later items finish first
+            time.sleep(0.02 * (5 - item))
+            return item * 10, _statement_timeout.get()
+
+        self.assertEqual(list(map_parallel(call, range(6))), [(i * 10, 30) for i in range(6)])
+
+    def test_calls_overlap(self):
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def call(item):
+            with lock:
+                running.append(item)
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(item)
+            return item
+
+        self.assertEqual(list(map_parallel(call, range(8))), list(range(8)))
+        self.assertGreater(max(peak), 1)
+        self.assertLessEqual(max(peak), 4)
+
+    def test_first_error_is_raised(self):
+        def call(item):
+            if item == 2:
+                raise ValueError("boom")
+            return item
+
+        with self.assertRaisesMessage(ValueError, "boom"):
+            list(map_parallel(call, range(5)))
+
+    def test_overrun_raises_query_timeout(self):
+        with self.assertRaises(QueryTimeoutError):
+            list(map_parallel(lambda item: time.sleep(1.5), range(2), timeout=0.1))
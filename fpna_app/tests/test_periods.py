@@ -0,0 +1,107 @@
+from django.test import SimpleTestCase, override_settings
+
+from fpna_app.cache import current_period, report_cache
+from fpna_app.db import join_monthly_parts, monthly_accounts_parts, monthly_accounts_ranges
+from fpna_app.derived import period_range, quarter_start, shift_period
+from fpna_app.reports import budget_vs_actual_columns, report_window
+
+
+class PeriodTests(SimpleTestCase):
+    def test_shift_period_across_years(self):
+        self.assertEqual(shift_period(2024, 11, 3), (2025, 2))
+        self.assertEqual(shift_period(2025, 1, -1), (2024, 12))
+        self.assertEqual(shift_period(2025, 2, -14), (2023, 12))
+        self.assertEqual(shift_period(2024, 12, 0), (2024, 12))
+
+    def test_quarter_start(self):
+        self.assertEqual([quarter_start(2025, month)[1] for month in range(1, 13)],
+                         [1, 1, 1, 4, 4, 4, 7, 7, 7, 10, 10, 10])
+
+    def test_period_range_is_half_open(self):
+        self.assertEqual(period_range(2024, 11, 2025, 2), [(2024, 11), (2024, 12), (2025, 1)])
+        self.assertEqual(period_range(2024, 10, 2024, 13), [(2024, 10), (2024, 11), (2024, 12)])
+        self.assertEqual(period_range(2025, 1, 2025, 1), [])
+
+
+class BudgetVsActualColumnsTests(SimpleTestCase):
+    def ranges(self, period):
+        return {
+            column.key: (column.header, column.start_year, column.start_period, column.end_year, column.end_period)
+            for column in budget_vs_actual_columns(period)
+        }
+
+    def test_january_looks_back_into_last_year(self):
+        self.assertEqual(self.ranges((2025, 1)), {
+            "q1_actual": ("Q3 2024 Actual", 2024, 7, 2024, 10),
+            "q2_actual": ("Q4 2024 Actual", 2024, 10, 2025, 1),
+            "q2_budget": ("Q4 2024 Budget", 2024, 10, 2025, 1),
+            "q2_average": ("Q4 2024 Average", 2024, 10, 2025, 1),
+            "variance": ("Q4 2024 Var B/(W)", 2024, 10, 2025, 1),
+            "q3_budget": ("Q1 2025 Budget", 2025, 1, 2025, 4),
+        })
+
+    def test_same_quarter_same_columns(self):
+        self.assertEqual(self.ranges((2025, 1)), self.ranges((2025, 3)))
+
+    def test_december_quarter_ends_next_year(self):
+        columns = self.ranges((2024, 12))
+        self.assertEqual(columns["q1_actual"], ("Q2 2024 Actual", 2024, 4, 2024, 7))
+        self.assertEqual(columns["q2_actual"], ("Q3 2024 Actual", 2024, 7, 2024, 10))
+        self.assertEqual(columns["q3_budget"], ("Q4 2024 Budget", 2024, 10, 2025, 1))
+
+    def test_april_prior_quarter_is_last_year(self):
+        columns = self.ranges((2025, 4))
+        self.assertEqual(columns["q1_actual"], ("Q4 2024 Actual", 2024, 10, 2025, 1))
+        self.assertEqual(columns["q2_actual"], ("Q1 2025 Actual", 2025, 1, 2025, 4))
+
+    @override_settings(FPNA_REPORT_TRAILING_MONTHS=2, FPNA_REPORT_HORIZON_MONTHS=1)
+    def test_report_window_covers_every_column(self):
+        period = (2025, 1)
+        self.assertEqual(report_window(budget_vs_actual_columns(period), period), (2024, 7, 2025, 4))
+
+    @override_settings(FPNA_REPORT_TRAILING_MONTHS=24, FPNA_REPORT_HORIZON_MONTHS=6)
+    def test_report_window_default_span(self):
+        period = (2025, 1)
+        self.assertEqual(report_window(budget_vs_actual_columns(period), period), (2023, 1, 2025, 7))
+
+
+class MonthlyAccountsPartsTests(SimpleTestCase):
+    def setUp(self):
+        self.token = current_period.set((2025, 7))
+        report_cache.invalidate()
+
+    def tearDown(self):
+        report_cache.invalidate()
+        current_period.reset(self.token)
+
+    def test_ranges_split_at_current_period(self):
+        self.assertEqual(monthly_accounts_ranges(2023, 7, 2026, 1), [(2023, 7, 2025, 7), (2025, 7, 2026, 1)])
+        self.assertEqual(monthly_accounts_ranges(2023, 7, 2024, 13), [(2023, 7, 2024, 13)])
+        self.assertEqual(monthly_accounts_ranges(2025, 9, 2026, 1), [(2025, 9, 2026, 1)])
+
+    def test_closed_part_keeps_closed_ttl(self):
+        parts, (_, params) = monthly_accounts_parts(2025, 5, 2025, 9, ["AFP"])
+        self.assertEqual((params["start_year"], params["start_period"], params["end_year"], params["end_period"]),
+                         (2025, 5, 2025, 9))
+        rows = [("actual", "A", 2025, 6, 1.0), ("actual", "B", 2025, 7, 2.0), ("budget", "A", 2025, 8, 3.0)]
+        matrices = join_monthly_parts(parts, rows)
+        self.assertEqual(matrices["actual"].row_names, ["A", "B"])
+        self.assertEqual(matrices["actual"].periods, [(2025, 5), (2025, 6), (2025, 7), (2025, 8)])
+        self.assertEqual(matrices["actual"].values.tolist(), [[0, 1, 0, 0], [0, 0, 2, 0]])
+        self.assertEqual(matrices["budget"].values.tolist(), [[0, 0, 0, 3], [0, 0, 0, 0]])
+
+        ttls = {key[1:5]: expires_at for key, (expires_at, _) in report_cache._entries.items()}
+        self.assertGreater(ttls[(2025, 5, 2025, 7)] - ttls[(2025, 7, 2025, 9)], report_cache.open_ttl)
+
+        # Served from the two cached parts without a statement
+        parts, query = monthly_accounts_parts(2025, 5, 2025, 9, ["AFP"])
+        self.assertIsNone(query)
+        self.assertEqual(join_monthly_parts(parts, [])["actual"].values.tolist(), matrices["actual"].values.tolist())
+
+    def test_only_missing_part_is_fetched(self):
+        parts, _ = monthly_accounts_parts(2025, 5, 2025, 9, ["AFP"])
+        join_monthly_parts(parts, [])
+        report_cache.invalidate(lambda key: key[3:5] == (2025, 9))
+        _, (_, params) = monthly_accounts_parts(2025, 5, 2025, 9, ["AFP"])
+        self.assertEqual((params["start_year"], params["start_period"], params["end_year"], params["end_period"]),
+                         (2025, 7, 2025, 9))
@@ -0,0 +1,151 @@
+import os
+import tempfile
+import threading
+import time
+
+from django.test import SimpleTestCase
+
+from fpna_app.singleflight import SingleFlight, _locked_file_flight
+
+
+def start(target, *args):
+    """
+    Run `target` in a thread; returns (thread, outcome) where outcome gets
+    "result" or "error" once it finishes
+    """
+    outcome = {}
+
+    def run():
+        try:
+            outcome["result"] = target(*args)
+        except Exception as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, outcome
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        self.flight = SingleFlight()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def leader_fn(self, result=None, error=None):
+        def fn():
+            self.calls += 1
+            self.release.wait(5)
+            if error is not None:
+                raise error
+            return result
+        return fn
+
+    def wait_for_leader(self):
+        deadline = time.monotonic() + 5
+        while self.calls < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def wait_for_followers(self, count):
+        deadline = time.monotonic() + 5
+        while self.flight.stats()["followers"] < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_followers_share_the_leaders_result(self):
+        leader = start(self.flight.do, "key", self.leader_fn(result=42))
+        self.wait_for_leader()
+        followers = [start(self.flight.do, "key", self.leader_fn(result=0)) for _ in range(3)]
+        self.wait_for_followers(3)
+        self.release.set()
+        for thread, outcome in [leader] + followers:
+            thread.join(5)
+            self.assertEqual(outcome, {"result": 42})
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.flight.stats(), {"leaders": 1, "followers": 3, "in_flight": 0})
+
+    def test_followers_get_the_leaders_error(self):
+        leader = start(self.flight.do, "key", self.leader_fn(error=RuntimeError("boom")))
+        self.wait_for_leader()
+        follower = start(self.flight.do, "key", self.leader_fn(result=0))
+        self.wait_for_followers(1)
+        self.release.set()
+        for thread, outcome in (leader, follower):
+            thread.join(5)
+            self.assertIsInstance(outcome["error"], RuntimeError)
+        self.assertEqual(self.calls, 1)
+
+    def test_follower_times_out(self):
+        leader = start(self.flight.do, "key", self.leader_fn(result=1))
+        self.wait_for_leader()
+        with self.assertRaises(TimeoutError):
+            self.flight.do("key", self.leader_fn(result=0), timeout=0.05)
+        self.release.set()
+        leader[0].join(5)
+        self.assertEqual(leader[1], {"result": 1})
+
+    def test_follower_timeout_starts_with_the_computation(self):
+        def leader_fn(started):
+            time.sleep(0.2)
+            started()
+            return self.leader_fn(result=1)()
+
+        leader = start(lambda: self.flight.do("key", leader_fn, report_start=True))
+        time.sleep(0.05)
+        follower = start(self.flight.do, "key", self.leader_fn(result=0), 0.1)
+        self.wait_for_leader()
+        self.release.set()
+        for thread, outcome in (leader, follower):
+            thread.join(5)
+            self.assertEqual(outcome, {"result": 1})
+        self.assertEqual(self.calls, 1)
+
+    def test_later_call_recomputes(self):
+        self.release.set()
+        self.assertEqual(self.flight.do("key", self.leader_fn(result=1)), 1)
+        self.assertEqual(self.flight.do("key", self.leader_fn(result=2)), 2)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(self.flight.stats()["leaders"], 2)
+
+
+class LockedFileFlightTests(SimpleTestCase):
+    def setUp(self):
+        self.lock_dir = tempfile.mkdtemp()
+        self.release = threading.Event()
+        self.started = threading.Event()
+
+    def tearDown(self):
+        for name in os.listdir(self.lock_dir):
+            os.unlink(os.path.join(self.lock_dir, name))
+        os.rmdir(self.lock_dir)
+
+    def flight(self, fn, timeout=5):
+        return _locked_file_flight(("report", 2025, 1), fn, self.lock_dir, 30, timeout)
+
+    def leader(self):
+        self.started.set()
+        self.release.wait(5)
+        return {"total": 1.5}
+
+    def test_waiter_reuses_the_leaders_result(self):
+        leader = start(self.flight, self.leader)
+        self.started.wait(5)
+        waiter = start(self.flight, lambda: self.fail("the waiter computed"))
+        time.sleep(0.2)
+        self.release.set()
+        for thread, outcome in (leader, waiter):
+            thread.join(5)
+            self.assertEqual(outcome, {"result": {"total": 1.5}})
+        self.assertEqual([name for name in os.listdir(self.lock_dir) if name.endswith(".lock")], [])
+
+    def test_later_caller_recomputes(self):
+        self.release.set()
+        self.assertEqual(self.flight(self.leader), {"total": 1.5})
+        self.assertEqual(self.flight(lambda: {"total": 2.0}), {"total": 2.0})
+
+    def test_waiter_computes_after_timeout(self):
+        leader = start(self.flight, self.leader)
+        self.started.wait(5)
+        self.assertEqual(self.flight(lambda: {"total": 0.0}, timeout=0.1), {"total": 0.0})
+        self.release.set()
+        leader[0].join(5)
+        self.assertEqual(leader[1], {"result": {"total": 1.5}})
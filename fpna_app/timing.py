@@ -0,0 +1,76 @@
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Timings of the request being served, set by ServerTimingMiddleware when
+# FPNA_REQUEST_TIMING is on; None otherwise, which turns every hook below
+# into a no-op.
+request_timings = ContextVar("request_timings", default=None)
+
+slow_log = logging.getLogger("fpna_app.slow_requests")
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = []
+        self.phases = []
+
+    def total_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def db_ms(self):
+        return sum(query["ms"] for query in self.queries)
+
+
+def record_query(function, params, rows, started):
+    """
+    Record one database call that began at perf_counter() `started`
+    """
+    timings = request_timings.get()
+    if timings is None:
+        return
+    timings.queries.append({
+        "function": function,
+        "params": params,
+        "rows": rows,
+        "ms": round((time.perf_counter() - started) * 1000, 2),
+    })
+
+
+@contextmanager
+def phase(name):
+    """
+    Time a block of request work (e.g. "assemble", "render")
+    """
+    timings = request_timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.phases.append((name, round((time.perf_counter() - started) * 1000, 2)))
+
+
+def server_timing_header(timings, total_ms):
+    entries = [f'db;dur={timings.db_ms():.1f};desc="{len(timings.queries)} queries"']
+    entries += [f"{name};dur={ms:.1f}" for name, ms in timings.phases]
+    entries.append(f"total;dur={total_ms:.1f}")
+    return ", ".join(entries)
+
+
+def log_slow_request(request, response, timings, total_ms):
+    slow_log.warning(json.dumps({
+        "ts": time.time(),
+        "method": request.method,
+        "path": request.get_full_path(),
+        "status": response.status_code,
+        "total_ms": round(total_ms, 2),
+        "db_ms": round(timings.db_ms(), 2),
+        "phases": dict(timings.phases),
+        "queries": timings.queries,
+    }, default=str))
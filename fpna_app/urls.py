@@ -1,12 +1,23 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# FPNA_ASYNC_VIEWS serves the report views from their async versions (ASGI only)
+ASYNC_VIEWS = getattr(settings, "FPNA_ASYNC_VIEWS", False)
+
 urlpatterns = [
     path("", views.dashboard, name="dashboard"),
-    path("budget-vs-actual/", views.budget_vs_actual, name="budget_vs_actual"),
-    path("load-metrics/", views.load_metrics, name="load_metrics"),
-    path("load-accounts/", views.load_accounts, name="load_accounts"),
+    path("budget-vs-actual/", views.abudget_vs_actual if ASYNC_VIEWS else views.budget_vs_actual, name="budget_vs_actual"),
+    path("budget-vs-actual/group/", views.budget_vs_actual_group, name="budget_vs_actual_group"),
+    path("budget-vs-actual/export/", views.export_budget_vs_actual, name="export_budget_vs_actual"),
+    path("budget-vs-actual/transactions/", views.account_transactions, name="account_transactions"),
+    path("load-metrics/", views.aload_metrics if ASYNC_VIEWS else views.load_metrics, name="load_metrics"),
+    path("load-accounts/", views.aload_accounts if ASYNC_VIEWS else views.load_accounts, name="load_accounts"),
     path("select-company/", views.select_company, name="select_company"),
     path("settings/", views.settings, name="settings"),
     path("roll-month/", views.roll_month, name="roll_month"),
+    path("status/db/", views.db_status, name="db_status"),
+    path("status/warmup/", views.warmup_status, name="warmup_status"),
+    path("status/profiles/", views.profile_list, name="profile_list"),
+    path("status/profiles/<int:profile_id>/", views.profile_detail, name="profile_detail"),
 ]
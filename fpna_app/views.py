@@ -1,5 +1,20 @@
+import tempfile
+from datetime import date, datetime
+
+from asgiref.sync import sync_to_async
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
-from .db import fetch_actual_metrics, fetch_actual_accounts, fetch_budget_metrics, fetch_budget_accounts, fetch_budget_vs_actual_accounts, fetch_budget_vs_actual_metrics, fetch_actual_accounts_average, fetch_actual_metrics_average
+from django.template.loader import render_to_string
+from .db import fetch_actual_metrics, fetch_actual_accounts, iter_account_transactions, pool_stats, replica_status
+from .exports import iter_budget_vs_actual_csv, write_budget_vs_actual_xlsx
+from .reference import get_companies
+from .cache import get_current_period
+from .conditional import conditional_report
+from .reports import (
+    BUDGET_VS_ACTUAL_GROUPS, aget_budget_vs_actual, budget_vs_actual_columns, get_budget_vs_actual,
+    get_budget_vs_actual_group,
+)
+from .timing import phase
 
 def budget_vs_actual_safe(request):
     # Simple version without database calls
@@ -10,13 +25,28 @@ def budget_vs_actual_safe(request):
     
     context = {
         "financial_data": financial_data,
+        "columns": budget_vs_actual_columns(),
     }
     
     return render(request, "dashboard/budget_actual.html", context)
 
+def _selected_company(request):
+    try:
+        return request.session.get('selected_company', 'AFP')
+    except AttributeError:
+        return 'AFP'
+
+def _budget_vs_actual_etag(request):
+    # The columns, and so the page, follow the current period
+    return _selected_company(request), get_current_period()
+
+def _date_range_etag(request):
+    return _selected_company(request), request.GET.get("start_date"), request.GET.get("end_date")
+
+@conditional_report("budget_vs_actual", _budget_vs_actual_etag)
 def budget_vs_actual(request):
-    # Define the quarters using year/period format
-    # Q1 2025 = periods 1-3 (Jan-Mar), Q2 2025 = periods 4-6 (Apr-Jun)
+    # Columns follow the session's current_month/current_year (see
+    # reports.budget_vs_actual_columns)
     
     # Get selected company from session, default to AFP
     try:
@@ -25,401 +55,231 @@ def budget_vs_actual(request):
         selected_company = 'AFP'  # Fallback if session not available
     company_ids = [selected_company]
     
-    # Fetch Q1 2025 data (periods 1-3: Jan, Feb, Mar)
-    # Using start_period=1, end_period=4 (half-open, so this gets periods 1, 2, 3)
-    q1_accounts_data = fetch_actual_accounts(2025, 1, 2025, 4, company_ids)
-    q1_metrics_data = fetch_actual_metrics(2025, 1, 2025, 4, company_ids)
-    
-    # Fetch Q2 2025 data (periods 4-6: Apr, May, Jun)
-    # Using start_period=4, end_period=7 (half-open, so this gets periods 4, 5, 6)
-    q2_accounts_data = fetch_actual_accounts(2025, 4, 2025, 7, company_ids)
-    q2_metrics_data = fetch_actual_metrics(2025, 4, 2025, 7, company_ids)
-    
-    # Fetch Q2 2025 budget data (periods 4-6 for Q2: Apr, May, Jun)
-    # Q2 = periods 4, 5, 6, so we use start_period=4, end_period=7 (half-open)
-    q2_budget_accounts_data = fetch_budget_accounts(2025, 4, 2025, 7, company_ids)
-    q2_budget_metrics_data = fetch_budget_metrics(2025, 4, 2025, 7, company_ids)
-    
-    # Fetch Q2 2025 budget vs actual variance data
-    q2_variance_accounts_data = fetch_budget_vs_actual_accounts(2025, 4, 2025, 7, company_ids)
-    q2_variance_metrics_data = fetch_budget_vs_actual_metrics(2025, 4, 2025, 7, company_ids)
-    
-    # Fetch Q2 2025 average data (same year/period parameters as budget)
-    q2_average_accounts_data = fetch_actual_accounts_average(2025, 4, 2025, 7, company_ids)
-    q2_average_metrics_data = fetch_actual_metrics_average(2025, 4, 2025, 7, company_ids)
-    
-    # Fetch Q3 2025 budget data (periods 7-9 for Q3: Jul, Aug, Sep)
-    # Q3 = periods 7, 8, 9, so we use start_period=7, end_period=10 (half-open)
-    q3_budget_accounts_data = fetch_budget_accounts(2025, 7, 2025, 10, company_ids)
-    q3_budget_metrics_data = fetch_budget_metrics(2025, 7, 2025, 10, company_ids)
-    
-    # Convert to dictionaries for easier lookup
-    q1_accounts_dict = {row['ref_name']: row for row in q1_accounts_data} if q1_accounts_data else {}
-    q1_metrics_dict = {row['metric_name']: row for row in q1_metrics_data} if q1_metrics_data else {}
-    
-    q2_accounts_dict = {row['ref_name']: row for row in q2_accounts_data} if q2_accounts_data else {}
-    q2_metrics_dict = {row['metric_name']: row for row in q2_metrics_data} if q2_metrics_data else {}
-    
-    q2_budget_accounts_dict = {row['ref_name']: row for row in q2_budget_accounts_data} if q2_budget_accounts_data else {}
-    q2_budget_metrics_dict = {row['metric_name']: row for row in q2_budget_metrics_data} if q2_budget_metrics_data else {}
-    
-    q2_variance_accounts_dict = {row['ref_name']: row for row in q2_variance_accounts_data} if q2_variance_accounts_data else {}
-    q2_variance_metrics_dict = {row['metric_name']: row for row in q2_variance_metrics_data} if q2_variance_metrics_data else {}
-    
-    q2_average_accounts_dict = {row['ref_name']: row for row in q2_average_accounts_data} if q2_average_accounts_data else {}
-    q2_average_metrics_dict = {row['metric_name']: row for row in q2_average_metrics_data} if q2_average_metrics_data else {}
-    
-    q3_budget_accounts_dict = {row['ref_name']: row for row in q3_budget_accounts_data} if q3_budget_accounts_data else {}
-    q3_budget_metrics_dict = {row['metric_name']: row for row in q3_budget_metrics_data} if q3_budget_metrics_data else {}
-    
-    # Define the exact order from your Excel list - COMPLETE VERSION with groups
-    line_items = [
-        # Sales Accounts group
-        {"name": "Sales - Aluminum", "type": "account", "group": "gross_sales"},
-        {"name": "Sales - DC VA", "type": "account", "group": "gross_sales"}, 
-        {"name": "Sales - CNC VA", "type": "account", "group": "gross_sales"},
-        {"name": "Sales - SEC VA", "type": "account", "group": "gross_sales"},
-        {"name": "Sales - Intercompany", "type": "account", "group": "gross_sales"},
-        {"name": "Sales - Outside Purchases", "type": "account", "group": "gross_sales"},
-        {"name": "Gross Sales", "type": "metric", "group": "gross_sales", "is_group_header": True},
-        
-        # Sales Deduction Accounts group
-        {"name": "Sales - Returns", "type": "account", "group": "sales_deductions"},
-        {"name": "Sales - Discounts", "type": "account", "group": "sales_deductions"},
-        {"name": "Sales - Allowances", "type": "account", "group": "sales_deductions"},
-        {"name": "Sales Deductions", "type": "metric", "group": "sales_deductions", "is_group_header": True},
-        {"name": "% of Sales", "type": "percentage"},
-        
-        {"name": "Net Sales", "type": "metric"},
-        
-        # Material Accounts group
-        {"name": "Material - 304", "type": "account", "group": "total_metal_costs"},
-        {"name": "Material - 360", "type": "account", "group": "total_metal_costs"},
-        {"name": "Material - 365", "type": "account", "group": "total_metal_costs"},
-        {"name": "Material - 369", "type": "account", "group": "total_metal_costs"},
-        {"name": "Material - 380", "type": "account", "group": "total_metal_costs"},
-        {"name": "Material - 383", "type": "account", "group": "total_metal_costs"},
-        {"name": "Material - 384", "type": "account", "group": "total_metal_costs"},
-        {"name": "Material - 390", "type": "account", "group": "total_metal_costs"},
-        {"name": "Material - 413", "type": "account", "group": "total_metal_costs"},
-        {"name": "Material - Twitch", "type": "account", "group": "total_metal_costs"},
-        {"name": "Material - Discounts", "type": "account", "group": "total_metal_costs"},
-        {"name": "Material - Scrap", "type": "account", "group": "total_metal_costs"},
-        {"name": "Material - Inventory Change", "type": "account", "group": "total_metal_costs"},
-        {"name": "Total Metal Costs", "type": "metric", "group": "total_metal_costs", "is_group_header": True},
-        
-        # CoS Accounts group
-        {"name": "CoS - Impregnation", "type": "account", "group": "total_outside_costs"},
-        {"name": "CoS - Inserts/Castings", "type": "account", "group": "total_outside_costs"},
-        {"name": "CoS - Machining", "type": "account", "group": "total_outside_costs"},
-        {"name": "CoS - Painting/Plating", "type": "account", "group": "total_outside_costs"},
-        {"name": "CoS - Containers/Boxes", "type": "account", "group": "total_outside_costs"},
-        {"name": "Total Outside Costs", "type": "metric", "group": "total_outside_costs", "is_group_header": True},
-        
-        {"name": "Total Material Costs", "type": "metric"},
-        {"name": "% of Net Sales (x Tool)", "type": "percentage"},
-        
-        {"name": "Contribution (x Tool/CNC)", "type": "metric"},
-        {"name": "Contribution (x Tool)", "type": "metric"},
-        {"name": "% of Net Sales (x Tool)", "type": "percentage"},
-        
-        # Tooling Sales
-        {"name": "Tooling Sales - New", "type": "account"},
-        {"name": "Tooling Sales - Repairs", "type": "account"},
-        {"name": "Tooling Sales - Perpetual", "type": "account"},
-        {"name": "Tooling Sales", "type": "metric"},
-        
-        # Tooling Costs
-        {"name": "Tooling Costs - New", "type": "account"},
-        {"name": "Tooling Costs - Repairs", "type": "account"},
-        {"name": "Tooling Costs - Perpetual", "type": "account"},
-        {"name": "Tooling Costs", "type": "metric"},
-        
-        {"name": "Tooling Contribution", "type": "metric"},
-        {"name": "% of Tooling Sales", "type": "percentage"},
-        
-        {"name": "Total Contribution", "type": "metric"},
-        {"name": "% of Net Sales (x Tool)", "type": "percentage"},
-        
-        # Direct Labor group
-        {"name": "Direct Labor", "type": "metric"},
-        {"name": "Melt - Direct Labor", "type": "account", "group": "total_direct_labor"},
-        {"name": "Melt - Direct Labor OT", "type": "account", "group": "total_direct_labor"},
-        {"name": "DC - Direct Labor", "type": "account", "group": "total_direct_labor"},
-        {"name": "DC - Direct Labor OT", "type": "account", "group": "total_direct_labor"},
-        {"name": "FIN - Direct Labor", "type": "account", "group": "total_direct_labor"},
-        {"name": "FIN - Direct Labor OT", "type": "account", "group": "total_direct_labor"},
-        {"name": "CNC - Direct Labor", "type": "account", "group": "total_direct_labor"},
-        {"name": "CNC - Direct Labor OT", "type": "account", "group": "total_direct_labor"},
-        {"name": "Total Direct Labor", "type": "metric", "group": "total_direct_labor", "is_group_header": True},
-        {"name": "% of Contribution x Tooling", "type": "percentage"},
-        
-        # Direct Expenses
-        {"name": "Direct Expenses", "type": "metric"},
-        {"name": "Melt - Flux", "type": "account"},
-        {"name": "Melt - Supplies", "type": "account"},
-        {"name": "DC - Hydraulic Fluid", "type": "account"},
-        {"name": "DC - Die Lube", "type": "account"},
-        {"name": "DC - Plunger Lube", "type": "account"},
-        {"name": "DC - Hot Oil Expense", "type": "account"},
-        {"name": "DC - Supplies", "type": "account"},
-        {"name": "DC - Nitrogen/Gases", "type": "account"},
-        {"name": "DC - Piston Tips", "type": "account"},
-        {"name": "DC - Shot Sleeves", "type": "account"},
-        {"name": "DC - Plunger Arms", "type": "account"},
-        {"name": "DC - Impregnation", "type": "account"},
-        {"name": "FIN - Supplies", "type": "account"},
-        {"name": "CNC - Fluids", "type": "account"},
-        {"name": "CNC - Perishable Tools", "type": "account"},
-        {"name": "CNC - Machine Maintenance", "type": "account"},
-        {"name": "CNC - Outside Maintenance", "type": "account"},
-        {"name": "MAINT - Air Compressors", "type": "account"},
-        {"name": "MAINT - Automated Equipment", "type": "account"},
-        {"name": "MAINT - Cranes", "type": "account"},
-        {"name": "MAINT - DC Machines", "type": "account"},
-        {"name": "MAINT - Trim Presses", "type": "account"},
-        {"name": "MAINT - Furnaces", "type": "account"},
-        {"name": "MAINT - Fork Lift Trucks", "type": "account"},
-        {"name": "MAINT - Shot Blast", "type": "account"},
-        {"name": "MAINT - Evap/Cooling Tower", "type": "account"},
-        {"name": "TR - Outside Shops", "type": "account"},
-        {"name": "TR - Ejector/Core/Leader Pins", "type": "account"},
-        {"name": "TR - Supplies", "type": "account"},
-        {"name": "QA - Gages/Supplies", "type": "account"},
-        {"name": "QA - Sorting", "type": "account"},
-        {"name": "SHPG - Supplies", "type": "account"},
-        {"name": "SHPG - Freight In", "type": "account"},
-        {"name": "SHPG - Premium FRT Out", "type": "account"},
-        {"name": "SHPG - Freight on Returns", "type": "account"},
-        {"name": "GF - General Supplies", "type": "account"},
-        {"name": "GF - Satefy Supplies", "type": "account"},
-        {"name": "GF - Janitorial Supplies", "type": "account"},
-        {"name": "GF - Uniforms", "type": "account"},
-        {"name": "GF - Building Maintenance", "type": "account"},
-        {"name": "GF - Waste Water Disposal", "type": "account"},
-        {"name": "Total Direct Expenses", "type": "metric"},
-        {"name": "% of Contribution x Tooling", "type": "percentage"},
-        
-        {"name": "Total Direct", "type": "metric"},
-        {"name": "% of Contribution x Tooling", "type": "percentage"},
-        
-        # Indirect Labor
-        {"name": "Indirect Labor", "type": "metric"},
-        {"name": "Melt - Indirect Labor", "type": "account"},
-        {"name": "Melt - Indirect Labor OT", "type": "account"},
-        {"name": "DC - Indirect Labor", "type": "account"},
-        {"name": "DC - Indirect Labor OT", "type": "account"},
-        {"name": "FIN - Indirect Labor", "type": "account"},
-        {"name": "FIN - Indirect Labor OT", "type": "account"},
-        {"name": "CNC - Indirect Labor", "type": "account"},
-        {"name": "CNC - Indirect Labor OT", "type": "account"},
-        {"name": "PCS - Indirect Labor", "type": "account"},
-        {"name": "PCS - Indirect Labor OT", "type": "account"},
-        {"name": "MAINT - Indirect Labor", "type": "account"},
-        {"name": "MAINT - Indirect Labor OT", "type": "account"},
-        {"name": "TR - Indirect Labor", "type": "account"},
-        {"name": "TR - Indirect Labor OT", "type": "account"},
-        {"name": "QA - Indirect Labor", "type": "account"},
-        {"name": "QA - Indirect Labor OT", "type": "account"},
-        {"name": "SHPG - Indirect Labor", "type": "account"},
-        {"name": "SHPG - Indirect Labor OT", "type": "account"},
-        {"name": "ENG - Indirect Labor", "type": "account"},
-        {"name": "ENG - Indirect Labor OT", "type": "account"},
-        {"name": "GF - Indirect Labor", "type": "account"},
-        {"name": "SGA - Indirect Labor", "type": "account"},
-        {"name": "SGA - Indirect Labor OT", "type": "account"},
-        {"name": "Total Indirect Labor", "type": "metric"},
-        {"name": "% of Contribution x Tooling", "type": "percentage"},
-        
-        # Indirect Expenses
-        {"name": "Indirect Expenses", "type": "metric"},
-        {"name": "QA - IATF Fees", "type": "account"},
-        {"name": "GF - Training/Education", "type": "account"},
-        {"name": "GF - Depreciation", "type": "account"},
-        {"name": "GF - Electricity", "type": "account"},
-        {"name": "GF - Water", "type": "account"},
-        {"name": "GF - Natural Gas", "type": "account"},
-        {"name": "GF - Propane", "type": "account"},
-        {"name": "GF - General Liability Ins.", "type": "account"},
-        {"name": "GF - Property Taxes", "type": "account"},
-        {"name": "GF - Meridian Leases", "type": "account"},
-        {"name": "GF - Equipment Lease/Rental", "type": "account"},
-        {"name": "GF - Building Expense", "type": "account"},
-        {"name": "SGA - Commissions", "type": "account"},
-        {"name": "SGA - Supplies/Fees", "type": "account"},
-        {"name": "SGA - Professional Services", "type": "account"},
-        {"name": "SGA - Phone/Data", "type": "account"},
-        {"name": "SGA - Travel/Entertainment", "type": "account"},
-        {"name": "SGA - Vehicle Expense", "type": "account"},
-        {"name": "SGA - Recruiting/Relocation", "type": "account"},
-        {"name": "SGA - Corporate Expenses", "type": "account"},
-        {"name": "SGA - Payroll Fees", "type": "account"},
-        {"name": "SGA - Outside Janitorial", "type": "account"},
-        {"name": "GF - Management Bonus", "type": "account"},
-        {"name": "GF - Vacation/Holiday Pay", "type": "account"},
-        {"name": "GF - 401k Match", "type": "account"},
-        {"name": "GF - Payroll Taxes", "type": "account"},
-        {"name": "GF - Workers Comp", "type": "account"},
-        {"name": "GF - Life Insurance", "type": "account"},
-        {"name": "GF - Health Insurance", "type": "account"},
-        {"name": "GF - Profit Sharing", "type": "account"},
-        {"name": "Total Indirect Expenses", "type": "metric"},
-        {"name": "% of Contribution x Tooling", "type": "percentage"},
-        
-        {"name": "Total Indirect", "type": "metric"},
-        {"name": "% of Contribution x Tooling", "type": "percentage"},
-        
-        {"name": "Operating Profit/(Loss)", "type": "metric"},
-        {"name": "% of Contribution x Tooling", "type": "percentage"},
-        
-        # Other Income/Expenses
-        {"name": "OTHR - Absorption", "type": "account"},
-        {"name": "OTHR - Interest Expense", "type": "account"},
-        {"name": "OTHR - Misc Income", "type": "account"},
-        {"name": "OTHR - Fixed Asset Gain/(Loss)", "type": "account"},
-        {"name": "OTHR - Income Tax Expense", "type": "account"},
-        {"name": "Total Other Inc/(Exp)", "type": "metric"},
-        
-        {"name": "Net Income/(Loss)", "type": "metric"},
-    ]
-    
-    # Build the data structure for the template
-    financial_data = []
-    for item in line_items:
-        if item["type"] == "account":
-            # Get account data from database for each quarter
-            q1_account_data = q1_accounts_dict.get(item["name"])
-            q2_account_data = q2_accounts_dict.get(item["name"])
-            q2_budget_data = q2_budget_accounts_dict.get(item["name"])
-            q2_variance_data = q2_variance_accounts_dict.get(item["name"])
-            q2_average_data = q2_average_accounts_dict.get(item["name"])
-            q3_budget_data = q3_budget_accounts_dict.get(item["name"])
-            
-            # Extract values, defaulting to 0 if not found
-            q1_val = q1_account_data.get('value', 0) if q1_account_data else 0
-            q2_val = q2_account_data.get('value', 0) if q2_account_data else 0
-            q2_budget_val = q2_budget_data.get('value', 0) if q2_budget_data else 0
-            q2_average_val = q2_average_data.get('avg_value', 0) if q2_average_data else 0
-            q3_budget_val = q3_budget_data.get('value', 0) if q3_budget_data else 0
-            
-            # Get variance from dedicated function
-            variance = q2_variance_data.get('variance', 0) if q2_variance_data else 0
-            
-            financial_data.append({
-                "name": item["name"],
-                "type": "account", 
-                "group": item.get("group"),
-                "is_group_header": item.get("is_group_header", False),
-                "q1_actual": q1_val,
-                "q2_actual": q2_val,
-                "q2_budget": q2_budget_val,
-                "q2_average": q2_average_val,
-                "q3_budget": q3_budget_val,
-                "variance": variance,
-            })
-        elif item["type"] == "metric":
-            # Get metric data from database for each quarter
-            q1_metric_data = q1_metrics_dict.get(item["name"])
-            q2_metric_data = q2_metrics_dict.get(item["name"])
-            q2_budget_data = q2_budget_metrics_dict.get(item["name"])
-            q2_variance_data = q2_variance_metrics_dict.get(item["name"])
-            q2_average_data = q2_average_metrics_dict.get(item["name"])
-            q3_budget_data = q3_budget_metrics_dict.get(item["name"])
-            
-            # Extract values, defaulting to 0 if not found
-            q1_val = q1_metric_data.get('value', 0) if q1_metric_data else 0
-            q2_val = q2_metric_data.get('value', 0) if q2_metric_data else 0
-            q2_budget_val = q2_budget_data.get('value', 0) if q2_budget_data else 0
-            q2_average_val = q2_average_data.get('avg_value', 0) if q2_average_data else 0
-            q3_budget_val = q3_budget_data.get('value', 0) if q3_budget_data else 0
-            
-            # Get variance from dedicated function
-            variance = q2_variance_data.get('variance', 0) if q2_variance_data else 0
-            
-            financial_data.append({
-                "name": item["name"],
-                "type": "metric",
-                "group": item.get("group"),
-                "is_group_header": item.get("is_group_header", False),
-                "q1_actual": q1_val,
-                "q2_actual": q2_val,
-                "q2_budget": q2_budget_val,
-                "q2_average": q2_average_val,
-                "q3_budget": q3_budget_val,
-                "variance": variance,
-            })
-        else:  # percentage
-            financial_data.append({
-                "name": item["name"],
-                "type": "percentage",
-                "group": item.get("group"),
-                "is_group_header": item.get("is_group_header", False),
-                "q1_actual": 0,  # Calculate percentages
-                "q2_actual": 0,
-                "q2_budget": 0,
-                "q2_average": 0,
-                "q3_budget": 0,
-                "variance": 0,
-            })
+    period = get_current_period()
+    # Account rows are loaded per group when expanded (budget_vs_actual_group)
+    financial_data = get_budget_vs_actual(company_ids, period, detail=False)
     
     context = {
         "financial_data": financial_data,
+        "columns": budget_vs_actual_columns(period),
+        "lazy_groups": True,
     }
     
-    return render(request, "dashboard/budget_actual.html", context)
+    with phase("render"):
+        return render(request, "dashboard/budget_actual.html", context)
 
-def load_metrics(request):
+async def _aselected_company(request):
+    try:
+        return await request.session.aget('selected_company', 'AFP')
+    except AttributeError:
+        return 'AFP'
+
+@conditional_report("budget_vs_actual", _budget_vs_actual_etag)
+async def abudget_vs_actual(request):
+    """
+    Async budget_vs_actual (FPNA_ASYNC_VIEWS): the report queries run on the
+    async connection pool, so the worker serves other users while they wait
+    """
+    company_ids = [await _aselected_company(request)]
+    period = get_current_period()
+    financial_data = await aget_budget_vs_actual(company_ids, period, detail=False)
+    context = {
+        "financial_data": financial_data,
+        "columns": budget_vs_actual_columns(period),
+        "lazy_groups": True,
+    }
+    # Context processors read the session and reference data synchronously
+    with phase("render"):
+        return await sync_to_async(render)(request, "dashboard/budget_actual.html", context)
+
+def _budget_vs_actual_group_etag(request):
+    return _selected_company(request), get_current_period(), request.GET.get("group")
+
+@conditional_report("budget_vs_actual_group", _budget_vs_actual_group_etag)
+def budget_vs_actual_group(request):
+    """
+    htmx partial: the account rows of one Budget vs. Actual group (?group=),
+    requested the first time the group is expanded
+    """
+    group = request.GET.get("group")
+    if group not in BUDGET_VS_ACTUAL_GROUPS:
+        return HttpResponseBadRequest("Unknown group")
+    period = get_current_period()
+    rows = get_budget_vs_actual_group([_selected_company(request)], group, period)
+    with phase("render"):
+        return render(request, "dashboard/_budget_actual_group_rows.html", {
+            "rows": rows,
+            "group": group,
+            "columns": budget_vs_actual_columns(period),
+        })
+
+def export_budget_vs_actual(request):
+    """
+    Download the Budget vs. Actual report as CSV (streamed) or XLSX.
+
+    `?format=csv|xlsx`; `?scope=all` exports every company in public.company,
+    generating one company's report at a time.
+    """
+    export_format = request.GET.get("format", "csv")
+    if request.GET.get("scope") == "all":
+        company_ids = get_companies()
+        filename = "budget_vs_actual_all_companies"
+    else:
+        try:
+            selected_company = request.session.get('selected_company', 'AFP')
+        except AttributeError:
+            selected_company = 'AFP'
+        company_ids = [selected_company]
+        filename = f"budget_vs_actual_{selected_company}"
+    period = get_current_period()
+
+    if export_format == "csv":
+        return StreamingHttpResponse(
+            iter_budget_vs_actual_csv(company_ids, period),
+            content_type="text/csv",
+            headers={"Content-Disposition": f'attachment; filename="{filename}.csv"'},
+        )
+    if export_format == "xlsx":
+        # The zip container can only be finalised once all sheets are written,
+        # so the workbook goes to a temporary file that is then streamed.
+        output = tempfile.TemporaryFile()
+        write_budget_vs_actual_xlsx(company_ids, output, period)
+        output.seek(0)
+        return FileResponse(
+            output,
+            as_attachment=True,
+            filename=f"{filename}.xlsx",
+            content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        )
+    return HttpResponseBadRequest("Unsupported export format")
+
+
+TRANSACTION_PAGE_SIZE = 200
+
+
+def account_transactions(request):
+    """
+    Stream one page of the transactions behind an account cell (htmx partial).
+
+    Pages are keyed on the (posting_date, uniqueid) of the last row shown,
+    passed back as `after`, so no page re-reads the rows before it. With
+    FPNA_ACTUALS_SOURCE=resolved each page is a range scan of
+    gl_txn_resolved_drilldown; on the raw ledger, which has no such index,
+    each page still filters and sorts the account's rows in the period range.
+    """
+    account = request.GET.get("account")
+    try:
+        start_year = int(request.GET["start_year"])
+        start_period = int(request.GET["start_period"])
+        end_year = int(request.GET["end_year"])
+        end_period = int(request.GET["end_period"])
+        after = None
+        if request.GET.get("after"):
+            # An empty date part stands for an undated row
+            after_date, after_id = request.GET["after"].split("~")
+            after = (date.fromisoformat(after_date) if after_date else None, int(after_id))
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest("Invalid period or page cursor")
+    if not account:
+        return HttpResponseBadRequest("Missing account")
+
+    try:
+        selected_company = request.session.get('selected_company', 'AFP')
+    except AttributeError:
+        selected_company = 'AFP'
+    company_ids = [selected_company]
+
+    context = {
+        "account": account,
+        "start_year": start_year, "start_period": start_period,
+        "end_year": end_year, "end_period": end_period,
+    }
+
+    def stream():
+        if after is None:
+            yield render_to_string("dashboard/_transactions_table.html", context, request)
+        received = 0
+        shown = 0
+        last = None
+        # One row past the page tells us whether another page exists
+        for chunk in iter_account_transactions(account, start_year, start_period, end_year, end_period,
+                                               company_ids, after=after, limit=TRANSACTION_PAGE_SIZE + 1):
+            received += len(chunk)
+            chunk = chunk[:TRANSACTION_PAGE_SIZE - shown]
+            if chunk:
+                shown += len(chunk)
+                last = chunk[-1]
+                yield render_to_string("dashboard/_transaction_rows.html", {"transactions": chunk})
+        next_cursor = None
+        if received > TRANSACTION_PAGE_SIZE:
+            last_date = last['posting_date'].isoformat() if last['posting_date'] else ""
+            next_cursor = f"{last_date}~{last['uniqueid']}"
+        yield render_to_string("dashboard/_transactions_more.html", {
+            **context,
+            "first_page": after is None,
+            "empty": after is None and shown == 0,
+            "next_cursor": next_cursor,
+        })
+
+    return StreamingHttpResponse(stream(), content_type="text/html; charset=utf-8")
+
+def _date_range_periods(request):
+    """
+    (start_year, start_period, end_year, end_period) from ?start_date&end_date,
+    taking each date's month as its period; None if either is missing
+    """
     start_date = request.GET.get("start_date")
     end_date = request.GET.get("end_date")
+    if not (start_date and end_date):
+        return None
+    start_dt = datetime.strptime(start_date, '%Y-%m-%d')
+    end_dt = datetime.strptime(end_date, '%Y-%m-%d')
+    return start_dt.year, start_dt.month, end_dt.year, end_dt.month
+
+@conditional_report("load_metrics", _date_range_etag)
+def load_metrics(request):
     try:
         selected_company = request.session.get('selected_company', 'AFP')
     except AttributeError:
         selected_company = 'AFP'
     company_ids = [selected_company]
-    
-    # Convert date strings to year/period format
-    # For now, assume dates map to periods (this may need adjustment based on your business logic)
-    from datetime import datetime
-    if start_date and end_date:
-        start_dt = datetime.strptime(start_date, '%Y-%m-%d')
-        end_dt = datetime.strptime(end_date, '%Y-%m-%d')
-        start_year = start_dt.year
-        start_period = start_dt.month  # Assuming month = period
-        end_year = end_dt.year
-        end_period = end_dt.month  # Assuming month = period
-        
-        metrics = fetch_actual_metrics(start_year, start_period, end_year, end_period, company_ids)
-    else:
-        metrics = []
+
+    periods = _date_range_periods(request)
+    metrics = fetch_actual_metrics(*periods, company_ids) if periods else []
     
     return render(request, "dashboard/_metrics_table.html", {"metrics": metrics})
 
+@conditional_report("load_accounts", _date_range_etag)
 def load_accounts(request):
-    start_date = request.GET.get("start_date")
-    end_date = request.GET.get("end_date")
     try:
         selected_company = request.session.get('selected_company', 'AFP')
     except AttributeError:
         selected_company = 'AFP'
     company_ids = [selected_company]
-    
-    # Convert date strings to year/period format
-    # For now, assume dates map to periods (this may need adjustment based on your business logic)
-    from datetime import datetime
-    if start_date and end_date:
-        start_dt = datetime.strptime(start_date, '%Y-%m-%d')
-        end_dt = datetime.strptime(end_date, '%Y-%m-%d')
-        start_year = start_dt.year
-        start_period = start_dt.month  # Assuming month = period
-        end_year = end_dt.year
-        end_period = end_dt.month  # Assuming month = period
-        
-        accounts = fetch_actual_accounts(start_year, start_period, end_year, end_period, company_ids)
-    else:
-        accounts = []
+
+    periods = _date_range_periods(request)
+    accounts = fetch_actual_accounts(*periods, company_ids) if periods else []
     
     return render(request, "dashboard/_accounts_table.html", {"accounts": accounts})
 
+@conditional_report("load_metrics", _date_range_etag)
+async def aload_metrics(request):
+    from .async_db import afetch_actual_metrics
+
+    periods = _date_range_periods(request)
+    company_ids = [await _aselected_company(request)]
+    metrics = await afetch_actual_metrics(*periods, company_ids) if periods else []
+    return await sync_to_async(render)(request, "dashboard/_metrics_table.html", {"metrics": metrics})
+
+@conditional_report("load_accounts", _date_range_etag)
+async def aload_accounts(request):
+    from .async_db import afetch_actual_accounts
+
+    periods = _date_range_periods(request)
+    company_ids = [await _aselected_company(request)]
+    accounts = await afetch_actual_accounts(*periods, company_ids) if periods else []
+    return await sync_to_async(render)(request, "dashboard/_accounts_table.html", {"accounts": accounts})
+
 def dashboard(request):
     # Get selected company from session, default to AFP
     try:
@@ -429,7 +289,6 @@ def dashboard(request):
     
     context = {
         'selected_company': selected_company,
-        'companies': ['AFP', 'Company1', 'Company2'],  # Add available companies
     }
     return render(request, "dashboard/dashboard.html", context)
 
@@ -463,8 +322,6 @@ def settings(request):
     """
     Settings page for managing current month/year and other app settings
     """
-    from datetime import datetime
-    
     # Get current settings from session or use defaults
     try:
         selected_company = request.session.get('selected_company', 'AFP')
@@ -490,7 +347,6 @@ def settings(request):
     
     context = {
         'selected_company': selected_company,
-        'companies': ['AFP', 'Company1', 'Company2'],
         'current_month': current_month,
         'current_year': current_year,
         'months': [
@@ -507,8 +363,6 @@ def roll_month(request):
     """
     Roll to the next month
     """
-    from datetime import datetime
-    
     if request.method == 'POST':
         try:
             current_month = request.session.get('current_month', datetime.now().month)
@@ -525,6 +379,13 @@ def roll_month(request):
             request.session['current_month'] = new_month
             request.session['current_year'] = new_year
             
+            # Compute every company's report for the new period in the background,
+            # in every worker
+            from django.conf import settings as django_settings
+            if getattr(django_settings, "FPNA_WARMUP_ON_ROLL", True):
+                from .warmup import warm_all_workers
+                warm_all_workers((new_year, new_month))
+            
             # Show success message
             from django.contrib import messages
             messages.success(request, f'Rolled to: {datetime(new_year, new_month, 1).strftime("%B %Y")}')
@@ -534,3 +395,64 @@ def roll_month(request):
             messages.error(request, f'Error rolling month: {str(e)}')
     
     return redirect('settings')
+
+def db_status(request):
+    """
+    Staff-only JSON snapshot of this worker's database pools (checkouts,
+    wait time, prepared statements), read replica routing, cache
+    invalidation thread, report cache and single-flight counters
+    """
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    from . import async_db, invalidation
+    from .cache import report_cache
+    from .singleflight import async_report_flight, report_flight
+    return JsonResponse({
+        "pool": pool_stats(),
+        "async_pool": async_db.pool_stats(),
+        "replica": replica_status(),
+        "invalidation": invalidation.status(),
+        "cache": report_cache.stats(),
+        "single_flight": {"sync": report_flight.stats(), "async": async_report_flight.stats()},
+    })
+
+def warmup_status(request):
+    """
+    Staff-only JSON view of the report warm-up: per company, its state and
+    whether its report is currently cached in this worker
+    """
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    from .warmup import warmup_status as status
+    return JsonResponse(status(get_current_period()))
+
+def profile_list(request):
+    """
+    Staff-only JSON list of this worker's recent request profiles, newest first
+    """
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    from .profiling import profiles
+    summary_keys = ("id", "ts", "path", "user", "total_ms", "db_ms", "samples")
+    return JsonResponse({"profiles": [
+        {key: profile[key] for key in summary_keys} | {"queries": len(profile["queries"])}
+        for profile in reversed(list(profiles))
+    ]})
+
+def profile_detail(request, profile_id):
+    """
+    Staff-only download of one profile: its collapsed stacks as text (ready
+    for flamegraph.pl or speedscope), or everything, SQL timings included,
+    with ?format=json
+    """
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    from .profiling import get_profile
+    profile = get_profile(profile_id)
+    if profile is None:
+        raise Http404("Profile not found (profiles are kept per worker)")
+    if request.GET.get("format") == "json":
+        return JsonResponse(profile)
+    response = HttpResponse(profile["collapsed"], content_type="text/plain; charset=utf-8")
+    response["Content-Disposition"] = f'attachment; filename="profile-{profile_id}.collapsed"'
+    return response
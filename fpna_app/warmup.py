@@ -0,0 +1,118 @@
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from .cache import current_period, get_current_period
+
+logger = logging.getLogger(__name__)
+
+# companyid -> {"period", "state" (pending/warming/warm/error), "seconds", "error", "updated"}
+_status = {}
+_running = set()
+_lock = threading.Lock()
+
+
+def _set_status(company, period, state, **extra):
+    with _lock:
+        _status[company] = {"period": period, "state": state, "updated": time.time(), **extra}
+
+
+def _warm_company(company, period):
+    from .reports import get_budget_vs_actual
+
+    # Cache TTLs are decided from the current period, which outside a request
+    # would otherwise be today's date
+    token = current_period.set(period)
+    started = time.monotonic()
+    _set_status(company, period, "warming")
+    try:
+        close_old_connections()
+        get_budget_vs_actual([company], period)
+        _set_status(company, period, "warm", seconds=round(time.monotonic() - started, 3))
+    except Exception as e:
+        _set_status(company, period, "error", error=str(e))
+    finally:
+        current_period.reset(token)
+        connection.close()
+
+
+def _run(period, company_ids):
+    try:
+        if company_ids is None:
+            from .reference import get_companies
+            company_ids = get_companies()
+        for company in company_ids:
+            _set_status(company, period, "pending")
+        with ThreadPoolExecutor(max_workers=getattr(settings, "FPNA_WARMUP_WORKERS", 2),
+                                thread_name_prefix="fpna-warmup") as executor:
+            list(executor.map(lambda company: _warm_company(company, period), company_ids))
+    finally:
+        connection.close()
+        with _lock:
+            _running.discard(period)
+
+
+def warm_reports(period=None, company_ids=None):
+    """
+    Compute and cache the Budget vs. Actual report of every company (or of
+    `company_ids`) for `period` in a background thread, at most
+    FPNA_WARMUP_WORKERS companies at a time. A warm-up already running for
+    the period is not started twice. Only this worker's report cache is
+    filled; warm_all_workers reaches the others. The page shares the same
+    single flight, and the warmed window's open months outlive
+    FPNA_CACHE_OPEN_TTL only while cache invalidation runs (see
+    ReportCache.ttl_for).
+
+    Returns the background thread, or None if nothing was started.
+    """
+    period = tuple(period or get_current_period())
+    with _lock:
+        if period in _running:
+            return None
+        _running.add(period)
+    thread = threading.Thread(target=_run, args=(period, company_ids), name="fpna-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def warm_all_workers(period):
+    """
+    Warm `period` in every gunicorn worker: the month is NOTIFYed on the
+    cache invalidation channel and each worker's listener (this one
+    included) runs warm_reports. Without a listening invalidation thread
+    (FPNA_CACHE_INVALIDATION other than "listen", or LISTEN unavailable)
+    only this worker is warmed, and the others compute each report on its
+    first request.
+    """
+    from . import invalidation
+
+    period = tuple(period)
+    if invalidation.listening():
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_notify(%s, %s)", [invalidation.CHANNEL, json.dumps({"warm": period})])
+            return None
+        except Exception as e:
+            logger.warning("Warm-up not announced to the other workers: %s", e)
+    return warm_reports(period)
+
+
+def warmup_status(period=None):
+    """
+    Per-company warm-up state for this worker, plus whether each report's
+    data is still in the report cache for `period`
+    """
+    from .reports import is_budget_vs_actual_cached
+
+    period = tuple(period or get_current_period())
+    with _lock:
+        status = {company: dict(entry) for company, entry in _status.items()}
+        running = sorted(_running)
+    for company, entry in status.items():
+        entry["cached"] = is_budget_vs_actual_cached([company], period)
+    return {"period": period, "running": running, "companies": status}
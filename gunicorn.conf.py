@@ -0,0 +1,26 @@
+# Picked up automatically by gunicorn when started from the project root
+
+
+def post_worker_init(worker):
+    """
+    Check the report layouts against the reference data, warm the report
+    cache of each new worker when FPNA_WARMUP_ON_BOOT=1, and start its cache
+    invalidation thread (FPNA_CACHE_INVALIDATION)
+    """
+    from django.conf import settings
+    from django.db import connection
+
+    from fpna_app.invalidation import start
+    from fpna_app.layout import check_layouts
+
+    try:
+        check_layouts()
+    except Exception as e:
+        worker.log.warning("Report layouts not checked: %s", e)
+    finally:
+        connection.close()
+    start()
+
+    if getattr(settings, "FPNA_WARMUP_ON_BOOT", False):
+        from fpna_app.warmup import warm_reports
+        warm_reports()
@@ -34,16 +34,23 @@ INSTALLED_APPS = [
 
 # --- Middleware (WhiteNoise directly after SecurityMiddleware in prod) ---
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack
+    "fpna_app.middleware.ServerTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     # Use WhiteNoise only when DEBUG is False (prod)
     *(
         ["whitenoise.middleware.WhiteNoiseMiddleware"]
         if not DEBUG else []
     ),
+    # Brotli (if installed) or gzip for the large report tables
+    "fpna_app.middleware.CompressionMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "fpna_app.middleware.ReportPeriodMiddleware",
+    # After authentication: only staff can ask for a profile
+    "fpna_app.middleware.ProfilingMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -74,7 +81,40 @@ WSGI_APPLICATION = "project.wsgi.application"
 # --- Database ---
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-if DATABASE_URL:
+# Connection budget: FPNA_DB_MAX_CONNECTIONS is split across the WEB_CONCURRENCY
+# worker processes (FPNA_DB_WORKER_CONNECTIONS each). Within a worker, the
+# cache invalidation LISTEN connection takes one, the async pool (with
+# FPNA_ASYNC_VIEWS) half of the rest, and the sync pool what remains, so a
+# worker never opens more than its share on the primary. A read replica gets
+# the same split of FPNA_DB_REPLICA_MAX_CONNECTIONS. With the pool off every
+# worker thread keeps its own persistent connection as before.
+FPNA_DB_POOL = os.getenv("FPNA_DB_POOL", "1") == "1"
+FPNA_DB_MAX_CONNECTIONS = int(os.getenv("FPNA_DB_MAX_CONNECTIONS", "20"))
+FPNA_DB_WORKER_CONNECTIONS = max(1, FPNA_DB_MAX_CONNECTIONS // int(os.getenv("WEB_CONCURRENCY", "1")))
+_pool_connections = FPNA_DB_WORKER_CONNECTIONS - (os.getenv("FPNA_CACHE_INVALIDATION", "off") == "listen")
+FPNA_ASYNC_POOL_MAX_SIZE = int(os.getenv(
+    "FPNA_ASYNC_POOL_MAX_SIZE",
+    str(max(1, _pool_connections // 2) if os.getenv("FPNA_ASYNC_VIEWS", "0") == "1" else 1),
+))
+FPNA_DB_POOL_SIZE = max(1, _pool_connections - (
+    FPNA_ASYNC_POOL_MAX_SIZE if os.getenv("FPNA_ASYNC_VIEWS", "0") == "1" else 0
+))
+# Seconds a request waits for a pooled connection before failing
+FPNA_DB_POOL_TIMEOUT = float(os.getenv("FPNA_DB_POOL_TIMEOUT", "10"))
+# Prepare finance.* calls once per connection; turn off behind a transaction-mode PgBouncer
+FPNA_PREPARE_STATEMENTS = os.getenv("FPNA_PREPARE_STATEMENTS", "1") == "1"
+
+if DATABASE_URL and FPNA_DB_POOL:
+    # Django's psycopg 3 pool replaces persistent connections (conn_max_age must be 0)
+    DATABASES = {
+        "default": dj_database_url.parse(DATABASE_URL, conn_max_age=0)
+    }
+    DATABASES["default"].setdefault("OPTIONS", {})["pool"] = {
+        "min_size": 1,
+        "max_size": FPNA_DB_POOL_SIZE,
+        "timeout": FPNA_DB_POOL_TIMEOUT,
+    }
+elif DATABASE_URL:
     DATABASES = {
         "default": dj_database_url.parse(DATABASE_URL, conn_max_age=600)
     }
@@ -86,6 +126,152 @@ else:
         }
     }
 
+# Optional streaming read replica for finance.* report reads (fpna_app.db
+# report_alias). Nothing else is routed to it: the ORM (sessions, auth) and the
+# loaders keep using "default". Reports fall back to the primary while the
+# replica lags more than FPNA_REPLICA_MAX_LAG seconds (measured at most every
+# FPNA_REPLICA_LAG_CHECK_INTERVAL), is unreachable, or has not yet replayed
+# data the app has already seen on the primary.
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+# Size of the async views' replica pool; with the connection pool on it comes
+# out of the replica's worker share like FPNA_ASYNC_POOL_MAX_SIZE
+FPNA_ASYNC_REPLICA_POOL_MAX_SIZE = FPNA_ASYNC_POOL_MAX_SIZE
+if DATABASE_URL and DATABASE_REPLICA_URL:
+    DATABASES["replica"] = dj_database_url.parse(
+        DATABASE_REPLICA_URL, conn_max_age=DATABASES["default"]["CONN_MAX_AGE"]
+    )
+    DATABASES["replica"]["OPTIONS"] = dict(DATABASES["default"].get("OPTIONS", {}))
+    if "pool" in DATABASES["replica"]["OPTIONS"]:
+        replica_connections = int(os.getenv("FPNA_DB_REPLICA_MAX_CONNECTIONS", str(FPNA_DB_MAX_CONNECTIONS)))
+        replica_worker_connections = max(1, replica_connections // int(os.getenv("WEB_CONCURRENCY", "1")))
+        if os.getenv("FPNA_ASYNC_VIEWS", "0") == "1":
+            FPNA_ASYNC_REPLICA_POOL_MAX_SIZE = max(1, replica_worker_connections // 2)
+            replica_worker_connections = max(1, replica_worker_connections - FPNA_ASYNC_REPLICA_POOL_MAX_SIZE)
+        DATABASES["replica"]["OPTIONS"]["pool"] = {
+            **DATABASES["replica"]["OPTIONS"]["pool"],
+            "max_size": replica_worker_connections,
+        }
+    DATABASES["replica"]["TEST"] = {"MIRROR": "default"}
+FPNA_REPORT_DATABASE = "replica" if "replica" in DATABASES else "default"
+FPNA_REPLICA_MAX_LAG = float(os.getenv("FPNA_REPLICA_MAX_LAG", "30"))
+FPNA_REPLICA_LAG_CHECK_INTERVAL = float(os.getenv("FPNA_REPLICA_LAG_CHECK_INTERVAL", "5"))
+
+# --- Report queries ---
+# "ledger" aggregates gl_txn_raw at query time; "rollup" reads actuals from
+# public.gl_monthly_rollup, kept current by `manage.py refresh_gl_rollup`;
+# "resolved" reads the account-mapped rows of public.gl_txn_resolved, kept
+# current by `manage.py refresh_gl_resolved`.
+FPNA_ACTUALS_SOURCE = os.getenv("FPNA_ACTUALS_SOURCE", "ledger")
+
+# Months of actuals before, and of budget after, the session's current period
+# fetched in one go for a report; its columns are sliced from that window.
+FPNA_REPORT_TRAILING_MONTHS = int(os.getenv("FPNA_REPORT_TRAILING_MONTHS", "24"))
+FPNA_REPORT_HORIZON_MONTHS = int(os.getenv("FPNA_REPORT_HORIZON_MONTHS", "6"))
+
+# Independent report computations (one per company in an all-companies
+# export) run on up to FPNA_QUERY_WORKERS threads, each taking a connection
+# from the worker's pool, with a FPNA_QUERY_TIMEOUT-second statement_timeout.
+FPNA_QUERY_WORKERS = int(os.getenv("FPNA_QUERY_WORKERS", "4"))
+FPNA_QUERY_TIMEOUT = float(os.getenv("FPNA_QUERY_TIMEOUT", "30"))
+
+# In-process report result cache (per worker). Ranges that end before the
+# session's current month are closed and kept much longer than open ones.
+# While cache invalidation (below) is running, changed entries are evicted as
+# they change, so open ranges keep FPNA_CACHE_INVALIDATED_OPEN_TTL instead.
+# Set FPNA_CACHE_MAX_ENTRIES=0 to disable.
+FPNA_CACHE_MAX_ENTRIES = int(os.getenv("FPNA_CACHE_MAX_ENTRIES", "512"))
+FPNA_CACHE_CLOSED_TTL = int(os.getenv("FPNA_CACHE_CLOSED_TTL", str(24 * 60 * 60)))
+FPNA_CACHE_OPEN_TTL = int(os.getenv("FPNA_CACHE_OPEN_TTL", "60"))
+FPNA_CACHE_INVALIDATED_OPEN_TTL = int(os.getenv("FPNA_CACHE_INVALIDATED_OPEN_TTL", str(FPNA_CACHE_CLOSED_TTL)))
+
+# Cache invalidation (fpna_app.invalidation): "listen" evicts report cache
+# entries as NOTIFY triggers (`manage.py cache_invalidation --create`) report
+# ledger, budget and reference changes, polling every FPNA_CACHE_POLL_INTERVAL
+# seconds while LISTEN is unavailable and retrying it every
+# FPNA_CACHE_LISTEN_RETRY; "poll" only polls. Started per gunicorn worker.
+FPNA_CACHE_INVALIDATION = os.getenv("FPNA_CACHE_INVALIDATION", "off")
+FPNA_CACHE_POLL_INTERVAL = int(os.getenv("FPNA_CACHE_POLL_INTERVAL", "30"))
+FPNA_CACHE_LISTEN_RETRY = int(os.getenv("FPNA_CACHE_LISTEN_RETRY", "60"))
+
+# Conditional GET for the report views (fpna_app.conditional): their ETag
+# covers the company, periods, ledger/budget data version (re-read at most
+# every FPNA_DATA_VERSION_CHECK_INTERVAL seconds) and the deployed commit, so
+# an unchanged report is answered with a 304 before any finance.* query.
+FPNA_REPORT_ETAGS = os.getenv("FPNA_REPORT_ETAGS", "1") == "1"
+FPNA_DATA_VERSION_CHECK_INTERVAL = int(os.getenv("FPNA_DATA_VERSION_CHECK_INTERVAL", "5"))
+FPNA_ETAG_VERSION = os.getenv("FPNA_ETAG_VERSION", os.getenv("RENDER_GIT_COMMIT", ""))
+# 0-11; higher compresses smaller but slower (fpna_app.middleware.CompressionMiddleware)
+FPNA_BROTLI_QUALITY = int(os.getenv("FPNA_BROTLI_QUALITY", "5"))
+
+# Concurrent requests for the same report share one computation per worker.
+# Set FPNA_SINGLEFLIGHT_LOCK_DIR to a local directory to also coalesce across
+# the worker processes on a host. Results go only to processes already waiting
+# for them, and the files are removed after FPNA_SINGLEFLIGHT_SHARE_TTL s.
+# A worker that waits FPNA_SINGLEFLIGHT_TIMEOUT s for the lock computes on its
+# own; requests waiting on their worker's leader time out that long after it
+# starts computing.
+FPNA_SINGLEFLIGHT_LOCK_DIR = os.getenv("FPNA_SINGLEFLIGHT_LOCK_DIR")
+FPNA_SINGLEFLIGHT_SHARE_TTL = int(os.getenv("FPNA_SINGLEFLIGHT_SHARE_TTL", "30"))
+FPNA_SINGLEFLIGHT_TIMEOUT = int(os.getenv("FPNA_SINGLEFLIGHT_TIMEOUT", "120"))
+
+# Async deployment: run under ASGI (e.g. `gunicorn project.asgi:application -k
+# uvicorn.workers.UvicornWorker`) with FPNA_ASYNC_VIEWS=1 to serve the report
+# views asynchronously from a per-worker psycopg 3 connection pool.
+FPNA_ASYNC_VIEWS = os.getenv("FPNA_ASYNC_VIEWS", "0") == "1"
+FPNA_ASYNC_POOL_MIN_SIZE = int(os.getenv("FPNA_ASYNC_POOL_MIN_SIZE", "1"))
+# FPNA_ASYNC_POOL_MAX_SIZE comes out of the connection budget (see Database)
+# Seconds to wait for a free pooled connection before failing the request
+FPNA_ASYNC_POOL_TIMEOUT = float(os.getenv("FPNA_ASYNC_POOL_TIMEOUT", "30"))
+
+# Report warm-up (fpna_app.warmup): after a month roll, and optionally when a
+# gunicorn worker boots (see gunicorn.conf.py), every company's report is
+# computed in the background, FPNA_WARMUP_WORKERS at a time. A roll reaches
+# every worker only with FPNA_CACHE_INVALIDATION=listen; otherwise just the
+# worker that served it is warmed. A warmed report's closed months last
+# FPNA_CACHE_CLOSED_TTL; its open ones last FPNA_CACHE_INVALIDATED_OPEN_TTL
+# with cache invalidation on, and only FPNA_CACHE_OPEN_TTL without it.
+FPNA_WARMUP_ON_ROLL = os.getenv("FPNA_WARMUP_ON_ROLL", "1") == "1"
+FPNA_WARMUP_ON_BOOT = os.getenv("FPNA_WARMUP_ON_BOOT", "0") == "1"
+FPNA_WARMUP_WORKERS = int(os.getenv("FPNA_WARMUP_WORKERS", "2"))
+
+# Per-request instrumentation (fpna_app.timing): database calls, report
+# assembly and template rendering are reported in a Server-Timing header, and
+# requests slower than FPNA_SLOW_REQUEST_MS are logged as JSON lines to
+# FPNA_SLOW_REQUEST_LOG. Off by default; off costs next to nothing.
+FPNA_REQUEST_TIMING = os.getenv("FPNA_REQUEST_TIMING", "0") == "1"
+FPNA_SLOW_REQUEST_MS = float(os.getenv("FPNA_SLOW_REQUEST_MS", "500"))
+FPNA_SLOW_REQUEST_LOG = os.getenv("FPNA_SLOW_REQUEST_LOG", str(BASE_DIR / "server.log"))
+
+# On-demand profiling (fpna_app.profiling): with FPNA_PROFILING on, staff can
+# add ?profile=1 to a request to sample its stacks every
+# FPNA_PROFILE_INTERVAL_MS. At most FPNA_PROFILE_RATE_PER_MINUTE requests per
+# worker are profiled, and each worker keeps its last FPNA_PROFILE_BUFFER.
+FPNA_PROFILING = os.getenv("FPNA_PROFILING", "0") == "1"
+FPNA_PROFILE_INTERVAL_MS = float(os.getenv("FPNA_PROFILE_INTERVAL_MS", "5"))
+FPNA_PROFILE_RATE_PER_MINUTE = int(os.getenv("FPNA_PROFILE_RATE_PER_MINUTE", "6"))
+FPNA_PROFILE_BUFFER = int(os.getenv("FPNA_PROFILE_BUFFER", "20"))
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {"message": {"format": "%(message)s"}},
+    "handlers": {
+        "slow_requests": {
+            "class": "logging.FileHandler",
+            "filename": FPNA_SLOW_REQUEST_LOG,
+            "formatter": "message",
+            "delay": True,
+        },
+    },
+    "loggers": {
+        "fpna_app.slow_requests": {"handlers": ["slow_requests"], "level": "WARNING", "propagate": False},
+    },
+}
+
+# Seconds between version checks of the cached companies / account map /
+# metric definitions (fpna_app.reference)
+FPNA_REFERENCE_CHECK_INTERVAL = int(os.getenv("FPNA_REFERENCE_CHECK_INTERVAL", "30"))
+
 AUTH_PASSWORD_VALIDATORS = []
 
 LANGUAGE_CODE = "en-us"